@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangocourseproject.settings')
+# Под ASGI-сервером event loop живет весь процесс, поэтому кеш использует клиент redis.asyncio
+os.environ.setdefault('CACHE_ASYNC_CLIENT', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,453 @@
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from redis.exceptions import RedisError
+
+from djangocourseproject.cache.breaker import get_breaker
+from djangocourseproject.cache.local import INVALIDATE_ALL, INVALIDATE_KEY, INVALIDATE_PATTERN, get_tier
+from djangocourseproject.metrics import record_cache_lookup, registry
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+
+class SyncClientAdapter:
+    """Асинхронный интерфейс клиента redis поверх синхронного клиента и его пула"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return sync_to_async(getattr(self._client, name))
+
+    def pipeline(self, **kwargs):
+        return SyncPipelineAdapter(self._client.pipeline(**kwargs))
+
+
+class SyncPipelineAdapter:
+    """Pipeline для SyncClientAdapter: команды копятся синхронно, execute выполняется в потоке"""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._pipe.reset()
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    async def execute(self):
+        return await sync_to_async(self._pipe.execute)()
+
+
+class AsyncRedisCache(RedisCache):
+    """RedisCache с нативными async-методами.
+
+    Стандартный бэкенд выполняет aget/aset в отдельном потоке через sync_to_async,
+    здесь же используется redis.asyncio, поэтому асинхронные view не занимают поток
+    на каждое обращение к кешу. Формат ключей и сериализация совпадают с синхронной
+    версией, так что оба варианта читают и пишут одни и те же записи.
+
+    Клиент redis.asyncio привязан к event loop, поэтому он нужен только там, где
+    loop живет весь процесс, - под ASGI-сервером (OPTIONS['ASYNC_CLIENT'] = True,
+    его включает asgi.py). Под WSGI каждый асинхронный view выполняется в новом
+    loop, и отдельный клиент с пулом на каждый запрос только плодил бы соединения,
+    поэтому там используется общий синхронный пул через sync_to_async.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        self._native_async = options.pop('ASYNC_CLIENT', False)
+        super().__init__(server, {**params, 'OPTIONS': options})
+        # Асинхронный клиент привязан к event loop, поэтому храним по клиенту на каждый loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _get_async_client(self):
+        if not self._native_async:
+            return SyncClientAdapter(self._cache.get_client(write=True))
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import redis.asyncio
+
+            options = {
+                key: value for key, value in self._options.items()
+                if key not in ('serializer', 'pool_class', 'parser_class')
+            }
+            client = redis.asyncio.Redis.from_url(self._servers[0], **options)
+            self._async_clients[loop] = client
+        return client
+
+    @property
+    def _serializer(self):
+        return self._cache._serializer
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        record_cache_lookup(key, value is not _missing)
+        return default if value is _missing else value
+
+    def delete_pattern(self, pattern, version=None):
+        """Удаляет ключи по шаблону Redis (как в django-redis), возвращает их количество"""
+        client = self._cache.get_client(write=True)
+        keys = list(client.scan_iter(match=self.make_key(pattern, version=version), count=1000))
+        if keys:
+            client.delete(*keys)
+        return len(keys)
+
+    async def aget(self, key, default=None, version=None):
+        value = await self._get_async_client().get(self.make_and_validate_key(key, version=version))
+        record_cache_lookup(key, value is not None)
+        return default if value is None else self._serializer.loads(value)
+
+    async def aget_many(self, keys, version=None):
+        if not keys:
+            return {}
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        values = await self._get_async_client().mget(list(key_map))
+        return {
+            key_map[key]: self._serializer.loads(value)
+            for key, value in zip(key_map, values) if value is not None
+        }
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        client = self._get_async_client()
+        if timeout == 0:
+            await client.delete(key)
+        else:
+            await client.set(key, self._serializer.dumps(value), ex=timeout)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        client = self._get_async_client()
+        if timeout == 0:
+            if added := bool(await client.set(key, self._serializer.dumps(value), nx=True)):
+                await client.delete(key)
+            return added
+        return bool(await client.set(key, self._serializer.dumps(value), ex=timeout, nx=True))
+
+    async def adelete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(await self._get_async_client().delete(key))
+
+    async def adelete_many(self, keys, version=None):
+        if not keys:
+            return
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        await self._get_async_client().delete(*keys)
+
+    async def ahas_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(await self._get_async_client().exists(key))
+
+
+class TieredRedisCache(AsyncRedisCache):
+    """AsyncRedisCache с локальным LRU процесса перед Redis для горячих ключей.
+
+    Политики задаются в OPTIONS['LOCAL']: MAX_ENTRIES - размер LRU, POLICIES -
+    словарь {префикс ключа: сколько секунд держать значение в памяти}. Ключи без
+    политики читаются из Redis как обычно. Запись и удаление ключей с политикой
+    публикуются в канал Redis, по которому каждый процесс чистит свою память.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        local = options.pop('LOCAL', {})
+        super().__init__(server, {**params, 'OPTIONS': options})
+        self._tier = get_tier(
+            self._servers[0],
+            self.make_key('local_cache_invalidation'),
+            local.get('MAX_ENTRIES', 10000),
+            local.get('POLICIES', {}),
+        )
+
+    def local_stats(self):
+        return self._tier.stats()
+
+    def _local_keys(self, keys, version):
+        return [self.make_and_validate_key(key, version=version) for key in keys if self._tier.ttl(key) is not None]
+
+    def _invalidate(self, messages):
+        for message in messages:
+            self._tier.handle(message)
+        if messages:
+            with self._cache.get_client(write=True).pipeline(transaction=False) as pipe:
+                for message in messages:
+                    pipe.publish(self._tier.channel, message)
+                pipe.execute()
+
+    async def _ainvalidate(self, messages):
+        for message in messages:
+            self._tier.handle(message)
+        if messages:
+            async with self._get_async_client().pipeline(transaction=False) as pipe:
+                for message in messages:
+                    pipe.publish(self._tier.channel, message)
+                await pipe.execute()
+
+    def invalidate_local(self, keys, version=None):
+        """Убирает ключи из памяти всех процессов"""
+        self._invalidate([INVALIDATE_KEY + key for key in self._local_keys(keys, version)])
+
+    async def ainvalidate_local(self, keys, version=None):
+        await self._ainvalidate([INVALIDATE_KEY + key for key in self._local_keys(keys, version)])
+
+    def get(self, key, default=None, version=None):
+        ttl = self._tier.ttl(key)
+        if ttl is None:
+            return super().get(key, default, version)
+        full_key = self.make_and_validate_key(key, version=version)
+        raw, epoch = self._tier.get(key, full_key)
+        if raw is None:
+            raw = self._cache.get_client(full_key).get(full_key)
+            if raw is not None:
+                self._tier.set(full_key, raw, ttl, epoch)
+        record_cache_lookup(key, raw is not None)
+        return default if raw is None else self._serializer.loads(raw)
+
+    async def aget(self, key, default=None, version=None):
+        ttl = self._tier.ttl(key)
+        if ttl is None:
+            return await super().aget(key, default, version)
+        full_key = self.make_and_validate_key(key, version=version)
+        raw, epoch = self._tier.get(key, full_key)
+        if raw is None:
+            raw = await self._get_async_client().get(full_key)
+            if raw is not None:
+                self._tier.set(full_key, raw, ttl, epoch)
+        record_cache_lookup(key, raw is not None)
+        return default if raw is None else self._serializer.loads(raw)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        self.invalidate_local([key], version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if added:
+            self.invalidate_local([key], version)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version)
+        self.invalidate_local(list(data), version)
+        return failed
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        self.invalidate_local([key], version)
+        return value
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version)
+        self.invalidate_local([key], version)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version)
+        self.invalidate_local(keys, version)
+
+    def delete_pattern(self, pattern, version=None):
+        count = super().delete_pattern(pattern, version)
+        self._invalidate([INVALIDATE_PATTERN + self.make_key(pattern, version=version)])
+        return count
+
+    def clear(self):
+        cleared = super().clear()
+        self._invalidate([INVALIDATE_ALL])
+        return cleared
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        await super().aset(key, value, timeout, version)
+        await self.ainvalidate_local([key], version)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = await super().aadd(key, value, timeout, version)
+        if added:
+            await self.ainvalidate_local([key], version)
+        return added
+
+    async def adelete(self, key, version=None):
+        deleted = await super().adelete(key, version)
+        await self.ainvalidate_local([key], version)
+        return deleted
+
+    async def adelete_many(self, keys, version=None):
+        await super().adelete_many(keys, version)
+        await self.ainvalidate_local(keys, version)
+
+
+class ResilientRedisCache(TieredRedisCache):
+    """TieredRedisCache, который при сбоях Redis переключается на запасной бэкенд.
+
+    Параметры в OPTIONS['CIRCUIT']: FAILURE_THRESHOLD - ошибок подряд до
+    переключения, RESET_TIMEOUT - через сколько секунд снова пробовать Redis,
+    FALLBACK - 'locmem' (память процесса, MAX_ENTRIES записей) или 'dummy'
+    (кеш выключен). Таймауты сокета задаются параметрами клиента redis в OPTIONS:
+    без них зависший Redis все равно будет держать запрос.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        circuit = options.pop('CIRCUIT', {})
+        super().__init__(server, {**params, 'OPTIONS': options})
+        self._breaker = get_breaker(
+            self._tier.channel,
+            circuit.get('FAILURE_THRESHOLD', 3),
+            circuit.get('RESET_TIMEOUT', 10),
+        )
+        fallback_params = {
+            key: value for key, value in params.items()
+            if key in ('TIMEOUT', 'KEY_PREFIX', 'VERSION', 'KEY_FUNCTION')
+        }
+        if circuit.get('FALLBACK', 'locmem') == 'dummy':
+            self._fallback = DummyCache(None, fallback_params)
+        else:
+            fallback_params['OPTIONS'] = {'MAX_ENTRIES': circuit.get('MAX_ENTRIES', 1000)}
+            self._fallback = LocMemCache(self._tier.channel, fallback_params)
+
+    def redis_available(self):
+        """Обращается ли кеш сейчас к Redis"""
+        return not self._breaker.is_open()
+
+    def _failed(self, operation, error):
+        self._breaker.record_failure()
+        registry.inc('cache_errors_total', {'operation': operation})
+        logger.warning("Ошибка Redis (%s): %s", operation, error)
+
+    def _use_fallback(self, operation, keys, version):
+        registry.inc('cache_fallback_total', {'operation': operation})
+        if keys is not None:
+            self._breaker.remember_keys(keys, version)
+
+    def _call(self, operation, args, keys=None, version=None, fallback=None):
+        if self._breaker.allow():
+            try:
+                if self._breaker.needs_replay():
+                    self._replay()
+                result = getattr(super(), operation)(*args)
+            except RedisError as error:
+                self._failed(operation, error)
+            else:
+                self._breaker.record_success()
+                return result
+        self._use_fallback(operation, keys, version)
+        return (fallback or getattr(self._fallback, operation))(*args)
+
+    async def _acall(self, operation, args, keys=None, version=None):
+        if self._breaker.allow():
+            try:
+                if self._breaker.needs_replay():
+                    await sync_to_async(self._replay)()
+                result = await getattr(super(), operation)(*args)
+            except RedisError as error:
+                self._failed(operation, error)
+            else:
+                self._breaker.record_success()
+                return result
+        self._use_fallback(operation, keys, version)
+        # Запасные бэкенды не ходят в сеть, их синхронные методы не блокируют event loop
+        return getattr(self._fallback, operation[1:])(*args)
+
+    def _replay(self):
+        """Удаляет из Redis ключи, измененные за время сбоя, и очищает запасной бэкенд"""
+        keys, patterns, clear = self._breaker.take_pending()
+        if not (keys or patterns or clear):
+            return
+        try:
+            if clear:
+                super().clear()
+            else:
+                by_version = defaultdict(list)
+                for key, version in keys:
+                    by_version[version].append(key)
+                for version, version_keys in by_version.items():
+                    super().delete_many(version_keys, version)
+                for pattern, version in patterns:
+                    super().delete_pattern(pattern, version)
+        except RedisError:
+            self._breaker.restore_pending(keys, patterns, clear)
+            raise
+        self._fallback.clear()
+        logger.warning("Redis снова доступен, сброшено ключей после сбоя: %s", len(keys))
+
+    def get(self, key, default=None, version=None):
+        return self._call('get', (key, default, version))
+
+    def get_many(self, keys, version=None):
+        return self._call('get_many', (keys, version))
+
+    def has_key(self, key, version=None):
+        return self._call('has_key', (key, version))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._call('set', (key, value, timeout, version), [key], version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._call('add', (key, value, timeout, version), [key], version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._call('set_many', (data, timeout, version), list(data), version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._call('touch', (key, timeout, version), [key], version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._call('incr', (key, delta, version), [key], version)
+
+    def delete(self, key, version=None):
+        return self._call('delete', (key, version), [key], version)
+
+    def delete_many(self, keys, version=None):
+        return self._call('delete_many', (keys, version), list(keys), version)
+
+    def delete_pattern(self, pattern, version=None):
+        return self._call('delete_pattern', (pattern, version), fallback=self._fallback_delete_pattern)
+
+    def _fallback_delete_pattern(self, pattern, version=None):
+        self._breaker.remember_pattern(pattern, version)
+        # Запасной бэкенд не умеет удалять по шаблону - очищаем его целиком
+        self._fallback.clear()
+        return 0
+
+    def clear(self):
+        return self._call('clear', (), fallback=self._fallback_clear)
+
+    def _fallback_clear(self):
+        self._breaker.remember_clear()
+        return self._fallback.clear()
+
+    async def aget(self, key, default=None, version=None):
+        return await self._acall('aget', (key, default, version))
+
+    async def aget_many(self, keys, version=None):
+        return await self._acall('aget_many', (keys, version))
+
+    async def ahas_key(self, key, version=None):
+        return await self._acall('ahas_key', (key, version))
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await self._acall('aset', (key, value, timeout, version), [key], version)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await self._acall('aadd', (key, value, timeout, version), [key], version)
+
+    async def adelete(self, key, version=None):
+        return await self._acall('adelete', (key, version), [key], version)
+
+    async def adelete_many(self, keys, version=None):
+        return await self._acall('adelete_many', (keys, version), list(keys), version)
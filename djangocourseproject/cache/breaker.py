@@ -0,0 +1,122 @@
+"""
+Автоматический выключатель (circuit breaker) для Redis.
+
+После FAILURE_THRESHOLD ошибок подряд выключатель размыкается, и кеш на
+RESET_TIMEOUT секунд переходит на запасной бэкенд, не обращаясь к Redis.
+Затем один запрос проверяет Redis: при успехе выключатель замыкается, при
+ошибке размыкается снова.
+
+Пока Redis недоступен, изменения попадают только в запасной бэкенд, поэтому
+ключи, которые успели записать или удалить, после восстановления удаляются
+из Redis - иначе там остались бы значения, устаревшие за время сбоя.
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Сколько изменений за время сбоя запоминаем; при переполнении после восстановления очищаем весь кеш
+MAX_PENDING_KEYS = 10000
+
+# Выключатели общие для всех потоков процесса
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+        # Ключи (ключ, версия) и шаблоны, измененные за время сбоя
+        self.pending_keys = set()
+        self.pending_patterns = set()
+        self.pending_clear = False
+        self.has_pending = False
+
+    def allow(self):
+        """Можно ли сейчас обращаться к Redis"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Пробный запрос. Если он не завершится, следующий разрешим через reset_timeout
+            self.state = HALF_OPEN
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+
+    def needs_replay(self):
+        """Нужно ли перед обращением к Redis сбросить ключи, измененные за время сбоя"""
+        return self.state == HALF_OPEN or self.has_pending
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    def remember_keys(self, keys, version):
+        with self._lock:
+            self.pending_keys.update((key, version) for key in keys)
+            self.has_pending = True
+            if len(self.pending_keys) > MAX_PENDING_KEYS:
+                self.pending_keys.clear()
+                self.pending_clear = True
+
+    def remember_pattern(self, pattern, version):
+        with self._lock:
+            self.pending_patterns.add((pattern, version))
+            self.has_pending = True
+
+    def remember_clear(self):
+        with self._lock:
+            self.pending_clear = True
+            self.has_pending = True
+
+    def take_pending(self):
+        """(ключи, шаблоны, очистить ли кеш целиком), накопленные за время сбоя"""
+        with self._lock:
+            pending = self.pending_keys, self.pending_patterns, self.pending_clear
+            self.pending_keys, self.pending_patterns, self.pending_clear = set(), set(), False
+            self.has_pending = False
+        return pending
+
+    def restore_pending(self, keys, patterns, clear):
+        with self._lock:
+            self.pending_keys |= keys
+            self.pending_patterns |= patterns
+            self.pending_clear = self.pending_clear or clear
+            self.has_pending = bool(self.pending_keys or self.pending_patterns or self.pending_clear)
+
+    def is_open(self):
+        return self.state != CLOSED
+
+
+def get_breaker(name, failure_threshold, reset_timeout):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(failure_threshold, reset_timeout)
+        return breaker
+
+
+def circuit_breakers():
+    return dict(_breakers)
@@ -0,0 +1,189 @@
+"""
+Локальный уровень кеша в памяти процесса.
+
+Хранит сериализованные значения горячих ключей Redis, чтобы повторные чтения
+не ходили в сеть. Записи живут не дольше TTL своей политики и вытесняются по LRU.
+Изменения из других процессов приходят через pub/sub Redis: пока подписка
+не работает, локальный уровень не используется совсем.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+import redis
+from redis.exceptions import RedisError
+
+from djangocourseproject.metrics import cache_key_prefix, registry
+
+# Пауза перед повторной подпиской после ошибки Redis (секунды)
+RESUBSCRIBE_DELAY = 1
+
+# Формат сообщений об инвалидации: первый символ - тип, дальше ключ или шаблон
+INVALIDATE_KEY = 'k'
+INVALIDATE_PATTERN = 'p'
+INVALIDATE_ALL = '*'
+
+# Локальные уровни общие для всех потоков процесса: бэкенд кеша создается на каждый поток
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalLRU:
+    """Ограниченный по размеру LRU с временем жизни записей, потокобезопасный"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Растет при каждой инвалидации, см. LocalTier.get
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] <= time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl, epoch):
+        with self._lock:
+            # Пока значение читалось из Redis, его могли изменить - такое не сохраняем
+            if epoch != self.epoch:
+                return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self.epoch += 1
+            self._data.pop(key, None)
+
+    def invalidate_pattern(self, pattern):
+        with self._lock:
+            self.epoch += 1
+            for key in [key for key in self._data if fnmatchcase(key, pattern)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._data.clear()
+
+
+class LocalTier:
+    """LRU процесса и подписка на инвалидации от остальных процессов"""
+
+    def __init__(self, server, channel, max_entries, policies):
+        self.server = server
+        self.channel = channel
+        # Префикс ключа -> сколько секунд держать значение в памяти
+        self.policies = sorted(policies.items(), key=lambda item: len(item[0]), reverse=True)
+        self.lru = LocalLRU(max_entries)
+        self.subscribed = False
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ttl(self, key):
+        """Время жизни ключа в памяти процесса или None, если ключ там не хранится"""
+        for prefix, ttl in self.policies:
+            if key.startswith(prefix):
+                return ttl
+        return None
+
+    def get(self, key, full_key):
+        """(значение, epoch): значение None означает промах, epoch передается в set"""
+        self.ensure_listener()
+        epoch = self.lru.epoch
+        if not self.subscribed:
+            return None, epoch
+        value = self.lru.get(full_key)
+        registry.inc(
+            'cache_local_requests_total',
+            {'prefix': cache_key_prefix(key), 'result': 'miss' if value is None else 'hit'},
+        )
+        return value, epoch
+
+    def set(self, full_key, value, ttl, epoch):
+        if self.subscribed:
+            self.lru.set(full_key, value, ttl, epoch)
+
+    def ensure_listener(self):
+        if self._pid == os.getpid() and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork поток подписки остался в родительском процессе
+                self.subscribed = False
+                self.lru.clear()
+            if self._pid != os.getpid() or not self._listener.is_alive():
+                self._pid = os.getpid()
+                self._listener = threading.Thread(target=self.listen, name='local-cache-invalidation', daemon=True)
+                self._listener.start()
+
+    def listen(self):
+        client = redis.Redis.from_url(self.server)
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Пока подписки не было, сообщения могли потеряться
+                self.lru.clear()
+                self.subscribed = True
+                for message in pubsub.listen():
+                    self.handle(message['data'].decode())
+            except RedisError:
+                pass
+            finally:
+                self.subscribed = False
+                self.lru.clear()
+            time.sleep(RESUBSCRIBE_DELAY)
+
+    def handle(self, message):
+        kind, target = message[:1], message[1:]
+        if kind == INVALIDATE_KEY:
+            self.lru.invalidate(target)
+        elif kind == INVALIDATE_PATTERN:
+            self.lru.invalidate_pattern(target)
+        else:
+            self.lru.clear()
+
+    def stats(self):
+        lookups = self.lru.hits + self.lru.misses
+        return {
+            'entries': len(self.lru),
+            'hits': self.lru.hits,
+            'misses': self.lru.misses,
+            'evictions': self.lru.evictions,
+            'hit_rate': self.lru.hits / lookups if lookups else 0.0,
+            'subscribed': self.subscribed,
+        }
+
+
+def get_tier(server, channel, max_entries, policies):
+    with _tiers_lock:
+        tier = _tiers.get(channel)
+        if tier is None:
+            tier = _tiers[channel] = LocalTier(server, channel, max_entries, policies)
+        return tier
+
+
+def local_tiers():
+    return dict(_tiers)
@@ -0,0 +1,77 @@
+"""
+Компактный сериализатор значений кеша.
+
+Первый байт записи - формат: msgpack для простых значений (словари, списки,
+кортежи, строки, числа, даты с часовым поясом), pickle для всего остального. Записи
+больше COMPRESS_MIN_SIZE байт сжимаются zlib. Записи без заголовка, оставшиеся
+от стандартного RedisSerializer, читаются как pickle.
+"""
+import pickle
+import zlib
+
+import msgpack
+
+# Сжимаем записи начиная с этого размера (байты)
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+MSGPACK = b'm'
+MSGPACK_ZLIB = b'M'
+PICKLE = b'p'
+PICKLE_ZLIB = b'P'
+
+# Код расширения msgpack для кортежей: сам msgpack их не отличает от списков
+TUPLE_EXT = 1
+
+
+def pack(obj):
+    # strict_types: подклассы (namedtuple, SafeString и т.п.) уходят в pickle, а не теряют тип
+    return msgpack.packb(obj, use_bin_type=True, datetime=True, strict_types=True, default=pack_ext)
+
+
+def pack_ext(obj):
+    if type(obj) is tuple:
+        return msgpack.ExtType(TUPLE_EXT, pack(list(obj)))
+    raise TypeError(f'{type(obj).__name__} не поддерживается msgpack')
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False, timestamp=3, strict_map_key=False, ext_hook=unpack_ext)
+
+
+def unpack_ext(code, data):
+    if code == TUPLE_EXT:
+        return tuple(unpack(data))
+    return msgpack.ExtType(code, data)
+
+
+class CompactSerializer:
+    """Сериализатор для OPTIONS['serializer'] бэкенда RedisCache"""
+
+    def dumps(self, obj):
+        # Целые числа храним как есть, иначе не будут работать incr/decr
+        if type(obj) is int:
+            return obj
+        try:
+            header, data = MSGPACK, pack(obj)
+        except (TypeError, ValueError, OverflowError):
+            header, data = PICKLE, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if len(data) >= COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(data, COMPRESS_LEVEL)
+            if len(compressed) < len(data):
+                header, data = header.upper(), compressed
+        return header + data
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+        header, payload = data[:1], data[1:]
+        if header in (MSGPACK_ZLIB, PICKLE_ZLIB):
+            payload = zlib.decompress(payload)
+        if header in (MSGPACK, MSGPACK_ZLIB):
+            return unpack(payload)
+        if header in (PICKLE, PICKLE_ZLIB):
+            return pickle.loads(payload)
+        return pickle.loads(data)
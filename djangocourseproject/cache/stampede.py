@@ -0,0 +1,124 @@
+"""
+Защита от лавины пересчетов при истечении горячих ключей.
+
+В кеше хранится запись (значение, время пересчета, срок свежести). Физически
+запись живет дольше срока свежести на stale_timeout секунд, поэтому:
+
+* пересчет выполняет только тот, кто взял блокировку (cache.add), остальные
+  получают устаревшее значение, а не идут в БД;
+* чем ближе истечение и чем дольше пересчет, тем выше шанс, что один из запросов
+  обновит значение заранее (вероятностное раннее истечение, XFetch);
+* если записи нет совсем, запросы без блокировки недолго ждут результата пересчета.
+"""
+import asyncio
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+# Сколько секунд устаревшее значение еще можно отдавать
+STALE_TIMEOUT = 60
+# Время жизни блокировки пересчета (секунды), на случай если пересчитывающий процесс упадет
+LOCK_TIMEOUT = 30
+# Как долго ждать чужого пересчета, если значения нет совсем
+WAIT_TIMEOUT = 3
+WAIT_INTERVAL = 0.05
+# Коэффициент раннего истечения: больше 1 - пересчитываем раньше
+BETA = 1.0
+
+
+def lock_key(key):
+    return f"{key}_lock"
+
+
+def as_entry(value):
+    """Запись из кеша или None, если по ключу лежит что-то другое.
+
+    До перехода на записи по тем же ключам хранились сами значения (словари,
+    QuerySet); их считаем промахом, и ключ перезаписывается в новом формате.
+    """
+    if type(value) is tuple and len(value) == 3 and isinstance(value[2], float):
+        return value
+    return None
+
+
+def is_fresh(entry, beta=BETA):
+    """Свежая ли запись с учетом вероятностного раннего истечения"""
+    _, delta, expires_at = entry
+    # -log(random()) > 0, поэтому чем больше delta, тем раньше запись считается устаревшей
+    return time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at
+
+
+def make_entry(value, delta, timeout):
+    return value, delta, time.time() + timeout
+
+
+def get_or_compute(key, compute, timeout, stale_timeout=STALE_TIMEOUT, beta=BETA):
+    """Значение из кеша или результат compute(), пересчитываемый одним процессом"""
+    entry = as_entry(cache.get(key))
+    if entry is not None and is_fresh(entry, beta):
+        return entry[0]
+
+    locked = cache.add(lock_key(key), 1, LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            # Пересчитывает кто-то другой - отдаем устаревшее значение
+            return entry[0]
+        entry = wait_for_entry(key)
+        if entry is not None:
+            return entry[0]
+        # Не дождались - считаем сами, но чужую блокировку не трогаем
+
+    try:
+        start = time.monotonic()
+        value = compute()
+        cache.set(key, make_entry(value, time.monotonic() - start, timeout), timeout + stale_timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key(key))
+
+
+def wait_for_entry(key):
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = as_entry(cache.get(key))
+        if entry is not None:
+            return entry
+    return None
+
+
+async def aget_or_compute(key, compute, timeout, stale_timeout=STALE_TIMEOUT, beta=BETA):
+    """Асинхронный вариант get_or_compute, compute - корутинная функция"""
+    entry = as_entry(await cache.aget(key))
+    if entry is not None and is_fresh(entry, beta):
+        return entry[0]
+
+    locked = await cache.aadd(lock_key(key), 1, LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            return entry[0]
+        entry = await await_entry(key)
+        if entry is not None:
+            return entry[0]
+
+    try:
+        start = time.monotonic()
+        value = await compute()
+        await cache.aset(key, make_entry(value, time.monotonic() - start, timeout), timeout + stale_timeout)
+        return value
+    finally:
+        if locked:
+            await cache.adelete(lock_key(key))
+
+
+async def await_entry(key):
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(WAIT_INTERVAL)
+        entry = as_entry(await cache.aget(key))
+        if entry is not None:
+            return entry
+    return None
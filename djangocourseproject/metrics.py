@@ -0,0 +1,227 @@
+"""
+Метрики приложения в формате Prometheus.
+
+Значения копятся в памяти процесса и раз в METRICS_FLUSH_INTERVAL секунд
+сбрасываются в Redis (HINCRBYFLOAT в общий хеш), поэтому /metrics показывает
+сумму по всем воркерам. Если кеш не Redis, метрики остаются только в процессе.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from redis.exceptions import RedisError
+
+# Границы корзин гистограмм (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# Описание метрик: имя -> (тип, описание)
+METRICS = {
+    'http_requests_total': ('counter', 'Количество запросов'),
+    'http_request_duration_seconds': ('histogram', 'Время обработки запроса'),
+    'http_response_size_bytes_total': ('counter', 'Суммарный размер ответов'),
+    'db_queries_per_request': ('histogram', 'Количество SQL-запросов на один HTTP-запрос'),
+    'db_query_duration_seconds_total': ('counter', 'Суммарное время SQL-запросов'),
+    'db_query_budget_exceeded_total': ('counter', 'Запросы, превысившие бюджет SQL-запросов'),
+    'cache_requests_total': ('counter', 'Обращения к кешу по префиксу ключа'),
+    'cache_local_requests_total': ('counter', 'Обращения к памяти процесса перед Redis по префиксу ключа'),
+    'cache_errors_total': ('counter', 'Ошибки Redis по операциям кеша'),
+    'cache_fallback_total': ('counter', 'Операции кеша, выполненные запасным бэкендом'),
+    'mailing_stage_duration_seconds': ('histogram', 'Время этапов отправки рассылки'),
+}
+
+METRICS_REDIS_KEY = 'metrics_samples'
+
+# Семейства ключей кеша для метки prefix. Остальные ключи считаются как other,
+# чтобы число значений метки не росло вместе с числом пользователей и страниц
+CACHE_KEY_FAMILIES = (
+    'user_roles', 'user_home_stats', 'users_stats', 'users_list_managers',
+    'receivers_list', 'messages_list', 'mailings_list',
+)
+# Ключи cache_page содержат URL, язык и часовой пояс - считаем их одним семейством
+CACHE_PAGE_KEY_PREFIX = 'views.decorators.cache.'
+
+_key_ids = re.compile(r'_\d+(?=_|$)')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы процесса, потокобезопасные"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(float)
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name, labels=None, value=1):
+        sample = name + format_labels(labels)
+        with self._lock:
+            self._pending[sample] += value
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        labels = labels or {}
+        updates = [(name + '_sum' + format_labels(labels), value), (name + '_count' + format_labels(labels), 1)]
+        # Корзины накопительные: значение попадает во все корзины с le >= value
+        for bound in buckets[bisect_left(buckets, value):] + (float('inf'),):
+            updates.append((name + '_bucket' + format_labels({**labels, 'le': format_le(bound)}), 1))
+        with self._lock:
+            for sample, delta in updates:
+                self._pending[sample] += delta
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed_at = time.monotonic()
+        return pending
+
+    def flush(self):
+        """Переносит накопленные значения в Redis. Без Redis значения остаются в процессе"""
+        client = get_redis_client()
+        if client is None:
+            return
+        pending = self.take_pending()
+        if not pending:
+            return
+        pipeline = client.pipeline(transaction=False)
+        for sample, value in pending.items():
+            pipeline.hincrbyfloat(cache.make_key(METRICS_REDIS_KEY), sample, value)
+        try:
+            pipeline.execute()
+        except RedisError:
+            # Redis недоступен: возвращаем значения, чтобы сбросить их в следующий раз
+            with self._lock:
+                for sample, value in pending.items():
+                    self._pending[sample] += value
+
+    def flush_if_due(self):
+        if time.monotonic() - self._flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def samples(self):
+        """Текущие значения: сумма по всем воркерам из Redis плюс несброшенные значения процесса"""
+        self.flush()
+        samples = defaultdict(float)
+        client = get_redis_client()
+        if client is not None:
+            try:
+                stored = client.hgetall(cache.make_key(METRICS_REDIS_KEY))
+            except RedisError:
+                # Redis недоступен: показываем хотя бы значения этого процесса
+                stored = {}
+            for sample, value in stored.items():
+                samples[sample.decode()] += float(value)
+        with self._lock:
+            for sample, value in self._pending.items():
+                samples[sample] += value
+        return samples
+
+
+registry = MetricsRegistry()
+
+
+def get_redis_client():
+    """Клиент Redis из настроек кеша или None, если кеш не Redis или Redis недоступен"""
+    backend = getattr(cache, '_cache', None)
+    if backend is None or not hasattr(backend, 'get_client'):
+        return None
+    # Пока кеш работает через запасной бэкенд, не ждем таймаутов Redis и здесь
+    if not getattr(cache, 'redis_available', lambda: True)():
+        return None
+    return backend.get_client(write=True)
+
+
+def cache_key_prefix(key):
+    """Семейство ключа без идентификаторов: user_home_stats_15_lock -> user_home_stats_lock"""
+    key = str(key)
+    if key.startswith(CACHE_PAGE_KEY_PREFIX):
+        return 'cache_page'
+    family = _key_ids.sub('', key)
+    return family if family.removesuffix('_lock') in CACHE_KEY_FAMILIES else 'other'
+
+
+def record_cache_lookup(key, hit):
+    registry.inc('cache_requests_total', {'prefix': cache_key_prefix(key), 'result': 'hit' if hit else 'miss'})
+
+
+def record_request(view, method, status, duration, response_size, queries, query_time):
+    labels = {'view': view}
+    registry.inc('http_requests_total', {**labels, 'method': method, 'status': status})
+    registry.observe('http_request_duration_seconds', duration, labels)
+    registry.observe('db_queries_per_request', queries, labels, buckets=QUERY_COUNT_BUCKETS)
+    registry.inc('db_query_duration_seconds_total', labels, query_time)
+    if response_size:
+        registry.inc('http_response_size_bytes_total', labels, response_size)
+
+
+def sample_family(sample):
+    """Имя метрики, к которой относится строка: http_request_duration_seconds_bucket -> http_request_duration_seconds"""
+    name = sample.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and METRICS.get(name[:-len(suffix)], ('',))[0] == 'histogram':
+            return name[:-len(suffix)]
+    return name
+
+
+def sample_sort_key(sample):
+    # Корзины гистограммы должны идти по возрастанию le
+    match = re.search(r'le="([^"]+)"', sample)
+    le = float(match.group(1)) if match else 0
+    return sample_family(sample), re.sub(r',?le="[^"]+"', '', sample), le
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus(samples, gauges=None):
+    """Текст в формате Prometheus exposition"""
+    lines = []
+    family = None
+    for sample in sorted(samples, key=sample_sort_key):
+        current = sample_family(sample)
+        if current != family:
+            family = current
+            kind, description = METRICS.get(family, ('untyped', ''))
+            lines.append(f'# HELP {family} {description}')
+            lines.append(f'# TYPE {family} {kind}')
+        lines.append(f'{sample} {format_value(samples[sample])}')
+
+    for name, (description, values) in (gauges or {}).items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in values:
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryCounter:
+    """execute_wrapper, который считает SQL-запросы и их время"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
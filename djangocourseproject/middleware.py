@@ -0,0 +1,130 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from djangocourseproject import metrics
+from djangocourseproject.routers import current_routing, get_replica_aliases, routing
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение с реплик для view с атрибутом use_replica = True.
+
+    После запроса, изменяющего данные, пользователь получает cookie и на
+    REPLICA_PIN_SECONDS закрепляется за основной базой, чтобы сразу видеть свои изменения.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing(pinned=self.is_pinned(request)):
+            response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        with routing(pinned=self.is_pinned(request)):
+            response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', view_func)
+        state = current_routing()
+        if state is not None and request.method in SAFE_METHODS:
+            # Состояние - изменяемый объект, поэтому флаг виден и в потоке sync_to_async
+            state.use_replica = getattr(view_class, 'use_replica', False)
+        return None
+
+    def is_pinned(self, request):
+        return request.method not in SAFE_METHODS or settings.REPLICA_PIN_COOKIE in request.COOKIES
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and get_replica_aliases():
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+def use_replica(view_func):
+    """Декоратор для функций-view, которым можно читать с реплики"""
+    view_func.use_replica = True
+    return view_func
+
+
+class MetricsMiddleware:
+    """Собирает время ответа, число и время SQL-запросов и размер ответа по каждой view.
+
+    Запросы, выполнившие больше QUERY_BUDGET SQL-запросов, попадают в лог
+    и в счетчик db_query_budget_exceeded_total.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = metrics.QueryCounter()
+        start = time.perf_counter()
+        self.install(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.uninstall(counter)
+        self.record(request, response, counter, time.perf_counter() - start)
+        metrics.registry.flush_if_due()
+        return response
+
+    async def __acall__(self, request):
+        counter = metrics.QueryCounter()
+        start = time.perf_counter()
+        # Асинхронные view ходят в БД из потока sync_to_async, соединения там свои
+        await sync_to_async(self.install)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(self.uninstall)(counter)
+        self.record(request, response, counter, time.perf_counter() - start)
+        await sync_to_async(metrics.registry.flush_if_due, thread_sensitive=False)()
+        return response
+
+    def install(self, counter):
+        for conn in connections.all():
+            conn.execute_wrappers.append(counter)
+
+    def uninstall(self, counter):
+        for conn in connections.all():
+            if counter in conn.execute_wrappers:
+                conn.execute_wrappers.remove(counter)
+
+    def record(self, request, response, counter, duration):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        metrics.record_request(
+            view, request.method, response.status_code, duration, size, counter.count, counter.duration,
+        )
+        if counter.count > settings.QUERY_BUDGET:
+            metrics.registry.inc('db_query_budget_exceeded_total', {'view': view})
+            logger.warning(
+                'Превышен бюджет SQL-запросов: %s %s (%s) - %d запросов, %.1f мс',
+                request.method, request.path, view, counter.count, counter.duration * 1000,
+            )
@@ -0,0 +1,118 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Запрос отставания реплики в секундах. На мастере (или на обычной базе) возвращает 0
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Как часто перепроверять реплику (секунды)
+REPLICA_CHECK_INTERVAL = 5
+
+_routing_state = ContextVar('db_routing_state', default=None)
+_replica_health = {}
+
+
+class RoutingState:
+    """Состояние маршрутизации для текущего запроса или блока кода"""
+
+    def __init__(self, use_replica=False, pinned=False):
+        self.use_replica = use_replica
+        self.pinned = pinned
+
+
+def get_replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def replica_lag(alias):
+    """Отставание реплики в секундах, None если реплика недоступна"""
+    conn = connections[alias]
+    if conn.vendor != 'postgresql':
+        return 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        return None
+
+
+def replica_is_healthy(alias):
+    """Реплика доступна и отстает не больше REPLICA_MAX_LAG_SECONDS.
+
+    Результат проверки хранится в памяти процесса REPLICA_CHECK_INTERVAL секунд,
+    чтобы не добавлять лишний запрос к каждому чтению.
+    """
+    now = time.monotonic()
+    cached = _replica_health.get(alias)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    lag = replica_lag(alias)
+    healthy = lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+    _replica_health[alias] = (now + REPLICA_CHECK_INTERVAL, healthy)
+    return healthy
+
+
+def choose_replica():
+    """Случайная исправная реплика или основная база, если таких нет"""
+    replicas = [alias for alias in get_replica_aliases() if replica_is_healthy(alias)]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def routing(use_replica=False, pinned=False):
+    """Задает правила маршрутизации запросов к БД для блока кода"""
+    token = _routing_state.set(RoutingState(use_replica, pinned))
+    try:
+        yield _routing_state.get()
+    finally:
+        _routing_state.reset(token)
+
+
+def read_from_replica():
+    """Отчетные запросы внутри блока читают с реплики"""
+    return routing(use_replica=True)
+
+
+def current_routing():
+    return _routing_state.get()
+
+
+class ReplicaRouter:
+    """Пишет всегда в основную базу, а чтение отправляет на реплики только там, где это разрешено.
+
+    Чтение идет на реплику, если view помечена use_replica (или код выполняется
+    внутри read_from_replica()), пользователь не закреплен за основной базой
+    после недавней записи и нет открытой транзакции на основной базе.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or not state.use_replica or state.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_aliases():
+            return False
+        return None
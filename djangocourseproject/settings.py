@@ -84,11 +84,14 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE = [
+    'djangocourseproject.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'djangocourseproject.middleware.ReplicaRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'user.middleware.UserRolesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware'
@@ -96,8 +99,35 @@ MIDDLEWARE = [
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'BACKEND': 'djangocourseproject.cache.backends.ResilientRedisCache',
+        'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'OPTIONS': {
+            # Короткие таймауты: зависший Redis не должен держать запросы
+            'socket_connect_timeout': float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.25)),
+            'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.25)),
+            # Нативный асинхронный клиент - только под ASGI (включает asgi.py), под WSGI - общий синхронный пул
+            'ASYNC_CLIENT': os.getenv('CACHE_ASYNC_CLIENT') == '1',
+            # После нескольких ошибок подряд кеш переходит на память процесса
+            'CIRCUIT': {
+                'FAILURE_THRESHOLD': 3,
+                'RESET_TIMEOUT': 10,
+                'FALLBACK': 'locmem',
+                'MAX_ENTRIES': 1000,
+            },
+            # msgpack для простых значений, pickle для остального, zlib для больших записей
+            'serializer': 'djangocourseproject.cache.serializers.CompactSerializer',
+            # Горячие ключи дополнительно держим в памяти процесса:
+            # префикс ключа -> время жизни в памяти (секунды)
+            'LOCAL': {
+                'MAX_ENTRIES': 10000,
+                'POLICIES': {
+                    'user_roles_': 60,
+                    'user_home_stats_': 10,
+                    'users_stats': 10,
+                    'users_list_managers': 10,
+                },
+            },
+        },
     }
 }
 
@@ -127,15 +157,47 @@ WSGI_APPLICATION = 'djangocourseproject.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': name,
         'USER': user,
         'PASSWORD': password,
         'HOST': host,
         'PORT': port,
+        # Переиспользуем соединение между запросами вместо подключения на каждый запрос
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплики для чтения: DB_REPLICAS=host[:port][/name],... (пользователь и пароль как у основной базы)
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    replica_address, _, replica_name = replica.partition('/')
+    replica_host, _, replica_port = replica_address.partition(':')
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or port,
+        'NAME': replica_name or name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['djangocourseproject.routers.ReplicaRouter']
+# Допустимое отставание реплики, после которого чтение идет в основную базу (секунды)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+# Сколько секунд после записи пользователь читает только из основной базы
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+REPLICA_PIN_COOKIE = 'db_pin_primary'
+
+# Метрики: как часто сбрасывать счетчики процесса в Redis (секунды)
+METRICS_FLUSH_INTERVAL = 5
+# Токен для сборщика метрик (Authorization: Bearer <токен>), менеджерам токен не нужен
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Допустимое число SQL-запросов на один HTTP-запрос
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 30))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
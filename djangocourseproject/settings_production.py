@@ -0,0 +1,30 @@
+"""
+Настройки для продакшена: DJANGO_SETTINGS_MODULE=djangocourseproject.settings_production
+
+Вместо постоянных соединений используется пул psycopg. Размеры пула задаются
+переменными окружения DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE и DB_POOL_TIMEOUT.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DEBUG = False
+
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
+
+# Пул несовместим с CONN_MAX_AGE: соединения возвращаются в пул после каждого запроса.
+# У каждой базы (основной и реплик) свой пул
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = 0
+    database['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            # Сколько секунд ждать свободное соединение, прежде чем вернуть ошибку
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            # Закрываем соединения, простаивающие дольше max_idle секунд
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+        },
+    }
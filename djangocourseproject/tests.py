@@ -0,0 +1,387 @@
+import os
+import threading
+import time
+from fnmatch import fnmatchcase
+from types import SimpleNamespace
+
+import redis.asyncio
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from redis.exceptions import ConnectionError
+
+from djangocourseproject.cache.backends import AsyncRedisCache, ResilientRedisCache, SyncClientAdapter
+from djangocourseproject.cache.breaker import HALF_OPEN, OPEN
+from djangocourseproject.cache.local import INVALIDATE_ALL, INVALIDATE_KEY, INVALIDATE_PATTERN, LocalTier
+from djangocourseproject.cache.stampede import aget_or_compute, get_or_compute
+from djangocourseproject.metrics import MetricsRegistry, cache_key_prefix
+from djangocourseproject.middleware import ReplicaRoutingMiddleware, use_replica
+from djangocourseproject.routers import _replica_health, read_from_replica, routing
+from user.models import CustomUser
+
+# Адрес, на котором Redis заведомо не слушает: клиенты создаются, но не подключаются
+UNREACHABLE_REDIS = 'redis://127.0.0.1:9/0'
+# Реплика в тестах - зеркало тестовой базы, как replica_N из DB_REPLICAS
+REPLICA = 'replica_1'
+
+
+class AsyncClientTestCase(SimpleTestCase):
+    """Под WSGI асинхронные методы кеша используют общий синхронный пул, а не клиент на каждый loop"""
+
+    async def get_client(self, cache):
+        return cache._get_async_client()
+
+    def test_sync_pool_without_asgi(self):
+        cache = AsyncRedisCache(UNREACHABLE_REDIS, {})
+        # Каждый async_to_sync под WSGI - новый event loop
+        for _ in range(3):
+            self.assertIsInstance(async_to_sync(self.get_client)(cache), SyncClientAdapter)
+        self.assertEqual(len(cache._async_clients), 0)
+
+        client = SimpleNamespace(get=lambda key: f'value of {key}')
+        self.assertEqual(async_to_sync(SyncClientAdapter(client).get)('key'), 'value of key')
+
+    def test_native_client_under_asgi(self):
+        cache = AsyncRedisCache(UNREACHABLE_REDIS, {'OPTIONS': {'ASYNC_CLIENT': True}})
+        self.assertIsInstance(async_to_sync(self.get_client)(cache), redis.asyncio.Redis)
+
+
+class LocalTierTestCase(SimpleTestCase):
+    """Локальный уровень кеша: инвалидации, защита от устаревших значений и работа без подписки"""
+
+    def setUp(self):
+        self.tier = LocalTier(UNREACHABLE_REDIS, 'test_invalidation', 3, {'hot_': 60, 'hot_short_': 0.05})
+        # Подписка "работает": поток слушателя жив, сообщения передаются в handle вручную
+        self.tier._pid = os.getpid()
+        self.tier._listener = threading.current_thread()
+        self.tier.subscribed = True
+
+    def cached(self, key):
+        return self.tier.get(key, f':1:{key}')[0]
+
+    def store(self, key, value):
+        _, epoch = self.tier.get(key, f':1:{key}')
+        self.tier.set(f':1:{key}', value, self.tier.ttl(key), epoch)
+
+    def test_policies(self):
+        self.assertEqual(self.tier.ttl('hot_key'), 60)
+        self.assertEqual(self.tier.ttl('hot_short_key'), 0.05)
+        self.assertIsNone(self.tier.ttl('cold_key'))
+
+    def test_set_after_invalidate_is_ignored(self):
+        # Значение прочитано из Redis, а пока оно шло, другой процесс его изменил
+        _, epoch = self.tier.get('hot_a', ':1:hot_a')
+        self.tier.handle(INVALIDATE_KEY + ':1:hot_a')
+        self.tier.set(':1:hot_a', b'old', 60, epoch)
+        self.assertIsNone(self.cached('hot_a'))
+
+        self.store('hot_a', b'new')
+        self.assertEqual(self.cached('hot_a'), b'new')
+        self.tier.handle(INVALIDATE_KEY + ':1:hot_a')
+        self.assertIsNone(self.cached('hot_a'))
+
+    def test_pattern_and_full_invalidation(self):
+        for key in ('hot_a', 'hot_user_1', 'hot_user_2'):
+            self.store(key, key.encode())
+        self.tier.handle(INVALIDATE_PATTERN + ':1:hot_user_*')
+        self.assertEqual(
+            [self.cached(key) for key in ('hot_a', 'hot_user_1', 'hot_user_2')], [b'hot_a', None, None],
+        )
+        self.tier.handle(INVALIDATE_ALL)
+        self.assertIsNone(self.cached('hot_a'))
+
+    def test_lru_and_ttl(self):
+        for key in ('hot_1', 'hot_2', 'hot_3'):
+            self.store(key, b'x')
+        self.cached('hot_1')
+        self.store('hot_4', b'x')
+        # Вытеснен самый давно читанный ключ
+        self.assertIsNone(self.cached('hot_2'))
+        self.assertEqual(self.tier.stats()['evictions'], 1)
+
+        self.store('hot_short_key', b'x')
+        time.sleep(0.06)
+        self.assertIsNone(self.cached('hot_short_key'))
+
+    def test_bypass_while_unsubscribed(self):
+        self.store('hot_a', b'value')
+        self.tier.subscribed = False
+        # Без подписки инвалидации могли потеряться: память не читается и не пополняется
+        self.assertIsNone(self.cached('hot_a'))
+        self.store('hot_b', b'value')
+        self.assertEqual(len(self.tier.lru), 1)
+
+
+class FlakyRedis:
+    """Redis в памяти процесса, который можно уронить целиком или по отдельным командам"""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+        self.failing = set()
+        self.commands = []
+
+    def command(self, name):
+        self.commands.append(name)
+        if self.down or name in self.failing:
+            raise ConnectionError('Redis недоступен')
+
+    def get(self, key):
+        self.command('get')
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        self.command('set')
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        self.command('delete')
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match, count=None):
+        self.command('scan')
+        return [key for key in list(self.data) if fnmatchcase(key, match)]
+
+    def flushdb(self):
+        self.command('flushdb')
+        self.data.clear()
+
+    def pipeline(self, transaction=True):
+        return FlakyPipeline(self)
+
+
+class FlakyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def publish(self, channel, message):
+        pass
+
+    def execute(self):
+        self.redis.command('publish')
+
+
+class ResilientCacheTestCase(SimpleTestCase):
+    """Переключение кеша на запасной бэкенд при сбоях Redis и возврат после восстановления"""
+
+    RESET_TIMEOUT = 0.05
+
+    def setUp(self):
+        # Выключатели общие на процесс и различаются префиксом ключей
+        self.cache = ResilientRedisCache(UNREACHABLE_REDIS, {
+            'KEY_PREFIX': self.id(),
+            'OPTIONS': {'CIRCUIT': {'FAILURE_THRESHOLD': 3, 'RESET_TIMEOUT': self.RESET_TIMEOUT}},
+        })
+        self.redis = FlakyRedis()
+        self.cache._cache.get_client = lambda key=None, write=False: self.redis
+        self.breaker = self.cache._breaker
+
+    def wait_reset(self):
+        time.sleep(self.RESET_TIMEOUT * 1.5)
+
+    def test_trips_after_threshold(self):
+        self.redis.down = True
+        with self.assertLogs('djangocourseproject.cache.backends', 'WARNING'):
+            for _ in range(3):
+                self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.trips, 1)
+        # Разомкнутый выключатель в Redis не ходит
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.assertEqual(len(self.redis.commands), 3)
+
+    def test_single_half_open_probe(self):
+        self.redis.down = True
+        with self.assertLogs('djangocourseproject.cache.backends', 'WARNING'):
+            for _ in range(3):
+                self.cache.get('key')
+            self.wait_reset()
+            self.assertTrue(self.breaker.allow())
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            # Пока пробный запрос не завершился, остальные идут в запасной бэкенд
+            self.assertFalse(self.breaker.allow())
+            self.breaker.record_failure()
+        self.assertEqual((self.breaker.state, self.breaker.trips), (OPEN, 2))
+
+        self.redis.down = False
+        self.wait_reset()
+        self.cache.set('key', 'value')
+        self.assertFalse(self.breaker.is_open())
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_replay_before_first_read(self):
+        self.cache.set('key', 'old')
+        self.cache.set('user_1', 'old')
+        self.redis.down = True
+        with self.assertLogs('djangocourseproject.cache.backends', 'WARNING'):
+            for _ in range(3):
+                self.cache.get('other')
+            # Изменения во время сбоя попадают только в запасной бэкенд
+            self.cache.set('key', 'new')
+            self.cache.delete_pattern('user_*')
+            self.assertEqual(self.cache.get('key'), None)
+
+            self.redis.down = False
+            self.redis.commands.clear()
+            self.wait_reset()
+            # Устаревшие значения удаляются из Redis до первого чтения
+            self.assertIsNone(self.cache.get('key'))
+        self.assertIsNone(self.cache.get('user_1'))
+        self.assertEqual(self.redis.commands[:3], ['delete', 'scan', 'delete'])
+        self.assertFalse(self.breaker.is_open())
+        self.assertFalse(self.breaker.has_pending)
+
+    def test_failed_replay_is_restored(self):
+        self.cache.set('key', 'old')
+        self.redis.down = True
+        with self.assertLogs('djangocourseproject.cache.backends', 'WARNING'):
+            for _ in range(3):
+                self.cache.get('other')
+            self.cache.set('key', 'new')
+
+            self.redis.down = False
+            self.redis.failing = {'delete'}
+            self.wait_reset()
+            # Сброс не удался: чтение идет в запасной бэкенд, ключи остаются в очереди
+            self.assertEqual(self.cache.get('key'), 'new')
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.pending_keys, {('key', None)})
+
+        self.redis.failing = set()
+        self.wait_reset()
+        self.assertIsNone(self.cache.get('key'))
+        self.assertNotIn(f'{self.id()}:1:key', self.redis.data)
+        self.assertFalse(self.breaker.has_pending)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StampedeTestCase(SimpleTestCase):
+    """Значения, записанные по тем же ключам до перехода на записи со сроком свежести, считаются промахом"""
+
+    def setUp(self):
+        cache.clear()
+
+    async def compute(self):
+        return 'new'
+
+    def test_legacy_values_are_recomputed(self):
+        # Словарь из трех ключей распаковался бы без ошибки, но в ключи, а не в запись
+        for legacy in ({'a': 1, 'b': 2, 'c': 3}, ['a', 'b', 'c'], ('a', 'b', 'c'), 'abc'):
+            with self.subTest(legacy=legacy):
+                cache.set('stats', legacy)
+                self.assertEqual(get_or_compute('stats', lambda: 'new', 60), 'new')
+                self.assertEqual(get_or_compute('stats', lambda: 'other', 60), 'new')
+                cache.set('stats', legacy)
+                self.assertEqual(async_to_sync(aget_or_compute)('stats', self.compute, 60), 'new')
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRouterTestCase(SimpleTestCase):
+    """Чтение уходит на реплику только там, где это разрешено, и пока она не отстает"""
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        # settings задают реплики только при DB_REPLICAS, поэтому зеркало подключаем здесь,
+        # к уже созданной тестовой базе, и только тогда разрешаем к нему запросы
+        connections.settings[REPLICA] = {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}}
+        cls.databases = {'default', REPLICA}
+        cls.addClassCleanup(cls.remove_replica)
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def setUp(self):
+        _replica_health.clear()
+
+    def read_db(self):
+        return CustomUser.objects.all().db
+
+    def request(self, method, cookies=None):
+        """Проходит через middleware и возвращает (ответ, база, из которой читала view)"""
+        @use_replica
+        def view(request):
+            return HttpResponse(self.read_db())
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        return response, response.content.decode()
+
+    def test_reads_inside_read_from_replica(self):
+        self.assertEqual(self.read_db(), 'default')
+        with read_from_replica():
+            self.assertEqual(self.read_db(), REPLICA)
+            with CaptureQueriesContext(connections[REPLICA]) as queries:
+                CustomUser.objects.exists()
+            self.assertEqual(len(queries), 1)
+            # Внутри транзакции читаем то, что в ней записано
+            with transaction.atomic():
+                self.assertEqual(self.read_db(), 'default')
+        with routing(use_replica=True, pinned=True):
+            self.assertEqual(self.read_db(), 'default')
+
+    def test_pinned_after_write(self):
+        response, db = self.request('get')
+        self.assertEqual(db, REPLICA)
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+        response, db = self.request('post')
+        self.assertEqual(db, 'default')
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        _, db = self.request('get', {settings.REPLICA_PIN_COOKIE: cookie.value})
+        self.assertEqual(db, 'default')
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=-1)
+    def test_lagging_replica_falls_back_to_primary(self):
+        with read_from_replica():
+            self.assertEqual(self.read_db(), 'default')
+        self.assertEqual(_replica_health[REPLICA][1], False)
+
+
+class MetricsTestCase(SimpleTestCase):
+    """Метки метрик кеша не зависят от пользователя и URL"""
+
+    def test_cache_key_families(self):
+        for key, family in (
+            ('user_home_stats_15', 'user_home_stats'),
+            ('user_home_stats_15_lock', 'user_home_stats_lock'),
+            ('users_list_managers', 'users_list_managers'),
+            ('views.decorators.cache.cache_page..GET.0123abcd.4567ef.ru-ru.Europe/Moscow', 'cache_page'),
+            ('views.decorators.cache.cache_header..0123abcd.ru-ru.Europe/Moscow', 'cache_page'),
+            ('import_42', 'other'),
+        ):
+            with self.subTest(key=key):
+                self.assertEqual(cache_key_prefix(key), family)
+
+    def test_samples_without_redis(self):
+        registry = MetricsRegistry()
+        registry.inc('http_requests_total', {'view': 'home'})
+        backend = {'BACKEND': 'djangocourseproject.cache.backends.ResilientRedisCache', 'LOCATION': UNREACHABLE_REDIS}
+        # Если Redis недоступен, /metrics показывает значения процесса, а не падает
+        with override_settings(CACHES={'default': {**backend, 'KEY_PREFIX': self.id()}}):
+            self.assertEqual(registry.samples(), {'http_requests_total{view="home"}': 1})
@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from djangocourseproject.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('mailing.urls')),
     path('mailing/', include('mailing.urls', namespace='mailing')),
     path('user/', include('user.urls', namespace='user')),
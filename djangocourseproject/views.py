@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from djangocourseproject.cache.breaker import circuit_breakers
+from djangocourseproject.cache.local import local_tiers
+from djangocourseproject.metrics import registry, render_prometheus
+from mailing.permissions import user_is_manager
+from mailing.pg import pool_stats
+
+
+def has_metrics_access(request):
+    """Метрики доступны менеджерам и сборщику метрик с токеном METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_authenticated and user_is_manager(request.user)
+
+
+def pool_gauges():
+    """Статистика пулов соединений в виде gauge-метрик db_pool_*"""
+    gauges = {}
+    for alias, stats in pool_stats().items():
+        for name, value in stats.items():
+            gauges.setdefault(f'db_pool_{name}', (f'Пул соединений: {name}', []))[1].append(({'alias': alias}, value))
+    return gauges
+
+
+def local_cache_gauges():
+    """Размер и доля попаданий локального уровня кеша этого процесса"""
+    gauges = {}
+    for channel, tier in local_tiers().items():
+        stats = tier.stats()
+        labels = {'cache': channel}
+        gauges.setdefault('cache_local_entries', ('Записей в памяти процесса', []))[1].append(
+            (labels, stats['entries'])
+        )
+        gauges.setdefault('cache_local_hit_ratio', ('Доля попаданий в память процесса', []))[1].append(
+            (labels, stats['hit_rate'])
+        )
+    return gauges
+
+
+def circuit_gauges():
+    """Состояние выключателей Redis в этом процессе"""
+    gauges = {}
+    for name, breaker in circuit_breakers().items():
+        labels = {'cache': name}
+        gauges.setdefault('cache_circuit_open', ('Кеш работает через запасной бэкенд', []))[1].append(
+            (labels, int(breaker.is_open()))
+        )
+        gauges.setdefault('cache_circuit_trips', ('Сколько раз выключатель размыкался', []))[1].append(
+            (labels, breaker.trips)
+        )
+    return gauges
+
+
+def metrics_view(request):
+    """Метрики в формате Prometheus"""
+    if not has_metrics_access(request):
+        raise PermissionDenied("Метрики доступны только менеджерам")
+    return HttpResponse(
+        render_prometheus(registry.samples(), {**pool_gauges(), **local_cache_gauges(), **circuit_gauges()}),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
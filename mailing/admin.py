@@ -1,7 +1,15 @@
 from django.contrib import admin
-from .models import ReceiverMailing
+from .models import ReceiverMailing, ReceiverList
 
 @admin.register(ReceiverMailing)
 class ReceiverMailingAdmin(admin.ModelAdmin):
     list_display = ("email", "full_name")
     search_fields = ("email", "full_name")
+
+
+@admin.register(ReceiverList)
+class ReceiverListAdmin(admin.ModelAdmin):
+    list_display = ("name", "kind", "owner")
+    list_filter = ("kind",)
+    search_fields = ("name",)
+    raw_id_fields = ("owner", "receivers")
@@ -0,0 +1,491 @@
+"""JSON API для пакетной работы с получателями, сообщениями и рассылками.
+
+Авторизация - через сессию, поэтому запросы на изменение должны передавать
+CSRF-токен в заголовке X-CSRFToken.
+"""
+import json
+
+from django import forms
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.forms.models import model_to_dict
+from django.http import JsonResponse
+from django.views import View
+
+from mailing.forms import MailingForm, MessageForm, ReceiverForm
+from mailing.m2m import add_links, remove_links
+from mailing.models import Mailing, Message, ReceiverList, ReceiverMailing
+from mailing.permissions import annotate_access, filter_accessible, filter_owned
+from mailing.signals import adjust_mailing_counters
+
+MAX_BATCH_SIZE = 500
+# Вариантов на страницу поиска в полях выбора
+AUTOCOMPLETE_PAGE_SIZE = 20
+
+
+class APIError(Exception):
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class JSONAPIMixin(LoginRequiredMixin):
+    """Общая обработка JSON-запросов и ошибок"""
+
+    def handle_no_permission(self):
+        return JsonResponse({'error': 'Необходима авторизация'}, status=401)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except APIError as e:
+            payload = {'error': str(e)}
+            if e.details is not None:
+                payload['details'] = e.details
+            return JsonResponse(payload, status=e.status)
+
+    def get_payload(self):
+        try:
+            payload = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise APIError('Некорректный JSON')
+        if not isinstance(payload, dict):
+            raise APIError('Ожидается JSON-объект')
+        return payload
+
+    def get_list(self, payload, key):
+        items = payload.get(key)
+        if not isinstance(items, list) or not items:
+            raise APIError(f'Поле {key} должно быть непустым списком')
+        if len(items) > MAX_BATCH_SIZE:
+            raise APIError(f'Не больше {MAX_BATCH_SIZE} объектов за запрос')
+        return items
+
+    def get_ids(self, payload, key='ids'):
+        ids = self.get_list(payload, key)
+        if not all(isinstance(pk, int) for pk in ids):
+            raise APIError(f'Поле {key} должно содержать числовые идентификаторы')
+        return ids
+
+
+def int_ids(values):
+    """Оставляет только значения, похожие на идентификаторы"""
+    ids = set()
+    for value in values:
+        if isinstance(value, int) and not isinstance(value, bool):
+            ids.add(value)
+        elif isinstance(value, str) and value.isdigit():
+            ids.add(int(value))
+    return ids
+
+
+class PreloadedChoiceMixin:
+    """Поле выбора, которое ищет объекты в заранее загруженном словаре, а не отдельным запросом"""
+
+    def __init__(self, objects, *args, **kwargs):
+        self.objects = objects
+        super().__init__(*args, **kwargs)
+
+    def lookup(self, value):
+        try:
+            return self.objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+
+
+class PreloadedModelChoiceField(PreloadedChoiceMixin, forms.ModelChoiceField):
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        return self.lookup(value)
+
+
+class PreloadedModelMultipleChoiceField(PreloadedChoiceMixin, forms.ModelMultipleChoiceField):
+
+    def _check_values(self, value):
+        try:
+            value = dict.fromkeys(value)
+        except TypeError:
+            raise ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+        return [self.lookup(pk) for pk in value]
+
+
+class BatchAPIView(JSONAPIMixin, View):
+    """Пакетное создание (POST), изменение (PATCH) и удаление (DELETE) объектов.
+
+    POST   {"items": [{...}, ...]}
+    PATCH  {"items": [{"id": 1, ...}, ...]}
+    DELETE {"ids": [1, 2, ...]}
+
+    Пакет выполняется в одной транзакции: при ошибке в любом объекте не сохраняется ничего.
+    """
+    model = None
+    form_class = None
+    shared_via = None
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def get_form_kwargs(self):
+        return {}
+
+    def get_form(self, data, instance=None):
+        form = self.form_class(data=data, instance=instance, **self.get_form_kwargs())
+        # Уникальность проверяется сразу для всего пакета в validate_batch
+        form.validate_unique = lambda: None
+        return form
+
+    def validate_items(self, items, instances=None):
+        """Проверяет все объекты пакета, возвращает формы или выбрасывает APIError со всеми ошибками"""
+        forms, errors = [], {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors[index] = {'__all__': ['Ожидается JSON-объект']}
+                continue
+            instance = instances[index] if instances else None
+            data = item
+            if instance is not None:
+                # Не переданные поля берем из текущего объекта
+                data = {**model_to_dict(instance, fields=self.form_class._meta.fields), **item}
+            form = self.get_form(data, instance)
+            if form.is_valid():
+                forms.append(form)
+            else:
+                errors[index] = form.errors.get_json_data()
+
+        if not errors:
+            errors = self.validate_batch(forms)
+        if errors:
+            raise APIError('Ошибка проверки данных', details=errors)
+        return forms
+
+    def validate_batch(self, forms):
+        """Проверки, которые выполняются одним запросом на весь пакет"""
+        return {}
+
+    def get_accessible(self, ids):
+        """Загружает объекты одним запросом и проверяет права на каждый"""
+        objects = {
+            obj.pk: obj
+            for obj in annotate_access(self.get_queryset().filter(pk__in=ids), self.request.user, self.shared_via)
+        }
+        missing = [pk for pk in ids if pk not in objects]
+        if missing:
+            raise APIError('Объекты не найдены', status=404, details={'ids': missing})
+        forbidden = [pk for pk in ids if not objects[pk].has_access]
+        if forbidden:
+            raise APIError('Нет прав на изменение объектов', status=403, details={'ids': forbidden})
+        return [objects[pk] for pk in ids]
+
+    def invalidate_cache(self, owner_ids):
+        for owner_id in owner_ids:
+            cache.delete(f"user_home_stats_{owner_id}")
+
+    def post(self, request, *args, **kwargs):
+        forms = self.validate_items(self.get_list(self.get_payload(), 'items'))
+        with transaction.atomic():
+            objects = self.create_objects(forms)
+        self.invalidate_cache({request.user.pk})
+        return JsonResponse({'ids': [obj.pk for obj in objects]}, status=201)
+
+    def create_objects(self, forms):
+        objects = []
+        for form in forms:
+            obj = form.save(commit=False)
+            obj.owner = self.request.user
+            objects.append(obj)
+        return self.model.objects.bulk_create(objects)
+
+    def patch(self, request, *args, **kwargs):
+        items = self.get_list(self.get_payload(), 'items')
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        if not all(isinstance(pk, int) for pk in ids):
+            raise APIError('У каждого объекта должен быть числовой id')
+        if len(set(ids)) != len(ids):
+            raise APIError('Идентификаторы в пакете повторяются')
+
+        instances = self.get_accessible(ids)
+        forms = self.validate_items(items, instances)
+        with transaction.atomic():
+            self.update_objects(forms)
+        self.invalidate_cache({obj.owner_id for obj in instances if obj.owner_id})
+        return JsonResponse({'updated': len(forms)})
+
+    def update_objects(self, forms):
+        self.model.objects.bulk_update([form.instance for form in forms], self.form_class._meta.fields)
+
+    def delete(self, request, *args, **kwargs):
+        ids = self.get_ids(self.get_payload())
+        instances = self.get_accessible(ids)
+        with transaction.atomic():
+            self.model.objects.filter(pk__in=ids).delete()
+        self.invalidate_cache({obj.owner_id for obj in instances if obj.owner_id})
+        return JsonResponse({'deleted': len(instances)})
+
+
+class ReceiverBatchAPIView(BatchAPIView):
+    model = ReceiverMailing
+    form_class = ReceiverForm
+    shared_via = 'receivers'
+
+    def validate_batch(self, forms):
+        emails = {}
+        errors = {}
+        for index, form in enumerate(forms):
+            email = form.cleaned_data['email']
+            if email in emails:
+                errors[index] = {'email': [{'message': 'Email повторяется в пакете', 'code': 'duplicate'}]}
+            emails[email] = form.instance.pk
+
+        taken = ReceiverMailing.objects.filter(email__in=emails).values_list('email', 'pk')
+        for email, pk in taken:
+            if emails[email] != pk:
+                index = next(i for i, form in enumerate(forms) if form.cleaned_data['email'] == email)
+                errors[index] = {'email': [{'message': 'Получатель с таким email уже существует', 'code': 'unique'}]}
+        return errors
+
+    def invalidate_cache(self, owner_ids):
+        super().invalidate_cache(owner_ids)
+        for owner_id in owner_ids:
+            cache.delete(f"receivers_list_{owner_id}")
+
+
+class MessageBatchAPIView(BatchAPIView):
+    model = Message
+    form_class = MessageForm
+    shared_via = 'message'
+
+    def invalidate_cache(self, owner_ids):
+        super().invalidate_cache(owner_ids)
+        for owner_id in owner_ids:
+            cache.delete(f"messages_list_{owner_id}")
+
+
+class MailingBatchAPIView(BatchAPIView):
+    model = Mailing
+    form_class = MailingForm
+    # Связи многие-ко-многим, которые сохраняем сами, а не через form.save()
+    m2m_fields = ('segments', 'receivers')
+
+    def get_queryset(self):
+        # Текущие связи нужны форме для значений по умолчанию и changed_data
+        return Mailing.objects.prefetch_related(*self.m2m_fields)
+
+    def validate_items(self, items, instances=None):
+        # Сообщения, сегменты и получатели всего пакета загружаем тремя запросами, а не по запросу на каждую форму
+        message_ids = set()
+        related_ids = {name: set() for name in self.m2m_fields}
+        for item in items:
+            if isinstance(item, dict):
+                message_ids.add(item.get('message'))
+                for name in self.m2m_fields:
+                    if isinstance(item.get(name), list):
+                        related_ids[name].update(item[name])
+        for instance in instances or ():
+            message_ids.add(instance.message_id)
+            for name in self.m2m_fields:
+                related_ids[name].update(obj.pk for obj in getattr(instance, name).all())
+
+        querysets = self.form_class.choice_querysets(self.request.user)
+        self.messages = querysets['message'].in_bulk(int_ids(message_ids))
+        self.related = {name: querysets[name].in_bulk(int_ids(ids)) for name, ids in related_ids.items()}
+        return super().validate_items(items, instances)
+
+    def get_form_kwargs(self):
+        return {'user': self.request.user}
+
+    def get_form(self, data, instance=None):
+        form = super().get_form(data, instance)
+        form.fields['message'] = PreloadedModelChoiceField(
+            self.messages, queryset=form.fields['message'].queryset,
+        )
+        for name in self.m2m_fields:
+            form.fields[name] = PreloadedModelMultipleChoiceField(
+                self.related[name], queryset=form.fields[name].queryset, required=False,
+            )
+        return form
+
+    def create_objects(self, forms):
+        # bulk_create не вызывает save(), поэтому расписание считаем сами
+        for form in forms:
+            form.instance.schedule()
+        mailings = super().create_objects(forms)
+        for name in self.m2m_fields:
+            field = Mailing._meta.get_field(name)
+            through = field.remote_field.through
+            target = field.m2m_reverse_field_name()
+            through.objects.bulk_create([
+                through(mailing_id=mailing.pk, **{target: obj})
+                for mailing, form in zip(mailings, forms)
+                for obj in form.cleaned_data[name]
+            ])
+        # bulk_create не отправляет post_save, поэтому счетчики владельца обновляем сами
+        adjust_mailing_counters(
+            self.request.user.pk,
+            total=len(mailings),
+            active=sum(mailing.is_active for mailing in mailings),
+        )
+        return mailings
+
+    def update_objects(self, forms):
+        for form in forms:
+            form.instance.schedule()
+        Mailing.objects.bulk_update(
+            [form.instance for form in forms],
+            [field for field in self.form_class._meta.fields if field not in self.m2m_fields] + ['next_run_at'],
+        )
+        for form in forms:
+            form.save_links()
+
+    def invalidate_cache(self, owner_ids):
+        super().invalidate_cache(owner_ids)
+        for owner_id in owner_ids:
+            cache.delete(f"mailings_list_{owner_id}")
+
+
+class ReceiversAPIView(JSONAPIMixin, View):
+    """Массовое добавление и удаление получателей объекта.
+
+    POST {"add": [1, 2, ...], "remove": [3, ...]}
+    Связи меняются запросами INSERT ... SELECT и DELETE, без загрузки получателей.
+    """
+    model = None
+    # Поле модели со связью с получателями
+    links_field = 'receivers'
+    not_found_message = 'Объект не найден'
+    forbidden_message = 'Нет прав на изменение объекта'
+
+    def get_object(self, pk):
+        obj = annotate_access(self.model.objects.filter(pk=pk), self.request.user).first()
+        if obj is None:
+            raise APIError(self.not_found_message, status=404)
+        if not obj.has_access:
+            raise APIError(self.forbidden_message, status=403)
+        return obj
+
+    def get_receivers(self, obj):
+        """Получатели, которых можно добавить к объекту"""
+        return filter_accessible(ReceiverMailing.objects.all(), self.request.user)
+
+    def post(self, request, pk):
+        obj = self.get_object(pk)
+        payload = self.get_payload()
+        add = self.get_ids(payload, 'add') if payload.get('add') else []
+        remove = self.get_ids(payload, 'remove') if payload.get('remove') else []
+        if not add and not remove:
+            raise APIError('Укажите идентификаторы в add или remove')
+
+        receivers = self.get_receivers(obj).filter(pk__in=add)
+        if add:
+            found = set(receivers.values_list('pk', flat=True))
+            unknown = [receiver_id for receiver_id in add if receiver_id not in found]
+            if unknown:
+                raise APIError('Получатели не найдены', status=404, details={'ids': unknown})
+
+        links = getattr(self.model, self.links_field)
+        with transaction.atomic():
+            added = add_links(links, obj.pk, receivers) if add else 0
+            removed = remove_links(links, obj.pk, ReceiverMailing.objects.filter(pk__in=remove)) if remove else 0
+
+        self.invalidate_cache(obj)
+        return JsonResponse({'added': added, 'removed': removed})
+
+    def invalidate_cache(self, obj):
+        if obj.owner_id:
+            cache.delete(f"user_home_stats_{obj.owner_id}")
+
+
+class MailingReceiversAPIView(ReceiversAPIView):
+    model = Mailing
+    not_found_message = 'Рассылка не найдена'
+    forbidden_message = 'Нет прав на изменение рассылки'
+
+
+class SegmentReceiversAPIView(ReceiversAPIView):
+    model = ReceiverList
+    not_found_message = 'Сегмент не найден'
+    forbidden_message = 'Нет прав на изменение сегмента'
+
+    def get_object(self, pk):
+        segment = super().get_object(pk)
+        if segment.kind != ReceiverList.Kind.STATIC:
+            raise APIError('Состав фильтра задается условиями, а не списком получателей')
+        return segment
+
+    def get_receivers(self, segment):
+        # В список попадают только получатели его владельца
+        return ReceiverMailing.objects.filter(owner_id=segment.owner_id)
+
+    def invalidate_cache(self, segment):
+        owner_ids = set(
+            Mailing.objects.filter(segments=segment, owner__isnull=False).values_list('owner_id', flat=True)
+        )
+        for owner_id in owner_ids:
+            cache.delete(f"user_home_stats_{owner_id}")
+
+
+class AutocompleteAPIView(JSONAPIMixin, View):
+    """Постраничный поиск среди объектов пользователя для полей выбора.
+
+    GET ?term=строка&page=1
+    Ответ: {"results": [{"id": 1, "text": "..."}, ...], "pagination": {"more": true}}
+    """
+    model = None
+    search_fields = ()
+    ordering = ()
+    page_size = AUTOCOMPLETE_PAGE_SIZE
+
+    def get_queryset(self):
+        return filter_owned(self.model.objects.all(), self.request.user)
+
+    def get_page(self):
+        try:
+            page = int(self.request.GET.get('page', 1))
+        except ValueError:
+            raise APIError('Некорректный номер страницы')
+        if page < 1:
+            raise APIError('Некорректный номер страницы')
+        return page
+
+    def get(self, request, *args, **kwargs):
+        page = self.get_page()
+        queryset = self.get_queryset()
+        term = request.GET.get('term', '').strip()
+        if term:
+            condition = Q()
+            for field in self.search_fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(condition)
+
+        offset = (page - 1) * self.page_size
+        # Загружаем на один объект больше, чтобы узнать, есть ли следующая страница
+        objects = list(
+            queryset.order_by(*self.ordering, 'pk').only('pk', *self.search_fields)[offset:offset + self.page_size + 1]
+        )
+        return JsonResponse({
+            'results': [{'id': obj.pk, 'text': str(obj)} for obj in objects[:self.page_size]],
+            'pagination': {'more': len(objects) > self.page_size},
+        })
+
+
+class MessageAutocompleteAPIView(AutocompleteAPIView):
+    model = Message
+    search_fields = ('topic',)
+    ordering = ('topic',)
+
+
+class ReceiverAutocompleteAPIView(AutocompleteAPIView):
+    model = ReceiverMailing
+    search_fields = ('email', 'full_name')
+    ordering = ('email',)
+
+
+class SegmentAutocompleteAPIView(AutocompleteAPIView):
+    model = ReceiverList
+    search_fields = ('name',)
+    ordering = ('name',)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MailingConfig(AppConfig):
     name = 'mailing'
+
+    def ready(self):
+        from mailing import signals  # noqa: F401
@@ -1,7 +1,28 @@
 from django import forms
-from .models import ReceiverMailing, Message, Mailing
+from django.db.models import QuerySet
+from .m2m import replace_links
+from .models import ReceiverMailing, ReceiverList, Message, Mailing
+from .permissions import filter_owned
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
 from django.utils import timezone
 
+class SetBasedLinksMixin:
+    """Сохраняет связи многие-ко-многим через replace_links, а не set() с загрузкой объектов"""
+
+    def save_links(self):
+        model = type(self.instance)
+        for field in model._meta.many_to_many:
+            if field.name not in self.cleaned_data or field.name not in self.changed_data:
+                continue
+            value = self.cleaned_data[field.name]
+            if not isinstance(value, QuerySet):
+                value = field.related_model.objects.filter(pk__in=[obj.pk for obj in value])
+            replace_links(getattr(model, field.name), self.instance.pk, value)
+
+    def _save_m2m(self):
+        self.save_links()
+
+
 class ReceiverForm(forms.ModelForm):
     class Meta:
         model = ReceiverMailing
@@ -25,6 +46,74 @@ class ReceiverForm(forms.ModelForm):
             'placeholder': 'Введите комментарий'
         })
 
+class ReceiverImportForm(forms.Form):
+    file = forms.FileField(label='CSV-файл')
+
+    def __init__(self, *args, **kwargs):
+        super(ReceiverImportForm, self).__init__(*args, **kwargs)
+
+        self.fields['file'].help_text = 'Кодировка UTF-8, первая строка - заголовок с колонками email, full_name, comm'
+        self.fields['file'].widget.attrs.update({
+            'class': 'form-control',
+            'accept': '.csv,text/csv'
+        })
+
+
+class ReceiverListForm(SetBasedLinksMixin, forms.ModelForm):
+    class Meta:
+        model = ReceiverList
+        fields = ['name', 'kind', 'receivers', 'email_domain', 'name_contains']
+        widgets = {
+            'receivers': AutocompleteSelectMultiple('mailing:autocomplete-receivers'),
+        }
+
+    def __init__(self, *args, owner=None, **kwargs):
+        super(ReceiverListForm, self).__init__(*args, **kwargs)
+
+        self.fields['name'].widget.attrs.update({
+            'class': 'form-control',
+            'placeholder': 'Введите название сегмента'
+        })
+
+        self.fields['kind'].widget.attrs.update({
+            'class': 'form-select'
+        })
+
+        # В список можно добавить только своих получателей
+        owner = owner or self.instance.owner
+        self.fields['receivers'].queryset = ReceiverMailing.objects.filter(owner=owner)
+        self.fields['receivers'].help_text = 'Только для типа "Список"'
+        self.fields['receivers'].widget.attrs.update({
+            'class': 'form-select',
+            'placeholder': 'Начните вводить email или имя получателя'
+        })
+
+        self.fields['email_domain'].help_text = 'Только для типа "Фильтр", например example.com'
+        self.fields['email_domain'].widget.attrs.update({
+            'class': 'form-control',
+            'placeholder': 'Введите домен email'
+        })
+
+        self.fields['name_contains'].help_text = 'Только для типа "Фильтр"'
+        self.fields['name_contains'].widget.attrs.update({
+            'class': 'form-control',
+            'placeholder': 'Введите часть имени получателя'
+        })
+
+    def clean_email_domain(self):
+        return self.cleaned_data['email_domain'].strip().lstrip('@').lower()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Состав списка и условия фильтра не смешиваем
+        if cleaned_data.get('kind') == ReceiverList.Kind.FILTER:
+            cleaned_data['receivers'] = ReceiverMailing.objects.none()
+        else:
+            cleaned_data['email_domain'] = ''
+            cleaned_data['name_contains'] = ''
+        return cleaned_data
+
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
@@ -44,12 +133,18 @@ class MessageForm(forms.ModelForm):
         })
 
 
-class MailingForm(forms.ModelForm):
+class MailingForm(SetBasedLinksMixin, forms.ModelForm):
     class Meta:
         model = Mailing
-        fields = ['start_time', 'end_time', 'message', 'receivers']
-
-    def __init__(self, *args, **kwargs):
+        fields = ['start_time', 'end_time', 'recurrence', 'message', 'segments', 'receivers']
+        # Варианты подгружаются поиском, в HTML попадают только выбранные
+        widgets = {
+            'message': AutocompleteSelect('mailing:autocomplete-messages'),
+            'segments': AutocompleteSelectMultiple('mailing:autocomplete-segments'),
+            'receivers': AutocompleteSelectMultiple('mailing:autocomplete-receivers'),
+        }
+
+    def __init__(self, *args, user=None, **kwargs):
         super(MailingForm, self).__init__(*args, **kwargs)
 
         self.fields['start_time'].widget = forms.DateTimeInput(attrs={'type': 'datetime-local'})
@@ -64,18 +159,49 @@ class MailingForm(forms.ModelForm):
             'placeholder': 'Выберите дату и время окончания'
         })
 
-        self.fields['message'].queryset = Message.objects.all()
+        self.fields['recurrence'].widget.attrs.update({
+            'class': 'form-control',
+            'placeholder': 'Оставьте пустым для разовой рассылки'
+        })
+
+        # Выбрать можно только свои объекты; каждое поле проверяет присланные id одним запросом
+        for name, queryset in self.choice_querysets(user).items():
+            self.fields[name].queryset = queryset
+
         self.fields['message'].widget.attrs.update({
             'class': 'form-select',
-            'placeholder': 'Выберите сообщение для рассылки'
+            'placeholder': 'Начните вводить тему сообщения'
+        })
+
+        self.fields['segments'].widget.attrs.update({
+            'class': 'form-select',
+            'placeholder': 'Начните вводить название сегмента'
         })
 
-        self.fields['receivers'].queryset = ReceiverMailing.objects.all()
         self.fields['receivers'].widget.attrs.update({
-            'class': 'form-check',
-            'placeholder': 'Выберите пользователя для рассылки'
+            'class': 'form-select',
+            'placeholder': 'Начните вводить email или имя получателя'
         })
 
+    @staticmethod
+    def choice_querysets(user):
+        """Объекты, доступные пользователю в полях выбора: свои, у менеджера - все"""
+        if user is None:
+            return {
+                'message': Message.objects.none(),
+                'segments': ReceiverList.objects.none(),
+                'receivers': ReceiverMailing.objects.none(),
+            }
+        return {
+            'message': filter_owned(Message.objects.all(), user),
+            'segments': filter_owned(ReceiverList.objects.all(), user),
+            'receivers': filter_owned(ReceiverMailing.objects.all(), user),
+        }
+
+    def _get_validation_exclusions(self):
+        # Существование сообщения уже проверило поле формы, повторная проверка модели - лишний запрос
+        return super()._get_validation_exclusions() | {'message'}
+
     def clean(self):
         cleaned_data = super().clean()
         start_time = cleaned_data.get('start_time')
@@ -88,4 +214,9 @@ class MailingForm(forms.ModelForm):
             if self.instance.pk is None and start_time < timezone.now():
                 raise forms.ValidationError("Время начала не может быть в прошлом")
 
+        # Если сами поля с ошибками, об их содержимом уже сообщили
+        audience_valid = 'segments' not in self.errors and 'receivers' not in self.errors
+        if audience_valid and not cleaned_data.get('segments') and not cleaned_data.get('receivers'):
+            raise forms.ValidationError("Выберите сегменты или отдельных получателей")
+
         return cleaned_data
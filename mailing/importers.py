@@ -0,0 +1,128 @@
+"""Потоковый импорт получателей рассылок из CSV"""
+import csv
+import io
+from itertools import islice
+
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from mailing.models import ReceiverMailing
+from mailing.pg import copy_from, is_postgresql
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+STAGING_TABLE = 'receiver_import_staging'
+
+
+class ImportResult:
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.invalid = 0
+        self.errors = []
+
+    @property
+    def skipped(self):
+        """Корректные строки, которые не добавлены (такой email уже есть)"""
+        return self.processed - self.invalid - self.created
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def normalize_row(row):
+    """Проверяет и нормализует строку файла, возвращает (email, full_name, comm)"""
+    email = BaseUserManager.normalize_email((row.get('email') or '').strip())
+    validate_email(email)
+    # Валидатор длину адреса целиком не проверяет, а COPY упал бы на всей пачке
+    if len(email) > ReceiverMailing._meta.get_field('email').max_length:
+        raise ValidationError('Слишком длинный email получателя')
+    full_name = (row.get('full_name') or '').strip()
+    if not full_name:
+        raise ValidationError('Не указано ФИО получателя')
+    if len(full_name) > ReceiverMailing._meta.get_field('full_name').max_length:
+        raise ValidationError('Слишком длинное ФИО получателя')
+    comm = (row.get('comm') or '').strip() or None
+    return email, full_name, comm
+
+
+def _insert_batch_postgresql(rows, owner):
+    """Загружает пачку через COPY во временную таблицу и переносит ее одним INSERT ... ON CONFLICT"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    table = ReceiverMailing._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} '
+            f'(email varchar(254), full_name varchar(150), comm text) ON COMMIT DELETE ROWS'
+        )
+        copy_from(cursor, f'COPY {STAGING_TABLE} (email, full_name, comm) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} (email, full_name, comm, owner_id) '
+            f'SELECT DISTINCT ON (email) email, full_name, comm, %s FROM {STAGING_TABLE} '
+            f'ORDER BY email '
+            f'ON CONFLICT (email) DO NOTHING',
+            [owner.pk],
+        )
+        return cursor.rowcount
+
+
+def _insert_batch_orm(rows, owner):
+    unique = {email: (full_name, comm) for email, full_name, comm in rows}
+    existing = set(ReceiverMailing.objects.filter(email__in=unique).values_list('email', flat=True))
+    ReceiverMailing.objects.bulk_create(
+        [
+            ReceiverMailing(email=email, full_name=full_name, comm=comm, owner=owner)
+            for email, (full_name, comm) in unique.items()
+            if email not in existing
+        ],
+        ignore_conflicts=True,
+    )
+    return len(unique.keys() - existing)
+
+
+def import_receivers(fileobj, owner, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Импортирует получателей из CSV с колонками email, full_name, comm.
+
+    Файл читается построчно и загружается пачками, поэтому целиком в памяти не хранится.
+    Email, которые уже есть в базе, пропускаются. progress(result) вызывается после каждой пачки.
+    """
+    if isinstance(fileobj, io.TextIOBase):
+        text = fileobj
+    else:
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+    reader = csv.DictReader(text)
+    if not reader.fieldnames or 'email' not in reader.fieldnames:
+        raise ValidationError('В файле должна быть строка заголовка с колонкой email')
+
+    insert_batch = _insert_batch_postgresql if is_postgresql() else _insert_batch_orm
+    result = ImportResult()
+    numbered = enumerate(reader, start=2)
+
+    while True:
+        chunk = list(islice(numbered, batch_size))
+        if not chunk:
+            break
+
+        rows = []
+        for line, row in chunk:
+            try:
+                rows.append(normalize_row(row))
+            except ValidationError as e:
+                result.add_error(line, '; '.join(e.messages))
+
+        if rows:
+            result.created += insert_batch(rows, owner)
+        result.processed += len(chunk)
+
+        if progress:
+            progress(result)
+
+    return result
@@ -0,0 +1,93 @@
+"""
+Массовые операции со связями многие-ко-многим одним SQL-запросом.
+
+Связи добавляются через INSERT ... SELECT, удаляются и сравниваются через
+подзапросы, поэтому ни текущие, ни новые связи не загружаются в Python.
+Поле передается дескриптором модели (например, Mailing.receivers), а
+связываемые объекты - выборкой (QuerySet), а не списком.
+"""
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import F
+
+
+def link_table(descriptor):
+    """Имена промежуточной таблицы и ее колонок: (таблица, объект с полем, связанный объект)"""
+    field = descriptor.field
+    quote = connection.ops.quote_name
+    return (
+        quote(descriptor.through._meta.db_table),
+        quote(field.m2m_column_name()),
+        quote(field.m2m_reverse_name()),
+    )
+
+
+def select_pks(queryset):
+    """(SQL, параметры) подзапроса с колонкой link_pk - первичными ключами выборки, или None для пустой выборки"""
+    try:
+        return queryset.values(link_pk=F('pk')).query.sql_with_params()
+    except EmptyResultSet:
+        return None
+
+
+def add_links(descriptor, source_id, queryset):
+    """Связывает объект со всеми объектами выборки, существующие связи пропускает. Возвращает число новых"""
+    select = select_pks(queryset)
+    if select is None:
+        return 0
+    sql, params = select
+    table, source, target = link_table(descriptor)
+    with connection.cursor() as cursor:
+        # WHERE true нужен SQLite, чтобы не принять ON CONFLICT за часть SELECT
+        cursor.execute(
+            f'INSERT INTO {table} ({source}, {target}) '
+            f'SELECT %s, selected.link_pk FROM ({sql}) AS selected WHERE true '
+            f'ON CONFLICT DO NOTHING',
+            (source_id, *params),
+        )
+        return cursor.rowcount
+
+
+def remove_links(descriptor, source_id, queryset):
+    """Удаляет связи объекта с объектами выборки. Возвращает число удаленных"""
+    select = select_pks(queryset)
+    if select is None:
+        return 0
+    sql, params = select
+    table, source, target = link_table(descriptor)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {source} = %s AND {target} IN ({sql})',
+            (source_id, *params),
+        )
+        return cursor.rowcount
+
+
+def replace_links(descriptor, source_id, queryset):
+    """Оставляет у объекта связи ровно с объектами выборки. Возвращает (добавлено, удалено)"""
+    select = select_pks(queryset)
+    table, source, target = link_table(descriptor)
+    with connection.cursor() as cursor:
+        if select is None:
+            cursor.execute(f'DELETE FROM {table} WHERE {source} = %s', (source_id,))
+            return 0, cursor.rowcount
+        sql, params = select
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {source} = %s AND {target} NOT IN ({sql})',
+            (source_id, *params),
+        )
+        removed = cursor.rowcount
+    return add_links(descriptor, source_id, queryset), removed
+
+
+def copy_links(descriptor, from_id, to_id):
+    """Копирует связи одного объекта другому. Возвращает число скопированных"""
+    table, source, target = link_table(descriptor)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({source}, {target}) '
+            f'SELECT %s, {target} FROM {table} WHERE {source} = %s '
+            f'ON CONFLICT DO NOTHING',
+            (to_id, from_id),
+        )
+        return cursor.rowcount
@@ -0,0 +1,55 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from mailing.importers import DEFAULT_BATCH_SIZE, import_receivers
+from user.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Импортирует получателей рассылок из CSV (колонки email, full_name, comm)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Путь к CSV-файлу'
+        )
+        parser.add_argument(
+            '--owner',
+            required=True,
+            help='Email пользователя-владельца получателей'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Количество строк в пачке (по умолчанию {DEFAULT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            owner = CustomUser.objects.get(email=options['owner'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"Пользователь {options['owner']} не найден")
+
+        def progress(result):
+            self.stdout.write(
+                f"Обработано строк: {result.processed}, добавлено: {result.created}, ошибок: {result.invalid}"
+            )
+
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                result = import_receivers(fileobj, owner, options['batch_size'], progress)
+        except (OSError, ValidationError, UnicodeDecodeError) as e:
+            raise CommandError(f"Ошибка импорта: {e}")
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.ERROR(f"✗ Строка {line}: {message}"))
+        if result.invalid > len(result.errors):
+            self.stdout.write(self.style.ERROR(f"... и еще ошибок: {result.invalid - len(result.errors)}"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\n✓ ИМПОРТ ЗАВЕРШЕН!\n"
+            f"Обработано строк: {result.processed}\n"
+            f"Добавлено получателей: {result.created}\n"
+            f"Уже существовали: {result.skipped}\n"
+            f"Ошибок: {result.invalid}"
+        ))
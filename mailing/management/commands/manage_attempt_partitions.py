@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from mailing import partitions
+from mailing.pg import is_postgresql
+
+
+class Command(BaseCommand):
+    help = 'Создает будущие помесячные партиции попыток рассылок и отсоединяет/архивирует старые'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='На сколько месяцев вперед создавать партиции (по умолчанию 3)'
+        )
+        parser.add_argument(
+            '--retention-months',
+            type=int,
+            help='Сколько месяцев хранить попытки; более старые партиции отсоединяются'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Каталог для выгрузки отсоединенных партиций в .csv.gz (после выгрузки таблица удаляется)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет сделано'
+        )
+
+    def handle(self, *args, **options):
+        if not is_postgresql():
+            raise CommandError('Секционирование попыток рассылок поддерживается только для PostgreSQL')
+
+        months_ahead = options['months_ahead']
+        retention = options['retention_months']
+        archive_dir = options['archive_dir']
+        dry_run = options['dry_run']
+
+        if dry_run:
+            with connection.cursor() as cursor:
+                existing = partitions.list_partitions(cursor)
+            self.stdout.write(f"Существующие партиции: {len(existing)}")
+        else:
+            for name in partitions.ensure_partitions(months_ahead):
+                self.stdout.write(self.style.SUCCESS(f"✓ Создана партиция {name}"))
+
+        if retention is None:
+            return
+
+        for name in partitions.expired_partitions(retention):
+            if dry_run:
+                action = 'архивирована' if archive_dir else 'отсоединена'
+                self.stdout.write(f"Партиция {name} будет {action}")
+                continue
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                partitions.detach_partition(cursor, name)
+                self.stdout.write(self.style.WARNING(f"✓ Партиция {name} отсоединена"))
+                if archive_dir:
+                    path = partitions.archive_partition(cursor, name, archive_dir)
+                    self.stdout.write(self.style.SUCCESS(f"✓ Партиция {name} выгружена в {path}"))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from mailing.models import Mailing
+from user.models import CustomUser
+
+
+def mailing_count_subquery(*filters):
+    """Подзапрос с количеством рассылок пользователя"""
+    return Coalesce(
+        Subquery(
+            Mailing.objects.filter(*filters, owner=OuterRef('pk'))
+            .order_by()
+            .values('owner')
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def recount_mailing_counters(users=None):
+    """Пересчитывает денормализованные счетчики рассылок одним UPDATE"""
+    if users is None:
+        users = CustomUser.objects.all()
+    with transaction.atomic():
+        return users.update(
+            mailing_count=mailing_count_subquery(),
+            active_mailing_count=mailing_count_subquery(Q(status=Mailing.Status.RUNNING)),
+        )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики рассылок пользователей (mailing_count, active_mailing_count)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            dest='emails',
+            action='append',
+            help='Email пользователя (можно указать несколько раз); по умолчанию - все пользователи'
+        )
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.all()
+        if options['emails']:
+            users = users.filter(email__in=options['emails'])
+
+        updated = recount_mailing_counters(users)
+        self.stdout.write(self.style.SUCCESS(f"✓ Счетчики пересчитаны для пользователей: {updated}"))
@@ -0,0 +1,40 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mailing.rollups import rollup_attempts
+
+
+class Command(BaseCommand):
+    help = 'Агрегирует попытки рассылок в дневную статистику (с места последнего запуска)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag-minutes',
+            type=int,
+            default=5,
+            help='Не агрегировать последние N минут, пока в них еще пишутся попытки (по умолчанию 5)'
+        )
+        parser.add_argument(
+            '--since',
+            type=datetime.date.fromisoformat,
+            help='Пересчитать статистику начиная с даты (ГГГГ-ММ-ДД)'
+        )
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since:
+            since = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+
+        days = rollup_attempts(lag=datetime.timedelta(minutes=options['lag_minutes']), since=since)
+
+        if since and days and days[0] > timezone.localdate(since):
+            self.stdout.write(self.style.WARNING(
+                f"Статистика до {days[0]} не пересчитывалась: попытки за эти дни уже удалены"
+            ))
+        if days:
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Статистика пересчитана за {len(days)} дн.: с {days[0]} по {days[-1]}"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING("Нет попыток рассылок для агрегации"))
@@ -0,0 +1,78 @@
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mailing.scheduler import claim_due_mailings, complete_occurrence, occurrence_finished, occurrence_key
+
+
+class Command(BaseCommand):
+    help = 'Запускает повторяющиеся рассылки, время которых подошло'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько рассылок захватывать за раз (по умолчанию 100)'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, проверяя расписание каждые --interval секунд'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=30,
+            help='Пауза между проверками в режиме --loop, секунды (по умолчанию 30)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            dispatched = self.run_due(options['batch_size'])
+            if not options['loop']:
+                break
+            # Если захватили полный пакет, в очереди могут быть еще рассылки - проверяем сразу
+            if dispatched < options['batch_size']:
+                time.sleep(options['interval'])
+
+    def run_due(self, batch_size):
+        """Запускает подошедшие рассылки пакетами, возвращает число захваченных"""
+        total = 0
+        while True:
+            mailings = claim_due_mailings(batch_size)
+            total += len(mailings)
+            for mailing in mailings:
+                self.run_mailing(mailing)
+            if len(mailings) < batch_size:
+                break
+        if total:
+            self.stdout.write(self.style.SUCCESS(f"✓ Запущено рассылок по расписанию: {total}"))
+        return total
+
+    def run_mailing(self, mailing):
+        if mailing.owner_id and not mailing.owner.is_active:
+            # Запуск пропускаем и назначаем следующий
+            complete_occurrence(mailing)
+            self.stdout.write(self.style.WARNING(f"✗ Рассылка #{mailing.id}: владелец заблокирован"))
+            return
+        if mailing.status in (mailing.Status.DISABLED, mailing.Status.BLOCKED):
+            complete_occurrence(mailing)
+            return
+        # Ключ по времени запуска: если этот запуск уже выполнялся, письма не уйдут повторно
+        key = occurrence_key(mailing)
+        try:
+            call_command('start_mailing', str(mailing.id), key=key, stdout=StringIO())
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"✗ Рассылка #{mailing.id}: {e}"))
+            return
+        if not occurrence_finished(mailing, key):
+            retry_at = timezone.localtime(mailing.claimed_until)
+            self.stderr.write(self.style.ERROR(
+                f"✗ Рассылка #{mailing.id}: запуск не завершен, повтор после {retry_at:%H:%M}"
+            ))
+            return
+        complete_occurrence(mailing)
+        self.stdout.write(f"Рассылка #{mailing.id} запущена, следующий запуск: {mailing.next_run_at or 'нет'}")
@@ -1,9 +1,36 @@
 from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
 from django.utils import timezone
 from django.conf import settings
-from mailing.models import Mailing, MailingAttempt
+from djangocourseproject.metrics import registry
+from django.db import transaction
+from mailing.models import Mailing, MailingAttempt, MailingRun
+from mailing.signals import adjust_mailing_counters
+from mailing.timing import StageTimer
+from user.models import CustomUser
 import smtplib
+import time
+import uuid
+
+# Сколько попыток накапливать перед записью в БД
+ATTEMPT_BATCH_SIZE = 500
+# Не реже чем раз в столько секунд попытки записываются, а аренда запуска продлевается
+RENEW_INTERVAL = 60
+
+
+class RunAborted(Exception):
+    """Запуск прерван, пока шла отправка: его результаты не записываются"""
+
+
+class PreparedEmailMessage(EmailMessage):
+    """Письмо, MIME-представление которого собирается один раз"""
+    _prepared = None
+
+    def message(self, **kwargs):
+        if self._prepared is None:
+            self._prepared = super().message(**kwargs)
+        return self._prepared
 
 
 class Command(BaseCommand):
@@ -15,14 +42,18 @@ class Command(BaseCommand):
             type=int,
             help='ID рассылки для запуска'
         )
+        parser.add_argument(
+            '--key',
+            help='Ключ запуска: повторный запуск с тем же ключом не отправит письма заново'
+        )
 
     def handle(self, *args, **options):
         mailing_id = options['mailing_id']
 
         try:
             # Получаем рассылку
-            mailing = Mailing.objects.get(id=mailing_id)
-            self.stdout.write(f"Найдена рассылка #{mailing.id} - Статус: {mailing.status}")
+            mailing = Mailing.objects.select_related('message').get(id=mailing_id)
+            self.stdout.write(f"Найдена рассылка #{mailing.id} - Статус: {mailing.get_status_display()}")
             self.stdout.write(f"Сообщение: '{mailing.message.topic}'")
 
             # Проверка времени
@@ -37,86 +68,132 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR("✗ Неподходящее время для рассылки!"))
                 return
 
-            # Получаем всех связанных получателей
-            receivers = mailing.receivers.all()
-            self.stdout.write(f"✓ Найдено получателей: {receivers.count()}")
-
-            if not receivers.exists():
-                self.stdout.write(self.style.WARNING("✗ Нет получателей для рассылки"))
+            # Второй запуск той же рассылки не отправляет письма, а показывает ход первого
+            run, created = MailingRun.acquire(mailing.id, options['key'] or uuid.uuid4().hex)
+            if not created:
+                self.stdout.write(self.style.WARNING(
+                    f"✗ Рассылка уже запускалась (запуск #{run.pk}, {run.get_status_display().lower()}): "
+                    f"обработано {run.processed} из {run.total}"
+                ))
                 return
 
-            # Отображаем получателей
-            self.stdout.write("Список получателей:")
-            for receiver in receivers:
-                self.stdout.write(f"  - {receiver.full_name} <{receiver.email}>")
+            try:
+                # Получателей из сегментов и отдельных получателей раскрываем одним запросом
+                timer = StageTimer()
+                with timer.stage('fetch'):
+                    receivers = list(mailing.get_recipients().only('email', 'full_name', 'comm'))
+                self.stdout.write(f"✓ Найдено получателей: {len(receivers)}")
+                run.renew(total=len(receivers))
+
+                if not receivers:
+                    run.finish()
+                    # Пустой запуск тоже считается последним: кнопка запуска получит новый ключ
+                    self.set_last_run(mailing, run, 0, 0, timer)
+                    mailing.save(update_fields=['stats'])
+                    self.stdout.write(self.style.WARNING("✗ Нет получателей для рассылки"))
+                    return
+
+                # Отображаем получателей
+                self.stdout.write("Список получателей:")
+                for receiver in receivers:
+                    self.stdout.write(f"  - {receiver.full_name} <{receiver.email}>")
 
-            # Запускаем рассылку
-            self.process_mailing(mailing, receivers)
+                # Запускаем рассылку
+                self.process_mailing(mailing, run, receivers, timer)
+            except Exception as e:
+                run.finish(MailingRun.Status.FAILED, str(e))
+                raise
 
         except Mailing.DoesNotExist:
             self.stdout.write(self.style.ERROR(f"Рассылка с ID {mailing_id} не найдена"))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Ошибка: {str(e)}"))
 
-    def process_mailing(self, mailing, receivers):
-        """Обрабатывает рассылку для всех получателей"""
+    def process_mailing(self, mailing, run, receivers, timer):
+        """Обрабатывает рассылку для всех получателей через одно SMTP-соединение"""
         success_count = 0
         fail_count = 0
         messages_count = 0
 
-        # Обновляем статус рассылки
-        mailing.status = 'Запущена'
-        mailing.save()
+        # Обновляем статус рассылки, если его не изменили после загрузки
+        if not self.set_status(mailing, Mailing.Status.RUNNING) and mailing.status != Mailing.Status.RUNNING:
+            raise RunAborted(f"Статус рассылки #{mailing.pk} изменился: {mailing.get_status_display()}")
 
         message = mailing.message
         self.stdout.write(f"\nНачинаю отправку сообщения: '{message.topic}'")
         self.stdout.write("-" * 50)
 
-        for receiver in receivers:
-            # Отправляем письмо каждому получателю
-            result = self.send_email_to_receiver(message, receiver)
+        connection = get_connection(fail_silently=False)
+        connection_error = None
+        with timer.stage('smtp_connect'):
+            try:
+                connection.open()
+            except (smtplib.SMTPException, OSError) as e:
+                connection_error = f"Ошибка подключения: {str(e)}"
 
-            if result['success']:
-                success_count += 1
-                self.stdout.write(self.style.SUCCESS(
-                    f"✓ {receiver.email}: отправлено успешно"
-                ))
-                # Создаем успешную попытку для каждого получателя
-                MailingAttempt.objects.create(
-                    mailing=mailing,
-                    status='Успешно',
-                    server_response=result.get('response', 'Успешно')
-                )
-            else:
-                fail_count += 1
-                self.stdout.write(self.style.ERROR(
-                    f"✗ {receiver.email}: ошибка"
-                ))
-                # Создаем неуспешную попытку для каждого получателя
-                MailingAttempt.objects.create(
-                    mailing=mailing,
-                    status='Не успешно',
-                    server_response=result.get('response', 'Неизвестная ошибка')
-                )
+        attempts = []
+        renew_at = time.monotonic() + RENEW_INTERVAL
+        try:
+            for receiver in receivers:
+                # Отправляем письмо каждому получателю
+                if connection_error:
+                    result = {'success': False, 'response': connection_error}
+                else:
+                    result = self.send_email_to_receiver(connection, message, receiver, timer)
+
+                if result['success']:
+                    success_count += 1
+                    self.stdout.write(self.style.SUCCESS(
+                        f"✓ {receiver.email}: отправлено успешно"
+                    ))
+                    status = MailingAttempt.Status.SUCCESS
+                else:
+                    fail_count += 1
+                    self.stdout.write(self.style.ERROR(
+                        f"✗ {receiver.email}: ошибка"
+                    ))
+                    status = MailingAttempt.Status.FAILED
+
+                # Попытки пишем пачками, а не отдельным INSERT на каждого получателя
+                attempts.append(MailingAttempt(mailing=mailing, status=status, server_response=result['response']))
+                if len(attempts) >= ATTEMPT_BATCH_SIZE or time.monotonic() >= renew_at:
+                    if not self.write_attempts(run, attempts, success_count, fail_count, timer):
+                        raise RunAborted(f"Запуск #{run.pk} прерван, отправка остановлена")
+                    attempts = []
+                    renew_at = time.monotonic() + RENEW_INTERVAL
+        finally:
+            connection.close()
+            written = self.write_attempts(run, attempts, success_count, fail_count, timer)
+        if not written:
+            raise RunAborted(f"Запуск #{run.pk} прерван, результаты не записаны")
 
         messages_count = success_count + fail_count
 
         # Обновляем статус рассылки после отправки
         self.stdout.write("-" * 50)
 
-        # Получаем владельца рассылки
-        owner = mailing.owner
+        # Счетчики владельца обновляем одним UPDATE и только если запуск не прерван
+        with transaction.atomic():
+            if not run.finish():
+                raise RunAborted(f"Запуск #{run.pk} прерван, счетчики не обновлены")
+            if mailing.owner_id:
+                CustomUser.objects.filter(pk=mailing.owner_id).update(
+                    successful_mailing_count=F('successful_mailing_count') + success_count,
+                    unsuccessful_mailing_count=F('unsuccessful_mailing_count') + fail_count,
+                    messages_count=F('messages_count') + messages_count,
+                )
 
-        # Обновляем счетчики пользователя
-        if owner:
-            owner.successful_mailing_count = (owner.successful_mailing_count or 0) + success_count
-            owner.unsuccessful_mailing_count = (owner.unsuccessful_mailing_count or 0) + fail_count
-            owner.messages_count = (owner.messages_count or 0) + messages_count
-            owner.save()
+        # Отчет по этапам отправки сохраняем у рассылки и отдаем в метрики
+        self.set_last_run(mailing, run, success_count, fail_count, timer)
 
         if success_count > 0 or fail_count > 0:
-            mailing.status = 'Завершена'
-            mailing.save()
+            # Повторяющаяся рассылка остается запущенной до последнего запуска по расписанию
+            next_run = mailing.get_next_run(after=timezone.now())
+            status = Mailing.Status.RUNNING if next_run else Mailing.Status.FINISHED
+            if not self.set_status(mailing, status, stats=mailing.stats):
+                self.stdout.write(self.style.WARNING(
+                    f"Статус рассылки изменен во время отправки: {mailing.get_status_display()}"
+                ))
 
             self.stdout.write(self.style.SUCCESS(
                 f"\n✓ РАССЫЛКА ЗАВЕРШЕНА!\n"
@@ -125,29 +202,93 @@ class Command(BaseCommand):
                 f"Общее количество сообщений: {messages_count}"
             ))
         else:
+            mailing.save(update_fields=['stats'])
             self.stdout.write(self.style.ERROR(
                 "\n✗ НИ ОДНОГО ПИСЬМА НЕ ОТПРАВЛЕНО!"
             ))
 
-    def send_email_to_receiver(self, message, receiver):
+        self.stdout.write("\nВремя по этапам:")
+        for line in timer.report_lines():
+            self.stdout.write(line)
+
+        # Команда не проходит через middleware метрик, поэтому сбрасываем их сразу
+        registry.flush()
+
+    def set_status(self, mailing, status, **values):
+        """Записывает статус, только если в БД он тот же, что был при загрузке рассылки.
+
+        Пока шла отправка, менеджер мог отключить рассылку или заблокировать владельца;
+        тогда статус не перезаписывается, а перечитывается из БД. Поля values записываются
+        в любом случае. Возвращает True, если статус записан.
+        """
+        loaded = mailing._loaded_status
+        mailing.status = status
+        with transaction.atomic():
+            updated = Mailing.objects.filter(pk=mailing.pk, status=loaded).update(
+                status=status, next_run_at=mailing.get_next_run(), **values,
+            )
+            if updated:
+                # Сигнал post_save при update не приходит - счетчик активных рассылок меняем сами
+                active = int(status == Mailing.Status.RUNNING) - int(loaded == Mailing.Status.RUNNING)
+                adjust_mailing_counters(mailing.owner_id, active=active)
+        if not updated:
+            if values:
+                Mailing.objects.filter(pk=mailing.pk).update(**values)
+            mailing.refresh_from_db(fields=['status', 'next_run_at'])
+        mailing._loaded_status = mailing.status
+        return bool(updated)
+
+    def set_last_run(self, mailing, run, success_count, fail_count, timer):
+        """Отчет о завершенном запуске; по run_id страница рассылки строит ключ следующего запуска"""
+        mailing.stats = {
+            **(mailing.stats or {}),
+            'last_run': {
+                'run_id': run.pk,
+                'finished_at': timezone.now().isoformat(),
+                'sent': success_count,
+                'failed': fail_count,
+                'stages': timer.summary(),
+            },
+        }
+
+    def write_attempts(self, run, attempts, success_count, fail_count, timer):
+        """Записывает попытки и продлевает аренду запуска. False, если запуск уже прерван"""
+        with timer.stage('attempt_write'), transaction.atomic():
+            if not run.renew(sent=success_count, failed=fail_count):
+                return False
+            MailingAttempt.objects.bulk_create(attempts)
+        return True
+
+    def send_email_to_receiver(self, connection, message, receiver, timer):
         """Отправляет email конкретному получателю и возвращает ответ сервера"""
         try:
             # Персонализируем сообщение
-            personalized_body = f"Здравствуйте, {receiver.full_name}!\n\n"
-            personalized_body += message.text
+            with timer.stage('personalize'):
+                personalized_body = f"Здравствуйте, {receiver.full_name}!\n\n"
+                personalized_body += message.text
 
-            if receiver.comm:
-                personalized_body += f"\n\nПримечание: {receiver.comm}"
+                if receiver.comm:
+                    personalized_body += f"\n\nПримечание: {receiver.comm}"
 
-            personalized_body += "\n\n--\nЭто сообщение отправлено автоматически"
+                personalized_body += "\n\n--\nЭто сообщение отправлено автоматически"
 
-            send_mail(
-                subject=message.topic,
-                message=personalized_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[receiver.email],
-                fail_silently=False  # Не игнорировать ошибки
-            )
+            with timer.stage('mime'):
+                email = PreparedEmailMessage(
+                    subject=message.topic,
+                    body=personalized_body,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=[receiver.email],
+                    connection=connection,
+                )
+                email.message()
+
+            with timer.stage('smtp_send'):
+                try:
+                    connection.send_messages([email])
+                except smtplib.SMTPServerDisconnected:
+                    # Следующее письмо откроет соединение заново
+                    connection.close()
+                    raise
 
             if settings.EMAIL_BACKEND == 'django.core.mail.backends.console.EmailBackend':
                 response = "Email отправлен в консоль (режим тестирования)"
@@ -0,0 +1,141 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from djangocourseproject.routers import read_from_replica
+from mailing.timing import percentile
+from mailing.views import Home, MailingListView, MessageListView, ReceiverListView, UserListView
+from user.models import CustomUser
+from user.roles import aget_user_roles
+
+# Списки, которые пользователь видит первыми после входа
+LIST_VIEWS = (ReceiverListView, MessageListView, MailingListView)
+
+
+async def warm_user(user):
+    """Кеширует роли, статистику главной страницы и списки пользователя"""
+    await aget_user_roles(user)
+    await Home().aget_stats(user)
+    for view_class in LIST_VIEWS:
+        await view_class().aget_rows(user)
+
+
+async def awarm_users(users, deadline):
+    durations, errors = [], []
+    for user in users:
+        if time.monotonic() >= deadline:
+            break
+        start = time.monotonic()
+        try:
+            await warm_user(user)
+        except Exception as e:
+            errors.append(f"{user.email}: {e}")
+        else:
+            durations.append(time.monotonic() - start)
+    return durations, errors
+
+
+def warm_users(users, deadline):
+    """Прогревает кеш для части пакета в отдельном потоке со своим соединением с БД.
+
+    Возвращает время на каждого прогретого пользователя (секунды) и ошибки.
+    """
+    try:
+        return async_to_sync(awarm_users)(users, deadline)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Заранее заполняет кеш главной страницы, списков и сводок менеджера для недавно активных пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Прогревать пользователей, входивших за последние N дней (по умолчанию 7)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=1000,
+            help='Не больше N пользователей, начиная с последних вошедших (по умолчанию 1000)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Сколько пользователей прогревать параллельно (по умолчанию 4)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько пользователей загружать из БД за раз (по умолчанию 100)'
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=60,
+            help='Остановиться через N секунд, даже если прогреты не все (по умолчанию 60)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        deadline = started + options['time_budget']
+        concurrency = max(1, options['concurrency'])
+
+        # Сводки менеджера общие для всех - считаем один раз
+        with read_from_replica():
+            view = UserListView()
+            view.get_rows()
+            view.get_stats()
+        self.stdout.write("✓ Список и статистика пользователей для менеджеров")
+
+        users = (
+            CustomUser.objects
+            .filter(is_active=True, last_login__gte=timezone.now() - timedelta(days=options['days']))
+            .order_by('-last_login')[:options['limit']]
+        )
+
+        total = users.count()
+        durations, errors = [], []
+        batch = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for user in users.iterator(chunk_size=options['batch_size']):
+                batch.append(user)
+                if len(batch) >= options['batch_size']:
+                    self.warm_batch(executor, batch, concurrency, deadline, durations, errors)
+                    batch = []
+                    if time.monotonic() >= deadline:
+                        break
+            self.warm_batch(executor, batch, concurrency, deadline, durations, errors)
+        # Пользователи, до которых не дошли из-за ограничения по времени
+        skipped = total - len(durations) - len(errors)
+
+        for error in errors:
+            self.stderr.write(self.style.ERROR(f"✗ {error}"))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Кеш прогрет для пользователей: {len(durations)} за {elapsed:.1f} с"
+        ))
+        if durations:
+            self.stdout.write(
+                f"Время на пользователя: среднее {sum(durations) / len(durations) * 1000:.1f} мс, "
+                f"p95 {percentile(sorted(durations), 0.95) * 1000:.1f} мс"
+            )
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Не успели прогреть за отведенное время: {skipped}"))
+
+    def warm_batch(self, executor, batch, concurrency, deadline, durations, errors):
+        """Делит пакет между потоками и ждет, пока все они закончат"""
+        parts = [part for part in (batch[i::concurrency] for i in range(concurrency)) if part]
+        for part_durations, part_errors in executor.map(warm_users, parts, [deadline] * len(parts)):
+            durations.extend(part_durations)
+            errors.extend(part_errors)
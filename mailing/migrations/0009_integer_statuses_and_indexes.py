@@ -0,0 +1,101 @@
+# Generated by Django 6.0 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+MAILING_STATUSES = {
+    'Создана': 1,
+    'Запущена': 2,
+    'Завершена': 3,
+    'Отключена менеджером': 4,
+    'Заблокирована': 5,
+}
+
+ATTEMPT_STATUSES = {
+    'Успешно': 1,
+    'success': 1,
+    'Не успешно': 2,
+    'failed': 2,
+}
+
+
+def statuses_to_codes(apps, schema_editor):
+    Mailing = apps.get_model('mailing', 'Mailing')
+    MailingAttempt = apps.get_model('mailing', 'MailingAttempt')
+
+    for label, code in MAILING_STATUSES.items():
+        Mailing.objects.filter(status=label).update(status_code=code)
+    for label, code in ATTEMPT_STATUSES.items():
+        MailingAttempt.objects.filter(status=label).update(status_code=code)
+
+
+def codes_to_statuses(apps, schema_editor):
+    Mailing = apps.get_model('mailing', 'Mailing')
+    MailingAttempt = apps.get_model('mailing', 'MailingAttempt')
+
+    for label, code in MAILING_STATUSES.items():
+        Mailing.objects.filter(status_code=code).update(status=label)
+    for label in ('Успешно', 'Не успешно'):
+        MailingAttempt.objects.filter(status_code=ATTEMPT_STATUSES[label]).update(status=label)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0008_alter_mailing_options_alter_mailingattempt_options_and_more'),
+        # Счетчики пользователей заполняются по строковым статусам
+        ('user', '0004_customuser_mailing_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='mailingattempt',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.RunPython(statuses_to_codes, codes_to_statuses),
+        migrations.RemoveField(
+            model_name='mailing',
+            name='status',
+        ),
+        migrations.RemoveField(
+            model_name='mailingattempt',
+            name='status',
+        ),
+        migrations.RenameField(
+            model_name='mailing',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.RenameField(
+            model_name='mailingattempt',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.AlterField(
+            model_name='mailing',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Создана'), (2, 'Запущена'), (3, 'Завершена'), (4, 'Отключена менеджером'), (5, 'Заблокирована')], default=1, verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='mailingattempt',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')], verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'status'], name='mailing_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'start_time'], name='mailing_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['mailing', '-attempt_time'], name='attempt_mailing_time_idx'),
+        ),
+    ]
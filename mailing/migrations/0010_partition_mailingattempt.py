@@ -0,0 +1,105 @@
+# Generated by Django 6.0 on 2026-10-19 12:45
+
+import datetime
+
+from django.db import migrations
+
+TABLE = 'mailing_mailingattempt'
+SEQUENCE = 'mailing_mailingattempt_part_id_seq'
+COLUMNS = 'id, attempt_time, server_response, mailing_id, status'
+MONTHS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_table(apps, schema_editor):
+    """Превращает таблицу попыток в помесячно секционированную (PostgreSQL)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    execute = schema_editor.execute
+    execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_legacy')
+    execute(f'CREATE SEQUENCE {SEQUENCE}')
+    execute(
+        f"SELECT setval('{SEQUENCE}', COALESCE((SELECT MAX(id) FROM {TABLE}_legacy), 0) + 1, false)"
+    )
+    execute(f"""
+        CREATE TABLE {TABLE} (
+            id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+            attempt_time timestamp with time zone NOT NULL,
+            server_response text NOT NULL,
+            mailing_id bigint NOT NULL,
+            status smallint NOT NULL CHECK (status >= 0),
+            PRIMARY KEY (id, attempt_time),
+            CONSTRAINT {TABLE}_mailing_id_fk FOREIGN KEY (mailing_id)
+                REFERENCES mailing_mailing (id) DEFERRABLE INITIALLY DEFERRED
+        ) PARTITION BY RANGE (attempt_time)
+    """)
+    execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+    execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(attempt_time) FROM {TABLE}_legacy')
+        oldest = cursor.fetchone()[0]
+
+    today = datetime.date.today()
+    current = datetime.date(today.year, today.month, 1)
+    month = datetime.date(oldest.year, oldest.month, 1) if oldest else current
+    last = add_months(current, MONTHS_AHEAD)
+    while month <= last:
+        execute(
+            f"CREATE TABLE {TABLE}_p{month.year:04d}_{month.month:02d} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+            f"TO ('{add_months(month, 1).isoformat()} 00:00:00+00')"
+        )
+        month = add_months(month, 1)
+
+    execute(f'INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}_legacy')
+    # Отложенные проверки внешнего ключа не дают строить индексы в этой же транзакции
+    execute('SET CONSTRAINTS ALL IMMEDIATE')
+    execute(f'DROP TABLE {TABLE}_legacy')
+    execute(f'CREATE INDEX attempt_mailing_time_idx ON {TABLE} (mailing_id, attempt_time DESC)')
+
+
+def unpartition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    execute = schema_editor.execute
+    execute(f"""
+        CREATE TABLE {TABLE}_plain (
+            id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            attempt_time timestamp with time zone NOT NULL,
+            server_response text NOT NULL,
+            mailing_id bigint NOT NULL REFERENCES mailing_mailing (id) DEFERRABLE INITIALLY DEFERRED,
+            status smallint NOT NULL CHECK (status >= 0)
+        )
+    """)
+    execute(f'INSERT INTO {TABLE}_plain ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}')
+    execute('SET CONSTRAINTS ALL IMMEDIATE')
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}_plain', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {TABLE}_plain), 0) + 1, false)"
+    )
+    execute(f'DROP TABLE {TABLE} CASCADE')
+    execute(f'ALTER TABLE {TABLE}_plain RENAME TO {TABLE}')
+    execute(f'CREATE INDEX {TABLE}_mailing_id_idx ON {TABLE} (mailing_id)')
+    execute(f'CREATE INDEX attempt_mailing_time_idx ON {TABLE} (mailing_id, attempt_time DESC)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0009_integer_statuses_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='mailingattempt',
+            options={'permissions': [('can_view_all_attempts', 'Может просматривать все попытки рассылок')], 'verbose_name': 'попытка рассылки', 'verbose_name_plural': 'попытки рассылки'},
+        ),
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
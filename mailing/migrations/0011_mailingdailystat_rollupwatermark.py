@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-19 13:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_partition_mailingattempt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+                ('position', models.DateTimeField(null=True, verbose_name='Обработано до')),
+            ],
+            options={
+                'verbose_name': 'отметка агрегации',
+                'verbose_name_plural': 'отметки агрегации',
+            },
+        ),
+        migrations.CreateModel(
+            name='MailingDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')], verbose_name='Статус')),
+                ('attempts_count', models.PositiveIntegerField(default=0, verbose_name='Количество попыток')),
+                ('mailing', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_stats', to='mailing.mailing', verbose_name='Рассылка')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Владелец')),
+            ],
+            options={
+                'verbose_name': 'дневная статистика рассылки',
+                'verbose_name_plural': 'дневная статистика рассылок',
+                'indexes': [models.Index(fields=['owner', 'day'], name='daily_stat_owner_day_idx'), models.Index(fields=['day'], name='daily_stat_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'mailing', 'status'), name='daily_stat_unique')],
+            },
+        ),
+    ]
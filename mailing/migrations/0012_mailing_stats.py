@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0011_mailingdailystat_rollupwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='stats',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Статистика отправки'),
+        ),
+    ]
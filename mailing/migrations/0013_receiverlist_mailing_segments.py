@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 17:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0012_mailing_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailing',
+            name='receivers',
+            field=models.ManyToManyField(blank=True, to='mailing.receivermailing'),
+        ),
+        migrations.CreateModel(
+            name='ReceiverList',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, verbose_name='Название')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Список'), (2, 'Фильтр')], default=1, verbose_name='Тип')),
+                ('email_domain', models.CharField(blank=True, max_length=100, verbose_name='Домен email')),
+                ('name_contains', models.CharField(blank=True, max_length=150, verbose_name='Имя содержит')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Владелец')),
+                ('receivers', models.ManyToManyField(blank=True, related_name='segments', to='mailing.receivermailing', verbose_name='Получатели')),
+            ],
+            options={
+                'verbose_name': 'сегмент получателей',
+                'verbose_name_plural': 'сегменты получателей',
+            },
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='segments',
+            field=models.ManyToManyField(blank=True, related_name='mailings', to='mailing.receiverlist', verbose_name='Сегменты'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-19 18:20
+
+import mailing.schedule
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0013_receiverlist_mailing_segments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний запуск'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Следующий запуск'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='recurrence',
+            field=models.CharField(blank=True, help_text='В формате cron ("0 9 * * 1" - по понедельникам в 9:00) или @daily, @weekly, @monthly', max_length=100, validators=[mailing.schedule.validate_recurrence], verbose_name='Расписание повторов'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(condition=models.Q(('next_run_at__isnull', False)), fields=['next_run_at'], name='mailing_next_run_idx'),
+        ),
+    ]
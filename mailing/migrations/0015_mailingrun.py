@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-19 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0014_mailing_recurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, verbose_name='Ключ запуска')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Выполняется'), (2, 'Завершен'), (3, 'Прерван')], default=1, verbose_name='Статус')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Закончен')),
+                ('lease_until', models.DateTimeField(verbose_name='Аренда до')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Получателей')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Отправлено')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='mailing.mailing', verbose_name='Рассылка')),
+            ],
+            options={
+                'verbose_name': 'запуск рассылки',
+                'verbose_name_plural': 'запуски рассылок',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 3), _negated=True), fields=('mailing', 'key'), name='mailing_run_key_unique'), models.UniqueConstraint(condition=models.Q(('status', 1)), fields=('mailing',), name='mailing_run_active_unique')],
+            },
+        ),
+    ]
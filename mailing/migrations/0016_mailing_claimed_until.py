@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0015_mailingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Захвачена до'),
+        ),
+    ]
@@ -1,5 +1,12 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Concat
+from django.db.models.lookups import IContains, IEndsWith
 from django.utils import timezone
+from mailing.m2m import copy_links
+from mailing.schedule import CronSchedule, validate_recurrence
 from user.models import CustomUser
 
 
@@ -23,6 +30,59 @@ class ReceiverMailing(models.Model):
             ("can_manage_receivers", "Может управлять получателями (для менеджеров)"),
         ]
 
+class ReceiverList(models.Model):
+    """Сегмент получателей: именованный список или сохраненный фильтр по получателям владельца"""
+
+    class Kind(models.IntegerChoices):
+        STATIC = 1, 'Список'
+        FILTER = 2, 'Фильтр'
+
+    name = models.CharField(max_length=150, verbose_name='Название')
+    kind = models.PositiveSmallIntegerField(choices=Kind.choices, default=Kind.STATIC, verbose_name='Тип')
+    owner = models.ForeignKey(CustomUser, verbose_name='Владелец', on_delete=models.CASCADE, null=True)
+    # Состав списка; для фильтра не используется
+    receivers = models.ManyToManyField(ReceiverMailing, blank=True, related_name='segments', verbose_name='Получатели')
+    # Условия фильтра; пустое условие не ограничивает выборку
+    email_domain = models.CharField(max_length=100, blank=True, verbose_name='Домен email')
+    name_contains = models.CharField(max_length=150, blank=True, verbose_name='Имя содержит')
+
+    def __str__(self):
+        return self.name
+
+    def get_receivers(self):
+        """Получатели сегмента одним запросом"""
+        return ReceiverMailing.objects.filter(receivers_condition(ReceiverList.objects.filter(pk=self.pk)))
+
+    class Meta:
+        verbose_name = 'сегмент получателей'
+        verbose_name_plural = 'сегменты получателей'
+
+
+def receivers_condition(segments, *other_ids):
+    """Условие на ReceiverMailing: получатель входит хотя бы в один из сегментов segments.
+
+    Статические списки раскрываются через промежуточную таблицу, фильтры - коррелированным
+    подзапросом по получателям владельцев этих фильтров, поэтому сегменты не загружаются
+    в Python и число получателей не важно. Ветки объединяются UNION, а не OR: так каждая
+    идет по своему индексу, а не проверяется на всех строках ReceiverMailing.
+    other_ids - дополнительные выборки pk получателей для того же UNION.
+    """
+    static = ReceiverList.receivers.through.objects.filter(
+        receiverlist__in=segments.filter(kind=ReceiverList.Kind.STATIC),
+    ).values('receivermailing_id')
+    filters = segments.filter(kind=ReceiverList.Kind.FILTER)
+    matching_filters = filters.filter(
+        owner_id=OuterRef('owner_id'),
+    ).filter(
+        Q(email_domain='') | IEndsWith(OuterRef('email'), Concat(Value('@'), F('email_domain'))),
+        Q(name_contains='') | IContains(OuterRef('full_name'), F('name_contains')),
+    )
+    matched = ReceiverMailing.objects.filter(
+        Exists(matching_filters), owner_id__in=filters.values('owner_id'),
+    ).values('pk')
+    return Q(pk__in=static.union(matched, *other_ids))
+
+
 class Message(models.Model):
 
     topic = models.CharField()
@@ -44,25 +104,108 @@ class Message(models.Model):
 
 class Mailing(models.Model):
 
+    class Status(models.IntegerChoices):
+        CREATED = 1, 'Создана'
+        RUNNING = 2, 'Запущена'
+        FINISHED = 3, 'Завершена'
+        DISABLED = 4, 'Отключена менеджером'
+        BLOCKED = 5, 'Заблокирована'
+
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
-    status = models.CharField(default='Создана')
+    status = models.PositiveSmallIntegerField(choices=Status.choices, default=Status.CREATED, verbose_name='Статус')
     owner = models.ForeignKey(CustomUser, verbose_name='Владелец', on_delete=models.CASCADE, null=True)
     message = models.ForeignKey(Message, verbose_name='Сообщение', on_delete=models.CASCADE, related_name='receivers')
-    receivers = models.ManyToManyField(ReceiverMailing)
+    # Отдельные получатели; основная аудитория задается сегментами
+    receivers = models.ManyToManyField(ReceiverMailing, blank=True)
+    segments = models.ManyToManyField(ReceiverList, blank=True, related_name='mailings', verbose_name='Сегменты')
+    # Отчет о последнем запуске: счетчики и время по этапам отправки
+    stats = models.JSONField(default=dict, blank=True, verbose_name='Статистика отправки')
+    # Повторяющаяся рассылка запускается по расписанию между start_time и end_time
+    recurrence = models.CharField(
+        max_length=100,
+        blank=True,
+        validators=[validate_recurrence],
+        verbose_name='Расписание повторов',
+        help_text='В формате cron ("0 9 * * 1" - по понедельникам в 9:00) или @daily, @weekly, @monthly',
+    )
+    # Заранее вычисленное время следующего запуска; NULL - запусков по расписанию больше нет
+    next_run_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Следующий запуск')
+    last_run_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Последний запуск')
+    # Планировщик захватил запуск next_run_at и выполняет его; после этого срока запуск захватят снова
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Захвачена до')
 
     def __str__(self):
-        return f'{self.status}'
+        return self.get_status_display()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходные значения, чтобы пересчитывать счетчики владельца
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_owner_id = instance.__dict__.get('owner_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None:
+            self.schedule()
+        # Сохранение и обновление счетчиков владельца (сигнал post_save) - в одной транзакции
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+        self._loaded_status = self.status
+        self._loaded_owner_id = self.owner_id
+
+    @property
+    def is_active(self):
+        return self.status == self.Status.RUNNING
+
+    def get_next_run(self, after=None):
+        """Следующий запуск по расписанию (позже after, если задан) или None.
+
+        Отсчитывается от последнего запуска, а не от текущего времени: запуск,
+        пропущенный, пока планировщик не работал, остается в прошлом и будет выполнен.
+        """
+        if not self.recurrence or self.status in (self.Status.DISABLED, self.Status.BLOCKED):
+            return None
+        # Первый запуск может прийтись ровно на start_time
+        after = max(moment for moment in (self.start_time - timedelta(minutes=1), self.last_run_at, after) if moment)
+        next_run = CronSchedule(self.recurrence).next_after(after)
+        if next_run is None or next_run > self.end_time:
+            return None
+        return next_run
+
+    def schedule(self):
+        self.next_run_at = self.get_next_run()
+
+    def get_recipients(self):
+        """Получатели рассылки: отдельные и из сегментов, без повторов"""
+        return recipients_of(Mailing.objects.filter(pk=self.pk))
+
+    def clone(self, start_time, end_time):
+        """Новая рассылка с тем же сообщением, расписанием, сегментами и получателями.
+
+        Связи копируются в БД запросом INSERT ... SELECT, сколько бы получателей ни было.
+        """
+        with transaction.atomic():
+            copy = Mailing(
+                start_time=start_time, end_time=end_time, recurrence=self.recurrence,
+                message_id=self.message_id, owner_id=self.owner_id,
+            )
+            copy.update_status()
+            copy.save()
+            copy_links(Mailing.segments, self.pk, copy.pk)
+            copy_links(Mailing.receivers, self.pk, copy.pk)
+        return copy
 
     def update_status(self):
         if timezone.now() < self.start_time:
-            self.status = 'Создана'
+            self.status = self.Status.CREATED
 
         elif self.start_time <= timezone.now() <= self.end_time:
-            self.status = 'Запущена'
+            self.status = self.Status.RUNNING
 
         elif timezone.now() > self.end_time:
-            self.status = 'Завершена'
+            self.status = self.Status.FINISHED
 
     class Meta:
         verbose_name = 'рассылка'
@@ -74,21 +217,150 @@ class Mailing(models.Model):
             ("can_disable_mailing", "Может отключать рассылки (для менеджеров)"),
             ("can_manage_all_mailings", "Может управлять всеми рассылками"),
         ]
+        indexes = [
+            # Списки рассылок владельца и счетчики по статусу
+            models.Index(fields=['owner', 'status'], name='mailing_owner_status_idx'),
+            # Планировщик: рассылки в нужном статусе по времени начала
+            models.Index(fields=['status', 'start_time'], name='mailing_status_start_idx'),
+            # Планировщик повторов: только рассылки, у которых есть следующий запуск
+            models.Index(
+                fields=['next_run_at'],
+                name='mailing_next_run_idx',
+                condition=Q(next_run_at__isnull=False),
+            ),
+        ]
+
+
+def recipients_of(mailings):
+    """Получатели всех рассылок из выборки mailings одним запросом, без повторов"""
+    direct = Mailing.receivers.through.objects.filter(mailing__in=mailings)
+    segments = ReceiverList.objects.filter(mailings__in=mailings)
+    return ReceiverMailing.objects.filter(receivers_condition(segments, direct.values('receivermailing_id')))
+
+
+class MailingRun(models.Model):
+    """Запуск рассылки: блокировка от повторной отправки и ход выполнения.
+
+    У рассылки может быть только один выполняющийся запуск - это обеспечивает
+    частичное уникальное ограничение в БД. Живой запуск продлевает аренду
+    lease_until при каждой записи результатов; запуск, который перестал ее
+    продлевать, считается упавшим, и следующий запуск его прерывает.
+
+    Блокировкой служит строка, а не advisory lock PostgreSQL: сессионная блокировка
+    держала бы соединение из пула все время отправки и не хранила бы ключ и ход запуска.
+    """
+
+    class Status(models.IntegerChoices):
+        RUNNING = 1, 'Выполняется'
+        FINISHED = 2, 'Завершен'
+        FAILED = 3, 'Прерван'
+
+    # Срок аренды; запуск продлевает ее при каждой записи пачки попыток
+    LEASE = timedelta(minutes=5)
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='runs', verbose_name='Рассылка')
+    # Ключ идемпотентности: повторный запуск с тем же ключом не отправляет письма заново
+    key = models.CharField(max_length=64, verbose_name='Ключ запуска')
+    status = models.PositiveSmallIntegerField(choices=Status.choices, default=Status.RUNNING, verbose_name='Статус')
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name='Начат')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Закончен')
+    lease_until = models.DateTimeField(verbose_name='Аренда до')
+    total = models.PositiveIntegerField(default=0, verbose_name='Получателей')
+    sent = models.PositiveIntegerField(default=0, verbose_name='Отправлено')
+    failed = models.PositiveIntegerField(default=0, verbose_name='Ошибок')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+
+    def __str__(self):
+        return f"Запуск #{self.pk} рассылки #{self.mailing_id} - {self.get_status_display()}"
+
+    @property
+    def is_running(self):
+        return self.status == self.Status.RUNNING
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @classmethod
+    def find(cls, mailing_id, key):
+        """Запуск с ключом key или выполняющийся запуск рассылки, если есть"""
+        runs = cls.objects.filter(
+            Q(key=key) & ~Q(status=cls.Status.FAILED) | Q(status=cls.Status.RUNNING), mailing_id=mailing_id,
+        )
+        # Не больше двух строк: запуск с ключом и выполняющийся; запуск с ключом важнее
+        return min(runs, key=lambda run: run.key != key, default=None)
+
+    @classmethod
+    def acquire(cls, mailing_id, key):
+        """Начинает запуск рассылки. Возвращает (запуск, создан ли он сейчас).
+
+        Если запуск с этим ключом уже был или рассылка сейчас выполняется,
+        возвращается существующий запуск и новый не создается.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # Блокировка строки рассылки выстраивает одновременные попытки запуска в очередь
+            list(Mailing.objects.select_for_update().filter(pk=mailing_id).values_list('pk'))
+            run = cls.find(mailing_id, key)
+            if run is not None and run.is_running and run.lease_until < now:
+                run.finish(cls.Status.FAILED, 'Запуск перестал отвечать')
+                run = cls.find(mailing_id, key)
+            if run is not None:
+                return run, False
+            return cls.objects.create(mailing_id=mailing_id, key=key, lease_until=now + cls.LEASE), True
+
+    def renew(self, **progress):
+        """Продлевает аренду и сохраняет прогресс.
+
+        False, если запуск уже прерван: его результаты записывать нельзя. Вызывается
+        в одной транзакции с записью результатов, поэтому прерванный запуск
+        не может записать их после того, как его прервали.
+        """
+        lease_until = timezone.now() + self.LEASE
+        updated = MailingRun.objects.filter(pk=self.pk, status=self.Status.RUNNING).update(
+            lease_until=lease_until, **progress
+        )
+        if updated:
+            self.lease_until = lease_until
+            for name, value in progress.items():
+                setattr(self, name, value)
+        return bool(updated)
+
+    def finish(self, status=Status.FINISHED, error=''):
+        """Завершает запуск. False, если он уже был прерван"""
+        finished_at = timezone.now()
+        updated = MailingRun.objects.filter(pk=self.pk, status=self.Status.RUNNING).update(
+            status=status, finished_at=finished_at, error=error, sent=self.sent, failed=self.failed,
+        )
+        if updated:
+            self.status, self.finished_at, self.error = status, finished_at, error
+        return bool(updated)
+
+    class Meta:
+        verbose_name = 'запуск рассылки'
+        verbose_name_plural = 'запуски рассылок'
+        constraints = [
+            # Прерванный запуск можно повторить с тем же ключом
+            models.UniqueConstraint(
+                fields=['mailing', 'key'], condition=~Q(status=3), name='mailing_run_key_unique',
+            ),
+            # Не больше одного выполняющегося запуска на рассылку
+            models.UniqueConstraint(fields=['mailing'], condition=Q(status=1), name='mailing_run_active_unique'),
+        ]
 
 
 class MailingAttempt(models.Model):
-    STATUS_CHOICES = [
-        ('success', 'Успешно'),
-        ('failed', 'Не успешно')
-    ]
+
+    class Status(models.IntegerChoices):
+        SUCCESS = 1, 'Успешно'
+        FAILED = 2, 'Не успешно'
 
     attempt_time = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата и время попытки'
     )
-    status = models.CharField(
-        max_length=10,
-        choices=STATUS_CHOICES,
+    status = models.PositiveSmallIntegerField(
+        choices=Status.choices,
         verbose_name='Статус'
     )
     server_response = models.TextField(
@@ -103,12 +375,58 @@ class MailingAttempt(models.Model):
     )
 
     def __str__(self):
-        return f"Попытка #{self.mailing} - {self.status} - {self.attempt_time}"
+        return f"Попытка #{self.mailing} - {self.get_status_display()} - {self.attempt_time}"
 
     class Meta:
         verbose_name = 'попытка рассылки'
         verbose_name_plural = 'попытки рассылки'
-        ordering = ['-attempt_time']
+        # Таблица секционирована по attempt_time (миграция 0010), поэтому сортировку
+        # по умолчанию не задаем - она заставляла бы сортировать все партиции
         permissions = [
             ("can_view_all_attempts", "Может просматривать все попытки рассылок"),
         ]
+        indexes = [
+            # История попыток рассылки, от новых к старым
+            models.Index(fields=['mailing', '-attempt_time'], name='attempt_mailing_time_idx'),
+        ]
+
+
+class MailingDailyStat(models.Model):
+    day = models.DateField(verbose_name='День')
+    owner = models.ForeignKey(CustomUser, verbose_name='Владелец', on_delete=models.SET_NULL, null=True)
+    # При удалении рассылки статистика сохраняется без ссылки на нее
+    mailing = models.ForeignKey(
+        Mailing,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='daily_stats',
+        verbose_name='Рассылка'
+    )
+    status = models.PositiveSmallIntegerField(choices=MailingAttempt.Status.choices, verbose_name='Статус')
+    attempts_count = models.PositiveIntegerField(default=0, verbose_name='Количество попыток')
+
+    def __str__(self):
+        return f"{self.day} - {self.mailing_id} - {self.get_status_display()}: {self.attempts_count}"
+
+    class Meta:
+        verbose_name = 'дневная статистика рассылки'
+        verbose_name_plural = 'дневная статистика рассылок'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'mailing', 'status'], name='daily_stat_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'day'], name='daily_stat_owner_day_idx'),
+            models.Index(fields=['day'], name='daily_stat_day_idx'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name='Название')
+    position = models.DateTimeField(null=True, verbose_name='Обработано до')
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+    class Meta:
+        verbose_name = 'отметка агрегации'
+        verbose_name_plural = 'отметки агрегации'
@@ -0,0 +1,125 @@
+"""Помесячные партиции таблицы попыток рассылок (только PostgreSQL)"""
+import datetime
+import gzip
+import os
+import re
+
+from django.db import connection, transaction
+
+from mailing.models import RollupWatermark
+from mailing.pg import copy_to
+
+PARENT_TABLE = 'mailing_mailingattempt'
+# Отметка: попытки раньше этого момента отсоединены вместе с партициями
+PRUNED_WATERMARK_NAME = 'mailing_attempts_pruned'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+PARTITION_RE = re.compile(rf'^{PARENT_TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}'
+
+
+def list_partitions(cursor):
+    """Возвращает словарь {месяц: имя партиции} для присоединенных помесячных партиций"""
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        [PARENT_TABLE],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        if PARTITION_RE.match(name):
+            partitions[partition_month(name)] = name
+    return partitions
+
+
+def partition_month(name):
+    match = PARTITION_RE.match(name)
+    return datetime.date(int(match[1]), int(match[2]), 1)
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def create_partition(cursor, month):
+    """Создает партицию за месяц, перенося в нее строки, успевшие попасть в партицию по умолчанию"""
+    name = partition_name(month)
+    start, end = _bound(month), _bound(add_months(month, 1))
+    with transaction.atomic():
+        cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(
+            f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM ({start}) TO ({end})'
+        )
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            f'WHERE attempt_time >= {start} AND attempt_time < {end} RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved'
+        )
+        cursor.execute(f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return name
+
+
+def detach_partition(cursor, name):
+    """Отсоединяет партицию и отмечает, что попыток до ее конца больше нет"""
+    cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}')
+    end = add_months(partition_month(name), 1)
+    record_pruned(datetime.datetime.combine(end, datetime.time.min, tzinfo=datetime.timezone.utc))
+
+
+def record_pruned(until):
+    """Сдвигает отметку удаленных попыток вперед (назад она не двигается)"""
+    watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=PRUNED_WATERMARK_NAME)
+    if watermark.position is None or watermark.position < until:
+        watermark.position = until
+        watermark.save(update_fields=['position'])
+
+
+def pruned_until():
+    """Момент, раньше которого попытки удалены, или None, если ничего не удалялось"""
+    return RollupWatermark.objects.filter(name=PRUNED_WATERMARK_NAME).values_list('position', flat=True).first()
+
+
+def archive_partition(cursor, name, directory):
+    """Выгружает отсоединенную партицию в сжатый CSV и удаляет таблицу"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.csv.gz')
+    with gzip.open(path, 'wb') as archive:
+        copy_to(cursor, f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+    cursor.execute(f'DROP TABLE {name}')
+    return path
+
+
+def ensure_partitions(months_ahead, today=None):
+    """Создает партиции от текущего месяца на months_ahead месяцев вперед"""
+    current = month_start(today or datetime.date.today())
+    created = []
+    with connection.cursor() as cursor:
+        existing = list_partitions(cursor)
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                created.append(create_partition(cursor, month))
+    return created
+
+
+def expired_partitions(retention_months, today=None):
+    """Партиции, все строки которых старше срока хранения"""
+    boundary = add_months(month_start(today or datetime.date.today()), -retention_months)
+    with connection.cursor() as cursor:
+        existing = list_partitions(cursor)
+    return [name for month, name in sorted(existing.items()) if add_months(month, 1) <= boundary]
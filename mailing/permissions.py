@@ -1,29 +1,57 @@
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q, Value
+from mailing.models import Mailing
+from user.roles import MANAGERS_GROUP, aget_user_roles, user_has_role
 
 
-class OwnerOrManagerRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
-    """Миксин для проверки владельца или менеджера"""
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin для асинхронных view.
+
+    Пользователь и его роли загружаются асинхронно до вызова обработчика,
+    поэтому дальше request.user можно использовать без обращений к БД.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        await aget_user_roles(user)
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
 
-    def test_func(self):
-        user = self.request.user
-        obj = self.get_object()
 
-        # Проверяем группы
-        is_manager = user.groups.filter(name='Менеджеры').exists()
+class ObjectPermissionMixin(LoginRequiredMixin):
+    """Миксин, который проверяет права на объект в том же запросе, которым объект загружается.
 
-        # Доступ если: владелец объекта ИЛИ менеджер
-        return obj.owner == user or is_manager
+    shared_via - поле рассылки, через которое объект доступен владельцу рассылки
+    (например, 'receivers' для получателей или 'message' для сообщений).
+    """
+    shared_via = None
+    permission_denied_message = "У вас нет прав для выполнения этого действия"
 
-    def handle_no_permission(self):
-        if self.request.user.is_authenticated:
-            raise PermissionDenied("У вас нет прав для выполнения этого действия")
-        return super().handle_no_permission()
+    def get_queryset(self):
+        return annotate_access(super().get_queryset(), self.request.user, self.shared_via)
+
+    def get_object(self, queryset=None):
+        obj = super().get_object(queryset)
+        if not obj.has_access:
+            raise PermissionDenied(self.get_permission_denied_message())
+        return obj
+
+
+class OwnerOrManagerRequiredMixin(ObjectPermissionMixin):
+    """Миксин для проверки владельца или менеджера"""
 
 
 def user_is_manager(user):
     """Проверяет, является ли пользователь менеджером"""
-    return user.groups.filter(name='Менеджеры').exists()
+    return user_has_role(user, MANAGERS_GROUP)
+
+
+async def auser_is_manager(user):
+    """Асинхронный вариант user_is_manager"""
+    return MANAGERS_GROUP in await aget_user_roles(user)
 
 
 def user_is_owner_or_manager(user, obj):
@@ -31,3 +59,34 @@ def user_is_owner_or_manager(user, obj):
     if not user.is_authenticated:
         return False
     return obj.owner == user or user_is_manager(user)
+
+
+def access_condition(user, shared_via=None):
+    """Условие доступа пользователя к объекту: владелец или объект используется в его рассылках"""
+    condition = Q(owner=user)
+    if shared_via:
+        condition |= Exists(Mailing.objects.filter(owner=user, **{shared_via: OuterRef('pk')}))
+    return condition
+
+
+def annotate_access(queryset, user, shared_via=None):
+    """Добавляет к выборке признак has_access, не отбрасывая недоступные объекты"""
+    if user_is_manager(user):
+        return queryset.annotate(has_access=Value(True, output_field=BooleanField()))
+    return queryset.annotate(
+        has_access=ExpressionWrapper(access_condition(user, shared_via), output_field=BooleanField())
+    )
+
+
+def filter_accessible(queryset, user, shared_via=None):
+    """Оставляет в выборке только объекты, доступные пользователю"""
+    if user_is_manager(user):
+        return queryset
+    return queryset.filter(access_condition(user, shared_via))
+
+
+def filter_owned(queryset, user):
+    """Оставляет только объекты пользователя, у менеджера - все"""
+    if user_is_manager(user):
+        return queryset
+    return queryset.filter(owner=user)
@@ -0,0 +1,41 @@
+from django.db import connection, connections
+
+
+def is_postgresql(conn=None):
+    """Проверяет, что база данных - PostgreSQL"""
+    return (conn or connection).vendor == 'postgresql'
+
+
+def copy_to(cursor, sql, fileobj):
+    """Выполняет COPY ... TO STDOUT и пишет результат в файл"""
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        cursor.copy_expert(sql, fileobj)
+        return
+    with cursor.copy(sql) as copy:
+        for data in copy:
+            fileobj.write(data)
+
+
+def copy_from(cursor, sql, fileobj, chunk_size=64 * 1024):
+    """Выполняет COPY ... FROM STDIN, читая данные из файла"""
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        cursor.copy_expert(sql, fileobj)
+        return
+    with cursor.copy(sql) as copy:
+        while data := fileobj.read(chunk_size):
+            copy.write(data)
+
+
+def pool_stats():
+    """Статистика пулов соединений psycopg по алиасам баз данных.
+
+    Базы без пула (или не PostgreSQL) в результат не попадают.
+    """
+    stats = {}
+    for conn in connections.all():
+        pool = getattr(conn, 'pool', None) if is_postgresql(conn) else None
+        if pool is not None:
+            stats[conn.alias] = pool.get_stats()
+    return stats
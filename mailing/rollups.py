@@ -0,0 +1,91 @@
+"""Инкрементальная агрегация попыток рассылок в дневную статистику"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from mailing.models import MailingAttempt, MailingDailyStat, RollupWatermark
+from mailing.partitions import pruned_until
+
+WATERMARK_NAME = 'mailing_daily_stats'
+
+
+def day_bounds(day):
+    """Границы дня в текущем часовом поясе"""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def first_complete_day():
+    """Первый день, попытки за который сохранились целиком, или None, если ничего не удалялось.
+
+    Старые партиции попыток отсоединяются (manage_attempt_partitions), и за эти дни
+    остается только статистика - пересчитывать их нельзя. Партиции заканчиваются в полночь
+    UTC, поэтому пограничный день в местном времени сохранился лишь частично.
+    """
+    pruned = pruned_until()
+    if pruned is None:
+        return None
+    day = timezone.localdate(pruned)
+    return day if day_bounds(day)[0] == pruned else day + datetime.timedelta(days=1)
+
+
+def rollup_day(day, until):
+    """Пересчитывает статистику за день по попыткам, сделанным до until"""
+    start, end = day_bounds(day)
+    rows = (
+        MailingAttempt.objects
+        .filter(attempt_time__gte=start, attempt_time__lt=min(end, until))
+        .values('mailing_id', 'mailing__owner_id', 'status')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    # Строки удаленных рассылок (mailing = NULL) сохраняем: сырых попыток по ним уже нет
+    MailingDailyStat.objects.filter(day=day, mailing__isnull=False).delete()
+    MailingDailyStat.objects.bulk_create([
+        MailingDailyStat(
+            day=day,
+            mailing_id=row['mailing_id'],
+            owner_id=row['mailing__owner_id'],
+            status=row['status'],
+            attempts_count=row['total'],
+        )
+        for row in rows
+    ])
+    return len(rows)
+
+
+def rollup_attempts(lag=datetime.timedelta(minutes=5), since=None):
+    """Агрегирует попытки от отметки до (сейчас - lag).
+
+    Дни, попадающие в интервал, пересчитываются целиком, поэтому повторный
+    запуск безопасен, а поздно записанные попытки учитываются. Дни раньше
+    first_complete_day() пропускаются.
+    Возвращает список обработанных дней.
+    """
+    until = timezone.now() - lag
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        start = since or watermark.position
+        if start is None:
+            first = MailingAttempt.objects.order_by('attempt_time').values_list('attempt_time', flat=True).first()
+            if first is None:
+                return []
+            start = first
+
+        day = timezone.localdate(start)
+        # Дни, попытки за которые уже удалены, не трогаем: пересчет стер бы их статистику
+        first_day = first_complete_day()
+        if first_day is not None:
+            day = max(day, first_day)
+        last_day = timezone.localdate(until)
+        days = []
+        while day <= last_day:
+            rollup_day(day, until)
+            days.append(day)
+            day += datetime.timedelta(days=1)
+
+        watermark.position = until
+        watermark.save(update_fields=['position'])
+    return days
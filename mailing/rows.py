@@ -0,0 +1,108 @@
+"""
+Легкие строки для закешированных списков.
+
+В кеш кладется кортеж (версия, строки), где строка - кортеж значений полей из
+values_list, а не экземпляр модели. При чтении из кортежей собираются объекты
+Row только с теми атрибутами, которые нужны шаблону. Если набор полей меняется,
+повышаем version: записи старого формата считаются промахом.
+"""
+from django.core.cache import cache
+
+from mailing.models import Mailing
+
+
+class Row:
+    """Строка списка: атрибуты из fields (атрибут -> поле для values_list)"""
+    __slots__ = ()
+    version = 1
+    fields = {}
+
+    def __init__(self, values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def pack(cls, values):
+        """Значение для кеша из строк values_list"""
+        return cls.version, [tuple(row) for row in values]
+
+    @classmethod
+    def unpack(cls, payload):
+        """Строки из значения кеша или None, если формат устарел"""
+        if not isinstance(payload, tuple) or len(payload) != 2 or payload[0] != cls.version:
+            return None
+        return [cls(values) for values in payload[1]]
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values_list(*cls.fields.values())
+
+
+class ReceiverRow(Row):
+    fields = {
+        'id': 'id',
+        'email': 'email',
+        'full_name': 'full_name',
+        'comm': 'comm',
+        'owner_id': 'owner_id',
+        'owner_email': 'owner__email',
+    }
+    __slots__ = tuple(fields)
+
+
+class MessageRow(Row):
+    fields = {
+        'id': 'id',
+        'topic': 'topic',
+        'owner_id': 'owner_id',
+        'owner_email': 'owner__email',
+    }
+    __slots__ = tuple(fields)
+
+
+class MailingRow(Row):
+    fields = {
+        'id': 'id',
+        'status': 'status',
+        'start_time': 'start_time',
+        'end_time': 'end_time',
+        'message_topic': 'message__topic',
+        'owner_id': 'owner_id',
+        'owner_email': 'owner__email',
+    }
+    __slots__ = tuple(fields)
+    Status = Mailing.Status
+
+    @property
+    def is_active(self):
+        return self.status == Mailing.Status.RUNNING
+
+    def get_status_display(self):
+        return Mailing.Status(self.status).label
+
+
+class UserRow(Row):
+    fields = {
+        'id': 'id',
+        'email': 'email',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'is_active': 'is_active',
+        'mailing_count': 'mailing_count',
+        'active_mailing_count': 'active_mailing_count',
+    }
+    __slots__ = tuple(fields)
+
+
+async def cached_rows(cache_key, queryset, row_class, timeout=60):
+    """Строки списка из кеша или из БД одним запросом values_list"""
+    rows = row_class.unpack(await cache.aget(cache_key))
+    if rows is None:
+        payload = row_class.pack([values async for values in row_class.values(queryset)])
+        await cache.aset(cache_key, payload, timeout)
+        rows = row_class.unpack(payload)
+    return rows
@@ -0,0 +1,112 @@
+"""
+Расписания повторяющихся рассылок в формате cron.
+
+Поддерживаются пять полей (минута, час, день месяца, месяц, день недели) со
+значениями *, числами, диапазонами a-b, шагом */n и a-b/n и списками через
+запятую, а также сокращения @hourly, @daily, @weekly, @monthly и @yearly.
+Время считается в текущем часовом поясе (TIME_ZONE).
+"""
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 1',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+}
+
+# (название, минимум, максимум) для каждого поля
+FIELDS = (
+    ('минута', 0, 59),
+    ('час', 0, 23),
+    ('день месяца', 1, 31),
+    ('месяц', 1, 12),
+    ('день недели', 0, 7),
+)
+
+# Дальше этого срока ближайший запуск не ищем: такое расписание не сработает никогда (например, 30 февраля)
+SEARCH_YEARS = 5
+
+
+def parse_field(value, name, low, high):
+    """Множество значений одного поля cron"""
+    values = set()
+    for part in value.split(','):
+        expression, _, step = part.partition('/')
+        try:
+            step = int(step) if step else 1
+            if expression == '*':
+                start, end = low, high
+            elif '-' in expression:
+                start, end = (int(bound) for bound in expression.split('-', 1))
+            else:
+                start = end = int(expression)
+                if step != 1:
+                    end = high
+        except ValueError:
+            raise ValueError(f'Некорректное значение поля "{name}": {part}')
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f'Поле "{name}" должно быть в пределах {low}-{high}: {part}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = ALIASES.get(self.expression.lower(), self.expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError('Расписание должно состоять из пяти полей: минута, час, день месяца, месяц, день недели')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(value, *field) for value, field in zip(fields, FIELDS)
+        )
+        # 0 и 7 - воскресенье; храним в нумерации datetime.weekday(), где понедельник - 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        # Как в cron: если заданы и день месяца, и день недели, подходит любой из них
+        self.any_day = fields[2] != '*' and fields[4] != '*'
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def day_matches(self, day):
+        by_day = day.day in self.days
+        by_weekday = day.weekday() in self.weekdays
+        if self.any_day:
+            return by_day or by_weekday
+        return (by_day or not self.days_restricted) and (by_weekday or not self.weekdays_restricted)
+
+    def next_after(self, moment):
+        """Ближайший момент срабатывания строго после moment или None"""
+        local = timezone.localtime(moment).replace(tzinfo=None, second=0, microsecond=0)
+        current = local + datetime.timedelta(minutes=1)
+        limit = local.year + SEARCH_YEARS
+        # Пропускаем неподходящие месяцы, дни и часы целиком, а не по минуте
+        while current.year <= limit:
+            if current.month not in self.months:
+                current = (current.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self.day_matches(current):
+                current = (current + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif current.hour not in self.hours:
+                current = (current + datetime.timedelta(hours=1)).replace(minute=0)
+            elif current.minute not in self.minutes:
+                later = [minute for minute in self.minutes if minute > current.minute]
+                if later:
+                    current = current.replace(minute=min(later))
+                else:
+                    current = (current + datetime.timedelta(hours=1)).replace(minute=0)
+            else:
+                return timezone.make_aware(current)
+        return None
+
+
+def validate_recurrence(value):
+    """Валидатор поля модели: строка должна быть корректным расписанием"""
+    try:
+        schedule = CronSchedule(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+    if schedule.next_after(timezone.now()) is None:
+        raise ValidationError('Расписание никогда не срабатывает')
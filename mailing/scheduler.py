@@ -0,0 +1,69 @@
+"""Выбор повторяющихся рассылок, которым пора запускаться.
+
+Время следующего запуска хранится в Mailing.next_run_at (частичный индекс
+mailing_next_run_idx), поэтому планировщик читает только подошедшие рассылки,
+а не все. Несколько планировщиков могут работать одновременно: строки
+захватываются с SKIP LOCKED, и каждую рассылку забирает только один из них.
+
+Запуск переносится на следующий только после того, как отправка завершилась.
+Если планировщик упал или отправка не удалась, захват истекает через
+CLAIM_TIMEOUT, и тот же запуск выполняется снова с тем же ключом - письма,
+уже отправленные этим запуском, повторно не уходят.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from mailing.models import Mailing, MailingRun
+
+# Сколько захваченный запуск ждет завершения, прежде чем его захватят снова
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def occurrence_key(mailing):
+    """Ключ запуска по расписанию: один и тот же для всех попыток выполнить этот запуск"""
+    return f"schedule-{mailing.next_run_at:%Y%m%d%H%M}"
+
+
+def claim_due_mailings(limit, now=None):
+    """Захватывает до limit рассылок, время запуска которых подошло.
+
+    Пока захват не истек, рассылку не выберет ни этот, ни другой планировщик.
+    """
+    now = now or timezone.now()
+    due = Mailing.objects.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now), next_run_at__lte=now,
+    ).order_by('next_run_at')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True, of=('self',))
+        mailings = list(due.select_related('owner')[:limit])
+        for mailing in mailings:
+            mailing.claimed_until = now + CLAIM_TIMEOUT
+        Mailing.objects.bulk_update(mailings, ['claimed_until'])
+    return mailings
+
+
+def occurrence_finished(mailing, key):
+    """Выполнен ли запуск с ключом key. False - его нужно повторить, когда истечет захват"""
+    run = MailingRun.objects.filter(
+        Q(key=key) | Q(status=MailingRun.Status.RUNNING), mailing_id=mailing.pk,
+    ).order_by('-pk').first()
+    # Запуска нет - команда отказалась его начинать (например, рассылка вне своего времени)
+    return run is None or (run.key == key and run.status == MailingRun.Status.FINISHED)
+
+
+def complete_occurrence(mailing, now=None):
+    """Отмечает запуск выполненным и назначает следующий.
+
+    Следующий запуск отсчитывается от текущего, поэтому запуски, пропущенные
+    за время простоя, выполняются один раз, а не по разу на каждый.
+    """
+    # Статус могла изменить сама отправка или менеджер
+    mailing.refresh_from_db(fields=['status'])
+    mailing.last_run_at = now or timezone.now()
+    mailing.claimed_until = None
+    mailing.schedule()
+    mailing.save(update_fields=['last_run_at', 'next_run_at', 'claimed_until'])
@@ -0,0 +1,48 @@
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mailing.models import Mailing
+from user.models import CustomUser
+
+
+def adjust_mailing_counters(owner_id, total=0, active=0):
+    """Изменяет счетчики рассылок пользователя одним UPDATE"""
+    if not owner_id or not (total or active):
+        return
+    CustomUser.objects.filter(pk=owner_id).update(
+        mailing_count=Greatest(F('mailing_count') + total, Value(0)),
+        active_mailing_count=Greatest(F('active_mailing_count') + active, Value(0)),
+    )
+
+
+@receiver(post_save, sender=Mailing)
+def update_counters_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    is_active = int(instance.is_active)
+    if created:
+        adjust_mailing_counters(instance.owner_id, total=1, active=is_active)
+        return
+
+    old_owner_id = getattr(instance, '_loaded_owner_id', instance.owner_id)
+    old_is_active = int(getattr(instance, '_loaded_status', instance.status) == Mailing.Status.RUNNING)
+
+    if old_owner_id != instance.owner_id:
+        adjust_mailing_counters(old_owner_id, total=-1, active=-old_is_active)
+        adjust_mailing_counters(instance.owner_id, total=1, active=is_active)
+    else:
+        adjust_mailing_counters(instance.owner_id, active=is_active - old_is_active)
+
+
+@receiver(post_delete, sender=Mailing)
+def update_counters_on_delete(sender, instance, **kwargs):
+    # Сигнал приходит и при каскадном удалении (например, вместе с сообщением)
+    old_is_active = getattr(instance, '_loaded_status', instance.status) == Mailing.Status.RUNNING
+    adjust_mailing_counters(
+        getattr(instance, '_loaded_owner_id', instance.owner_id),
+        total=-1,
+        active=-int(old_is_active),
+    )
@@ -0,0 +1,730 @@
+import json
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mailing import partitions
+from mailing.api import AUTOCOMPLETE_PAGE_SIZE
+from mailing.exports import EXPORT_FORMATS
+from mailing.models import (
+    Mailing, MailingAttempt, MailingDailyStat, MailingRun, Message, ReceiverList, ReceiverMailing,
+)
+from mailing.schedule import CronSchedule, validate_recurrence
+from mailing.scheduler import claim_due_mailings
+from user.models import CustomUser
+from user.roles import MANAGERS_GROUP, invalidate_user_roles
+
+# Два масштаба данных: количество запросов не должно зависеть от масштаба
+SMALL_SCALE = 3
+LARGE_SCALE = 30
+
+TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+}
+
+
+def seed(owner, scale, prefix):
+    """Создает получателей, сообщения, рассылки, попытки и статистику владельца"""
+    now = timezone.now()
+    receivers = ReceiverMailing.objects.bulk_create([
+        ReceiverMailing(email=f'{prefix}{i}@example.com', full_name=f'Получатель {i}', comm='Комментарий', owner=owner)
+        for i in range(scale)
+    ])
+    messages = Message.objects.bulk_create([
+        Message(topic=f'Тема {prefix}{i}', text='Текст письма', owner=owner) for i in range(scale)
+    ])
+    mailings = [
+        Mailing.objects.create(
+            start_time=now - timedelta(hours=1),
+            end_time=now + timedelta(days=1),
+            status=Mailing.Status.RUNNING,
+            message=message,
+            owner=owner,
+        )
+        for message in messages
+    ]
+    through = Mailing.receivers.through
+    through.objects.bulk_create([
+        through(mailing_id=mailing.pk, receivermailing_id=receiver.pk)
+        for mailing in mailings
+        for receiver in receivers
+    ])
+    MailingAttempt.objects.bulk_create([
+        MailingAttempt(mailing=mailing, status=MailingAttempt.Status.SUCCESS, server_response='OK')
+        for mailing in mailings
+        for _ in range(scale)
+    ])
+    MailingDailyStat.objects.bulk_create([
+        MailingDailyStat(
+            day=timezone.localdate() - timedelta(days=day), owner=owner, mailing=mailing,
+            status=MailingAttempt.Status.SUCCESS, attempts_count=scale,
+        )
+        for mailing in mailings
+        for day in range(3)
+    ])
+    CustomUser.objects.bulk_create([
+        CustomUser(email=f'{prefix}user{i}@example.com', username=f'{prefix}user{i}') for i in range(scale)
+    ])
+    return receivers, messages, mailings
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryBudgetTestCase(TestCase):
+    """Бюджеты SQL-запросов на страницы и API.
+
+    Для каждого адреса число запросов замеряется на малом и большом наборе данных.
+    Тест падает, если число запросов растет вместе с данными (N+1) или превышает бюджет.
+    """
+
+    # (название, адрес, пользователь, бюджет запросов)
+    endpoints = (
+        ('Главная', 'mailing:home', 'owner', 5),
+        ('Получатели', 'mailing:receiver-list', 'owner', 5),
+        ('Сообщения', 'mailing:message-list', 'owner', 5),
+        ('Рассылки', 'mailing:mailing-list', 'owner', 5),
+        ('Рассылки (менеджер)', 'mailing:mailing-list', 'manager', 5),
+        ('Попытки', 'mailing:mailing_attempts-list', 'owner', 5),
+        ('Статистика', 'mailing:mailing-stats', 'owner', 7),
+        ('Пользователи', 'mailing:user_list', 'manager', 5),
+        ('Получатель', 'receiver', 'owner', 4),
+        ('Сообщение', 'message', 'owner', 4),
+        ('Рассылка', 'mailing', 'owner', 8),
+        ('Новая рассылка', 'mailing:mailing-create', 'owner', 4),
+        ('Изменение рассылки', 'mailing-update', 'owner', 8),
+        ('Поиск получателей', 'mailing:autocomplete-receivers', 'owner', 4),
+        ('Выгрузка попыток', 'mailing:mailing_attempts-export', 'owner', 4),
+        ('Выгрузка получателей', 'mailing:receiver-export', 'owner', 4),
+    )
+    report = []
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        cls.manager = CustomUser.objects.create_user(email='manager@example.com', username='manager', password='x')
+        cls.manager.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.report:
+            print(f"\n{'Адрес':<26}{'запросов':>10}{'мс':>8}{'запросов':>10}{'мс':>8}{'бюджет':>8}")
+            print(f"{'':<26}{f'(x{SMALL_SCALE})':>18}{f'(x{LARGE_SCALE})':>18}")
+            for name, small, large, budget in cls.report:
+                print(f"{name:<26}{small[0]:>10}{small[1]:>8.1f}{large[0]:>10}{large[1]:>8.1f}{budget:>8}")
+
+    def resolve(self, url_name, objects):
+        receivers, messages, mailings = objects
+        if url_name == 'receiver':
+            return reverse('mailing:receiver', args=[receivers[0].pk])
+        if url_name == 'message':
+            return reverse('mailing:message', args=[messages[0].pk])
+        if url_name == 'mailing':
+            return reverse('mailing:mailing', args=[mailings[0].pk])
+        if url_name == 'mailing-update':
+            return reverse('mailing:mailing-update', args=[mailings[0].pk])
+        return reverse(url_name)
+
+    def measure(self, url, user):
+        """Количество запросов и время (мс) одного GET-запроса без прогретого кеша"""
+        self.client.force_login(user)
+        # Кеш и роли сбрасываем, чтобы каждый замер шел по одному и тому же пути
+        cache.clear()
+        invalidate_user_roles(user.pk)
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries), elapsed
+
+    def test_query_counts_do_not_depend_on_data_size(self):
+        objects = seed(self.owner, SMALL_SCALE, 'small')
+        small = {
+            name: self.measure(self.resolve(url_name, objects), getattr(self, who))
+            for name, url_name, who, budget in self.endpoints
+        }
+
+        seed(self.owner, LARGE_SCALE - SMALL_SCALE, 'large')
+        for name, url_name, who, budget in self.endpoints:
+            large = self.measure(self.resolve(url_name, objects), getattr(self, who))
+            self.report.append((name, small[name], large, budget))
+            with self.subTest(endpoint=name):
+                self.assertEqual(
+                    small[name][0], large[0],
+                    f'{name}: количество запросов растет вместе с данными ({small[name][0]} -> {large[0]})',
+                )
+                self.assertLessEqual(large[0], budget, f'{name}: превышен бюджет запросов')
+
+
+@override_settings(**TEST_SETTINGS)
+class BatchAPIQueryTestCase(TestCase):
+    """Пакетные операции API выполняют одинаковое число запросов для любого размера пакета"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def post_json(self, url, payload, method='post'):
+        invalidate_user_roles(self.owner.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, json.dumps(payload), content_type='application/json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response, len(queries)
+
+    def create_receivers(self, prefix, count):
+        items = [{'email': f'{prefix}{i}@example.com', 'full_name': 'Получатель'} for i in range(count)]
+        return self.post_json(reverse('mailing:api-receivers'), {'items': items})
+
+    def test_receivers_batch(self):
+        small_response, small = self.create_receivers('small', SMALL_SCALE)
+        large_response, large = self.create_receivers('large', LARGE_SCALE)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 8)
+
+        ids = large_response.json()['ids']
+        _, patch = self.post_json(
+            reverse('mailing:api-receivers'),
+            {'items': [{'id': pk, 'full_name': 'Новое имя'} for pk in ids]},
+            method='patch',
+        )
+        _, patch_small = self.post_json(
+            reverse('mailing:api-receivers'),
+            {'items': [{'id': pk, 'full_name': 'Новое имя'} for pk in small_response.json()['ids']]},
+            method='patch',
+        )
+        self.assertEqual(patch, patch_small)
+
+    def test_mailings_batch(self):
+        receiver_ids = self.create_receivers('r', LARGE_SCALE)[0].json()['ids']
+        message = Message.objects.create(topic='Тема', text='Текст', owner=self.owner)
+        now = timezone.now() + timedelta(hours=1)
+
+        def items(count):
+            return [{
+                'start_time': now.isoformat(),
+                'end_time': (now + timedelta(days=1)).isoformat(),
+                'message': message.pk,
+                'receivers': receiver_ids[:SMALL_SCALE],
+            } for _ in range(count)]
+
+        _, small = self.post_json(reverse('mailing:api-mailings'), {'items': items(SMALL_SCALE)})
+        _, large = self.post_json(reverse('mailing:api-mailings'), {'items': items(LARGE_SCALE)})
+        self.assertEqual(small, large)
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.mailing_count, SMALL_SCALE + LARGE_SCALE)
+
+
+@override_settings(**TEST_SETTINGS)
+class ExportTestCase(TestCase):
+    """Под ASGI выгрузка идет асинхронным потоком и совпадает с выгрузкой под WSGI"""
+
+    async def read_async(self, url):
+        response = await self.async_client.get(url)
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_async_stream(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        seed(owner, SMALL_SCALE, 'export')
+        self.client.force_login(owner)
+        self.async_client.force_login(owner)
+        for url_name in ('mailing:mailing_attempts-export', 'mailing:receiver-export'):
+            for fmt in EXPORT_FORMATS:
+                with self.subTest(url=url_name, format=fmt):
+                    url = f'{reverse(url_name)}?format={fmt}'
+                    response = self.client.get(url)
+                    self.assertFalse(response.is_async)
+                    expected = b''.join(response.streaming_content)
+                    self.assertEqual(async_to_sync(self.read_async)(url), expected)
+                    rows = SMALL_SCALE ** 2 if 'attempts' in url_name else SMALL_SCALE
+                    # В CSV еще строка заголовка
+                    self.assertEqual(expected.count(b'\n'), rows + (fmt == 'csv'))
+
+
+@override_settings(**TEST_SETTINGS)
+class StartMailingQueryTestCase(TestCase):
+    """Запуск рассылки выполняет одинаковое число запросов для любого числа получателей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+
+    def run_mailing(self, scale, prefix):
+        receivers, messages, mailings = seed(self.owner, scale, prefix)
+        mailing = mailings[0]
+        with CaptureQueriesContext(connection) as queries:
+            call_command('start_mailing', str(mailing.pk), stdout=StringIO())
+        mailing.refresh_from_db()
+        self.assertEqual(mailing.status, Mailing.Status.FINISHED)
+        self.assertEqual(mailing.stats['last_run']['sent'], scale)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_receivers(self):
+        small = self.run_mailing(SMALL_SCALE, 'small')
+        large = self.run_mailing(LARGE_SCALE, 'large')
+        self.assertEqual(small, large)
+        # Вместе с блокировкой запуска и записью его хода (точки сохранения транзакций тоже считаются)
+        self.assertLessEqual(large, 23)
+
+
+class ImportReceiversTestCase(TestCase):
+    """Импорт отклоняет строки, которые не поместились бы в таблицу, а не роняет пачку"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+
+    def import_file(self, content):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as fileobj:
+            fileobj.write(content)
+            fileobj.flush()
+            out = StringIO()
+            call_command('import_receivers', fileobj.name, owner=self.owner.email, stdout=out)
+        return out.getvalue()
+
+    def test_long_email_rejected(self):
+        long_email = f"{'a' * 64}@{'b' * 63}.{'c' * 63}.{'d' * 63}.com"
+        out = self.import_file(f'email,full_name\n{long_email},Длинный\nok@example.com,Короткий\n'.encode())
+        self.assertIn('Строка 2: Слишком длинный email получателя', out)
+        self.assertEqual(list(ReceiverMailing.objects.values_list('email', flat=True)), ['ok@example.com'])
+
+    def test_undecodable_file(self):
+        with self.assertRaisesMessage(CommandError, 'Ошибка импорта'):
+            self.import_file('email,full_name\nok@example.com,Получатель\n'.encode('cp1251'))
+
+
+class RollupTestCase(TestCase):
+    """Пересчет статистики не стирает дни, попытки за которые уже удалены"""
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        _, _, (self.mailing,) = seed(self.owner, 1, 'rollup')
+
+    def rollup(self, *args):
+        out = StringIO()
+        call_command('rollup_attempts', '--lag-minutes', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_since_before_pruned_days(self):
+        pruned = timezone.localdate() - timedelta(days=40)
+        # Партиция заканчивается в полночь UTC - следующий местный день сохранился не целиком
+        partitions.record_pruned(datetime.combine(pruned + timedelta(days=1), datetime.min.time(), dt_timezone.utc))
+        for day in (pruned, pruned + timedelta(days=1)):
+            MailingDailyStat.objects.create(
+                day=day, owner=self.owner, mailing=self.mailing, status=MailingAttempt.Status.SUCCESS,
+                attempts_count=7,
+            )
+        out = self.rollup('--since', (pruned - timedelta(days=1)).isoformat())
+        self.assertIn(f'Статистика до {pruned + timedelta(days=2)} не пересчитывалась', out)
+        kept = MailingDailyStat.objects.filter(day__lte=pruned + timedelta(days=1), attempts_count=7)
+        self.assertEqual(kept.count(), 2)
+        self.assertEqual(MailingDailyStat.objects.get(day=timezone.localdate()).attempts_count, 1)
+
+    def test_first_day_without_pruning(self):
+        # Попытка в начале местного дня, раньше полуночи UTC: без удаления партиций день полный
+        first_day = timezone.localdate() - timedelta(days=5)
+        attempt_time = timezone.make_aware(datetime.combine(first_day, datetime.min.time())) + timedelta(hours=1)
+        MailingAttempt.objects.update(attempt_time=attempt_time)
+        MailingDailyStat.objects.all().delete()
+        self.rollup()
+        self.assertEqual(MailingDailyStat.objects.get(day=first_day).attempts_count, 1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Партиции есть только в PostgreSQL')
+    def test_detach_records_pruning(self):
+        month = partitions.add_months(partitions.month_start(timezone.localdate()), -24)
+        with connection.cursor() as cursor:
+            partitions.create_partition(cursor, month)
+        call_command('manage_attempt_partitions', '--months-ahead', '0', '--retention-months', '12', stdout=StringIO())
+        end = partitions.add_months(month, 1)
+        self.assertEqual(partitions.pruned_until(), datetime.combine(end, datetime.min.time(), dt_timezone.utc))
+
+
+@override_settings(**TEST_SETTINGS)
+class MailingRunTestCase(TestCase):
+    """Повторный или одновременный запуск рассылки не отправляет письма второй раз"""
+
+    def test_launch_is_idempotent(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        receivers, _, mailings = seed(owner, SMALL_SCALE, 'run')
+        mailing = mailings[0]
+        self.client.force_login(owner)
+        url = reverse('mailing:mailing-start', args=[mailing.pk])
+
+        response = self.client.post(url, {'launch_key': 'after-0'})
+        run = MailingRun.objects.get(mailing=mailing)
+        self.assertRedirects(response, reverse('mailing:mailing-run', args=[mailing.pk, run.pk]))
+        self.assertEqual((run.status, run.total, run.sent), (MailingRun.Status.FINISHED, SMALL_SCALE, SMALL_SCALE))
+
+        # Двойное нажатие: тот же ключ возвращает уже выполненный запуск
+        response = self.client.post(url, {'launch_key': 'after-0'})
+        self.assertRedirects(response, reverse('mailing:mailing-run', args=[mailing.pk, run.pk]))
+        self.assertEqual(len(mail.outbox), SMALL_SCALE)
+
+        # Пока идет другой запуск, новый не начинается
+        active = MailingRun.objects.create(mailing=mailing, key='other', lease_until=timezone.now() + MailingRun.LEASE)
+        response = self.client.post(url, {'launch_key': f'after-{run.pk}'})
+        self.assertRedirects(response, reverse('mailing:mailing-run', args=[mailing.pk, active.pk]))
+        self.assertEqual(len(mail.outbox), SMALL_SCALE)
+
+        # Запуск с истекшей арендой прерывается, и его результаты больше не записываются
+        MailingRun.objects.filter(pk=active.pk).update(lease_until=timezone.now() - timedelta(seconds=1))
+        call_command('start_mailing', str(mailing.pk), key='retry', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2 * SMALL_SCALE)
+        active.refresh_from_db()
+        self.assertEqual(active.status, MailingRun.Status.FAILED)
+        self.assertFalse(active.renew(sent=1))
+
+    def test_relaunch_after_empty_run(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        receivers, _, mailings = seed(owner, SMALL_SCALE, 'empty')
+        mailing = mailings[0]
+        mailing.receivers.clear()
+        self.client.force_login(owner)
+        detail = reverse('mailing:mailing', args=[mailing.pk])
+        start = reverse('mailing:mailing-start', args=[mailing.pk])
+
+        # Кнопка запуска отправляет ключ со страницы рассылки; после пустого запуска он меняется
+        for expected in (0, SMALL_SCALE):
+            page = self.client.get(detail).content.decode()
+            launch_key = re.search(r'name="launch_key" value="([^"]+)"', page).group(1)
+            self.client.post(start, {'launch_key': launch_key})
+            self.assertEqual(len(mail.outbox), expected)
+            mailing.receivers.set(receivers)
+
+
+class DisablingEmailBackend(locmem.EmailBackend):
+    """Почтовый бэкенд, во время отправки которого менеджер отключает рассылку"""
+    mailing_id = None
+
+    def send_messages(self, messages):
+        mailing = Mailing.objects.get(pk=self.mailing_id)
+        if mailing.status == Mailing.Status.RUNNING:
+            mailing.status = Mailing.Status.DISABLED
+            mailing.save()
+        return super().send_messages(messages)
+
+
+@override_settings(**{**TEST_SETTINGS, 'EMAIL_BACKEND': 'mailing.tests.DisablingEmailBackend'})
+class MailingDisabledDuringRunTestCase(TestCase):
+    """Рассылку, отключенную во время отправки, завершение запуска не включает обратно"""
+
+    def test_disabled_during_run(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        _, _, mailings = seed(owner, 2, 'disable')
+        # Отключение снимает рассылку со счетчика активных ровно один раз
+        for mailing, recurrence, active in zip(mailings, ['', '@daily'], [1, 0]):
+            with self.subTest(recurrence=recurrence):
+                Mailing.objects.filter(pk=mailing.pk).update(recurrence=recurrence)
+                DisablingEmailBackend.mailing_id = mailing.pk
+                call_command('start_mailing', str(mailing.pk), stdout=StringIO())
+                mailing.refresh_from_db()
+                self.assertEqual((mailing.status, mailing.next_run_at), (Mailing.Status.DISABLED, None))
+                self.assertEqual(mailing.stats['last_run']['sent'], 2)
+                owner.refresh_from_db()
+                self.assertEqual(owner.active_mailing_count, active)
+
+
+@override_settings(**TEST_SETTINGS)
+class SegmentTestCase(TestCase):
+    """Рассылка по сегментам не хранит получателей и раскрывает их при запуске"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='x')
+        cls.receivers = ReceiverMailing.objects.bulk_create([
+            ReceiverMailing(email=f'user{i}@{domain}', full_name=f'Получатель {i}', owner=cls.owner)
+            for i, domain in enumerate(['example.com', 'example.com', 'test.ru', 'test.ru', 'notexample.com'])
+        ])
+        # Чужой получатель не попадает в фильтр, даже если подходит под условие
+        ReceiverMailing.objects.create(email='foreign@example.com', full_name='Чужой', owner=other)
+        cls.static = ReceiverList.objects.create(name='Список', owner=cls.owner)
+        cls.static.receivers.set(cls.receivers[1:3])
+        cls.filter = ReceiverList.objects.create(
+            name='Фильтр', owner=cls.owner, kind=ReceiverList.Kind.FILTER, email_domain='example.com',
+        )
+
+    def test_segments(self):
+        self.client.force_login(self.owner)
+        now = timezone.now()
+        response = self.client.post(
+            reverse('mailing:api-mailings'),
+            {'items': [{
+                'start_time': (now + timedelta(minutes=1)).isoformat(),
+                'end_time': (now + timedelta(days=1)).isoformat(),
+                'message': Message.objects.create(topic='Тема', text='Текст', owner=self.owner).pk,
+                'segments': [self.static.pk, self.filter.pk],
+            }]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        mailing = Mailing.objects.get(pk=response.json()['ids'][0])
+        self.assertFalse(mailing.receivers.exists())
+
+        expected = ['user0@example.com', 'user1@example.com', 'user2@test.ru']
+        self.assertEqual(sorted(mailing.get_recipients().values_list('email', flat=True)), expected)
+
+        Mailing.objects.filter(pk=mailing.pk).update(start_time=now - timedelta(minutes=1))
+        call_command('start_mailing', str(mailing.pk), stdout=StringIO())
+        self.assertEqual(sorted(email for message in mail.outbox for email in message.to), expected)
+
+        # Отдельные получатели объединяются с получателями сегментов без повторов
+        mailing.receivers.add(self.receivers[0], self.receivers[4])
+        self.assertEqual(mailing.get_recipients().count(), 4)
+
+
+@override_settings(**TEST_SETTINGS)
+class MailingPickerTestCase(TestCase):
+    """Поля выбора формы рассылки видят только объекты владельца"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='x')
+        cls.own, _, _ = seed(cls.owner, LARGE_SCALE, 'own')
+        cls.foreign, cls.foreign_messages, _ = seed(other, SMALL_SCALE, 'foreign')
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_autocomplete(self):
+        url = reverse('mailing:autocomplete-receivers')
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), AUTOCOMPLETE_PAGE_SIZE)
+        self.assertTrue(first['pagination']['more'])
+        second = self.client.get(url, {'page': 2}).json()
+        self.assertFalse(second['pagination']['more'])
+        ids = {item['id'] for item in first['results'] + second['results']}
+        self.assertEqual(ids, {receiver.pk for receiver in self.own})
+
+        found = self.client.get(url, {'term': 'foreign'}).json()
+        self.assertEqual(found['results'], [])
+
+    def test_foreign_objects_rejected(self):
+        now = timezone.localtime()
+        response = self.client.post(reverse('mailing:mailing-create'), {
+            'start_time': (now + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (now + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M'),
+            'message': self.foreign_messages[0].pk,
+            'receivers': [self.own[0].pk, self.foreign[0].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.context['form'].errors), {'message', 'receivers'})
+
+
+@override_settings(**TEST_SETTINGS)
+class MailingLinksTestCase(TestCase):
+    """Копирование рассылки и массовое изменение получателей не зависят от их числа"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def clone(self, scale, prefix):
+        receivers, _, mailings = seed(self.owner, scale, prefix)
+        segment = ReceiverList.objects.create(name=prefix, owner=self.owner)
+        mailings[0].segments.add(segment)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('mailing:mailing-clone', args=[mailings[0].pk]))
+        copy = Mailing.objects.latest('pk')
+        self.assertRedirects(response, reverse('mailing:mailing-update', args=[copy.pk]), fetch_redirect_response=False)
+        self.assertEqual(copy.status, Mailing.Status.CREATED)
+        self.assertEqual(set(copy.receivers.all()), set(receivers))
+        self.assertEqual(list(copy.segments.all()), [segment])
+        return len(queries)
+
+    def test_clone(self):
+        self.assertEqual(self.clone(SMALL_SCALE, 'small'), self.clone(LARGE_SCALE, 'large'))
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.mailing_count, SMALL_SCALE + LARGE_SCALE + 2)
+
+    def test_clone_form_csrf_per_user(self):
+        _, _, mailings = seed(self.owner, SMALL_SCALE, 'csrf')
+        detail = reverse('mailing:mailing', args=[mailings[0].pk])
+        manager = CustomUser.objects.create_user(email='manager@example.com', username='manager', password='x')
+        manager.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+        # Страницу первым открывает владелец; менеджер должен получить форму со своим токеном
+        self.client.get(detail)
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(manager)
+        page = client.get(detail).content.decode()
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page).group(1)
+        response = client.post(reverse('mailing:mailing-clone', args=[mailings[0].pk]), {'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_bulk_receivers(self):
+        receivers, _, mailings = seed(self.owner, SMALL_SCALE, 'bulk')
+        mailing = mailings[0]
+        extra = ReceiverMailing.objects.create(email='extra@example.com', full_name='Новый', owner=self.owner)
+        response = self.client.post(
+            reverse('mailing:api-mailing-receivers', args=[mailing.pk]),
+            {'add': [extra.pk, receivers[0].pk], 'remove': [receivers[1].pk]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'added': 1, 'removed': 1})
+        self.assertEqual(set(mailing.receivers.all()), {extra, receivers[0], *receivers[2:]})
+
+        # Форма заменяет получателей целиком: лишние удаляются, новые добавляются
+        local = timezone.localtime(mailing.start_time)
+        response = self.client.post(reverse('mailing:mailing-update', args=[mailing.pk]), {
+            'start_time': local.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': timezone.localtime(mailing.end_time).strftime('%Y-%m-%dT%H:%M'),
+            'message': mailing.message_id,
+            'receivers': [receivers[1].pk, extra.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(mailing.receivers.all()), {receivers[1], extra})
+
+
+@override_settings(**TEST_SETTINGS)
+class SchedulerTestCase(TestCase):
+    """Повторяющаяся рассылка запускается один раз за пропущенный период и переносится на следующий"""
+
+    def test_recurring_mailing(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        receivers, _, mailings = seed(owner, SMALL_SCALE, 'cron')
+        mailing = mailings[0]
+        now = timezone.now()
+        mailing.start_time = now - timedelta(days=3)
+        mailing.end_time = now + timedelta(days=30)
+        mailing.recurrence = '@daily'
+        mailing.save()
+        self.assertLessEqual(mailing.next_run_at, now)
+
+        call_command('run_scheduler', stdout=StringIO())
+        mailing.refresh_from_db()
+        self.assertEqual(len(mail.outbox), len(receivers))
+        self.assertEqual(mailing.status, Mailing.Status.RUNNING)
+        self.assertGreater(mailing.next_run_at, now)
+        self.assertEqual(timezone.localtime(mailing.next_run_at).hour, 0)
+
+        # До следующего запуска планировщик ничего не делает
+        call_command('run_scheduler', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), len(receivers))
+
+        # Копия повторяющейся рассылки тоже повторяется
+        self.assertEqual(mailing.clone(now + timedelta(hours=1), now + timedelta(days=2)).recurrence, '@daily')
+
+    def test_claimed_occurrence_survives_crash(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', username='owner', password='x')
+        receivers, _, mailings = seed(owner, SMALL_SCALE, 'crash')
+        mailing = mailings[0]
+        now = timezone.now()
+        mailing.start_time = now - timedelta(days=3)
+        mailing.recurrence = '@daily'
+        mailing.save()
+        due = mailing.next_run_at
+
+        # Планировщик захватил запуск и упал, ничего не отправив: пока захват не истек, запуск не повторяется
+        self.assertEqual(claim_due_mailings(10), [mailing])
+        call_command('run_scheduler', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        # После истечения захвата тот же запуск выполняется
+        Mailing.objects.filter(pk=mailing.pk).update(claimed_until=now - timedelta(seconds=1))
+        call_command('run_scheduler', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), len(receivers))
+        mailing.refresh_from_db()
+        self.assertGreater(mailing.next_run_at, now)
+        self.assertIsNone(mailing.claimed_until)
+
+        # Упал после отправки, не успев перенести запуск: повтор с тем же ключом писем не шлет
+        Mailing.objects.filter(pk=mailing.pk).update(next_run_at=due, last_run_at=None)
+        call_command('run_scheduler', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), len(receivers))
+        mailing.refresh_from_db()
+        self.assertGreater(mailing.next_run_at, now)
+
+
+class CronScheduleTestCase(SimpleTestCase):
+    """Разбор расписаний и поиск ближайшего запуска (время - в TIME_ZONE проекта)"""
+
+    def next_after(self, expression, *moment):
+        result = CronSchedule(expression).next_after(timezone.make_aware(datetime(*moment)))
+        return result and timezone.localtime(result).replace(tzinfo=None)
+
+    def test_steps_and_ranges(self):
+        schedule = CronSchedule('*/15 9-17/4 * * 1-5')
+        self.assertEqual(schedule.minutes, {0, 15, 30, 45})
+        self.assertEqual(schedule.hours, {9, 13, 17})
+        self.assertEqual(CronSchedule('5/20 0 * * *').minutes, {5, 25, 45})
+        # Пятница 17:50 -> понедельник 9:00
+        self.assertEqual(self.next_after('*/15 9-17/4 * * 1-5', 2026, 10, 23, 17, 50), datetime(2026, 10, 26, 9, 0))
+        # Воскресенье можно задать и 0, и 7
+        self.assertEqual(CronSchedule('0 0 * * 7').weekdays, CronSchedule('0 0 * * 0').weekdays)
+
+    def test_day_of_month_or_day_of_week(self):
+        # Как в cron: 13-е число ИЛИ пятница
+        self.assertEqual(self.next_after('0 0 13 * 5', 2026, 11, 1), datetime(2026, 11, 6))
+        self.assertEqual(self.next_after('0 0 13 * 5', 2026, 11, 10), datetime(2026, 11, 13))
+        # Если задано только одно из полей, второе не ограничивает
+        self.assertEqual(self.next_after('0 0 13 * *', 2026, 11, 1), datetime(2026, 11, 13))
+
+    def test_month_and_year_rollover(self):
+        self.assertEqual(self.next_after('@monthly', 2026, 1, 31, 23, 59), datetime(2026, 2, 1))
+        self.assertEqual(self.next_after('30 23 31 * *', 2026, 4, 1), datetime(2026, 5, 31, 23, 30))
+        self.assertEqual(self.next_after('@yearly', 2026, 12, 31, 12), datetime(2027, 1, 1))
+        self.assertEqual(self.next_after('0 0 29 2 *', 2026, 10, 19), datetime(2028, 2, 29))
+
+    def test_invalid_expressions(self):
+        for expression in ('61 * * * *', '* * *', 'a * * * *', '0 0 0 * *', '*/0 * * * *', '5-1 * * * *'):
+            with self.subTest(expression=expression), self.assertRaises(ValidationError):
+                validate_recurrence(expression)
+        with self.assertRaisesMessage(ValidationError, 'никогда'):
+            validate_recurrence('0 0 30 2 *')
+        validate_recurrence('@weekly')
+
+
+@override_settings(**TEST_SETTINGS)
+class WarmCacheTestCase(TransactionTestCase):
+    """После warm_cache главная и списки не считают данные заново"""
+
+    urls = ('mailing:home', 'mailing:receiver-list', 'mailing:message-list', 'mailing:mailing-list')
+
+    def setUp(self):
+        cache.clear()
+        self.owner = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='x', last_login=timezone.now(),
+        )
+        seed(self.owner, SMALL_SCALE, 'warm')
+        self.client.force_login(self.owner)
+
+    def count_queries(self, url_name):
+        invalidate_user_roles(self.owner.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse(url_name)).status_code, 200)
+        return len(queries)
+
+    def test_warm_cache(self):
+        cold = {url_name: self.count_queries(url_name) for url_name in self.urls}
+        cache.clear()
+        call_command('warm_cache', concurrency=2, stdout=StringIO())
+        for url_name in self.urls:
+            with self.subTest(url=url_name):
+                self.assertLess(self.count_queries(url_name), cold[url_name])
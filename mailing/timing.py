@@ -0,0 +1,74 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from djangocourseproject.metrics import registry
+
+# Этапы отправки рассылки в порядке выполнения
+SEND_STAGES = (
+    ('fetch', 'Выборка получателей'),
+    ('personalize', 'Персонализация'),
+    ('mime', 'Сборка MIME'),
+    ('smtp_connect', 'Подключение к SMTP'),
+    ('smtp_send', 'SMTP-транзакция'),
+    ('attempt_write', 'Запись попыток'),
+)
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class StageTimer:
+    """Замеряет время этапов и копит значения для отчета и метрик"""
+
+    def __init__(self, metric='mailing_stage_duration_seconds'):
+        self.metric = metric
+        self.durations = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, duration):
+        self.durations[name].append(duration)
+        registry.observe(self.metric, duration, {'stage': name}, buckets=STAGE_BUCKETS)
+
+    def summary(self):
+        """Сводка по этапам: количество, сумма, среднее, p50, p95 и максимум (секунды)"""
+        result = {}
+        for name, values in self.durations.items():
+            values = sorted(values)
+            total = sum(values)
+            result[name] = {
+                'count': len(values),
+                'total': round(total, 6),
+                'avg': round(total / len(values), 6),
+                'p50': round(percentile(values, 0.5), 6),
+                'p95': round(percentile(values, 0.95), 6),
+                'max': round(values[-1], 6),
+            }
+        return result
+
+    def report_lines(self):
+        """Строки таблицы для вывода в консоль"""
+        summary = self.summary()
+        lines = [f"{'Этап':<22}{'раз':>8}{'всего, мс':>12}{'сред., мс':>12}{'p95, мс':>10}{'макс., мс':>12}"]
+        for name, label in SEND_STAGES:
+            if name not in summary:
+                continue
+            row = summary[name]
+            lines.append(
+                f"{label:<22}{row['count']:>8}{row['total'] * 1000:>12.1f}{row['avg'] * 1000:>12.2f}"
+                f"{row['p95'] * 1000:>10.2f}{row['max'] * 1000:>12.2f}"
+            )
+        return lines
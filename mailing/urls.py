@@ -1,10 +1,19 @@
 from django.urls import path
+from mailing.api import (
+    ReceiverBatchAPIView, MessageBatchAPIView, MailingBatchAPIView, MailingReceiversAPIView,
+    SegmentReceiversAPIView, MessageAutocompleteAPIView, ReceiverAutocompleteAPIView, SegmentAutocompleteAPIView,
+)
 from mailing.views import (
     Home,
     ReceiverDetail, ReceiverCreateView, ReceiverUpdateView, ReceiverDeleteView, ReceiverListView,
+    ReceiverImportView, ReceiverExportView,
+    SegmentListView, SegmentDetail, SegmentCreateView, SegmentUpdateView, SegmentDeleteView,
     MessageDetail, MessageCreateView, MessageUpdateView, MessageDeleteView, MessageListView,
-    MailingListView, MailingDetail, MailingCreateView, MailingUpdateView, MailingDeleteView, MailingAttemptListView,
-    UserListView, UserToggleBlockView, MailingToggleView, mailing_disable_quick, start_mailing_view
+    MailingListView, MailingDetail, MailingCreateView, MailingUpdateView, MailingDeleteView, MailingCloneView,
+    MailingAttemptListView,
+    MailingStatsView, MailingAttemptExportView,
+    UserListView, UserToggleBlockView, MailingToggleView, DatabasePoolStatsView, mailing_disable_quick,
+    MailingStartView, MailingRunDetail,
 )
 
 app_name = 'mailing'
@@ -17,9 +26,18 @@ urlpatterns = [
     path('receiver/<int:pk>/', ReceiverDetail.as_view(), name='receiver'),
     path('receiver_list/', ReceiverListView.as_view(), name='receiver-list'),
     path('receiver/add/', ReceiverCreateView.as_view(), name='receiver-create'),
+    path('receiver/import/', ReceiverImportView.as_view(), name='receiver-import'),
+    path('receiver/export/', ReceiverExportView.as_view(), name='receiver-export'),
     path('receiver/<int:pk>/edit/', ReceiverUpdateView.as_view(), name='receiver-update'),
     path('receiver/<int:pk>/delete/', ReceiverDeleteView.as_view(), name='receiver-delete'),
 
+    # Сегменты получателей
+    path('segment/<int:pk>/', SegmentDetail.as_view(), name='segment'),
+    path('segment_list/', SegmentListView.as_view(), name='segment-list'),
+    path('segment/add/', SegmentCreateView.as_view(), name='segment-create'),
+    path('segment/<int:pk>/edit/', SegmentUpdateView.as_view(), name='segment-update'),
+    path('segment/<int:pk>/delete/', SegmentDeleteView.as_view(), name='segment-delete'),
+
     # Сообщения
     path('message/<int:pk>/', MessageDetail.as_view(), name='message'),
     path('message_list/', MessageListView.as_view(), name='message-list'),
@@ -33,12 +51,29 @@ urlpatterns = [
     path('mailing/add/', MailingCreateView.as_view(), name='mailing-create'),
     path('mailing/<int:pk>/edit/', MailingUpdateView.as_view(), name='mailing-update'),
     path('mailing/<int:pk>/delete/', MailingDeleteView.as_view(), name='mailing-delete'),
-    path('mailing/<int:pk>/start/', start_mailing_view, name='mailing-start'),
+    path('mailing/<int:pk>/clone/', MailingCloneView.as_view(), name='mailing-clone'),
+    path('mailing/<int:pk>/start/', MailingStartView.as_view(), name='mailing-start'),
+    path('mailing/<int:pk>/runs/<int:run_pk>/', MailingRunDetail.as_view(), name='mailing-run'),
     path('mailing_attempts_list/', MailingAttemptListView.as_view(), name='mailing_attempts-list'),
+    path('mailing_attempts/export/', MailingAttemptExportView.as_view(), name='mailing_attempts-export'),
+    path('mailing_stats/', MailingStatsView.as_view(), name='mailing-stats'),
+
+    # JSON API для пакетных операций
+    path('api/receivers/', ReceiverBatchAPIView.as_view(), name='api-receivers'),
+    path('api/messages/', MessageBatchAPIView.as_view(), name='api-messages'),
+    path('api/mailings/', MailingBatchAPIView.as_view(), name='api-mailings'),
+    path('api/mailings/<int:pk>/receivers/', MailingReceiversAPIView.as_view(), name='api-mailing-receivers'),
+    path('api/segments/<int:pk>/receivers/', SegmentReceiversAPIView.as_view(), name='api-segment-receivers'),
+
+    # Поиск для полей выбора в формах
+    path('api/autocomplete/messages/', MessageAutocompleteAPIView.as_view(), name='autocomplete-messages'),
+    path('api/autocomplete/receivers/', ReceiverAutocompleteAPIView.as_view(), name='autocomplete-receivers'),
+    path('api/autocomplete/segments/', SegmentAutocompleteAPIView.as_view(), name='autocomplete-segments'),
 
     # Управление для менеджеров
     path('manager/users/', UserListView.as_view(), name='user_list'),
     path('manager/user/<int:pk>/toggle-block/', UserToggleBlockView.as_view(), name='user_toggle_block'),
     path('manager/mailing/<int:pk>/toggle/', MailingToggleView.as_view(), name='mailing_toggle'),
     path('manager/mailing/<int:pk>/disable-quick/', mailing_disable_quick, name='mailing_disable_quick'),
+    path('manager/db_pool/', DatabasePoolStatsView.as_view(), name='db_pool_stats'),
 ]
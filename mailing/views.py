@@ -1,8 +1,26 @@
-from django.views.generic import DetailView, CreateView, DeleteView, TemplateView
-from mailing.forms import ReceiverForm, MessageForm, MailingForm
-from mailing.models import ReceiverMailing, Message, MailingAttempt
-from mailing.permissions import OwnerOrManagerRequiredMixin, user_is_manager, user_is_owner_or_manager
+from django.views.generic import DetailView, CreateView, DeleteView, TemplateView, FormView
+from django.core.exceptions import ValidationError
+from mailing.forms import ReceiverForm, ReceiverImportForm, ReceiverListForm, MessageForm, MailingForm
+from mailing.importers import import_receivers
+from mailing.exports import EXPORT_FORMATS, export_response
+from django.views import View
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, JsonResponse
+from datetime import date
+from mailing.models import (
+    ReceiverMailing, ReceiverList, Message, MailingAttempt, MailingDailyStat, MailingRun, RollupWatermark,
+    recipients_of,
+)
+from mailing.rollups import WATERMARK_NAME
+from mailing.signals import adjust_mailing_counters
+from mailing.pg import pool_stats
+from mailing.timing import SEND_STAGES
+from mailing.rows import MailingRow, MessageRow, ReceiverRow, UserRow, cached_rows
+from mailing.permissions import (
+    AsyncLoginRequiredMixin, ObjectPermissionMixin, OwnerOrManagerRequiredMixin, auser_is_manager, user_is_manager,
+)
 from django.views.generic import ListView, UpdateView
+from django.views.generic.detail import SingleObjectMixin
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
 from django.urls import reverse_lazy
@@ -13,100 +31,89 @@ from mailing.models import Mailing
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from django.core.cache import cache
-from django.db.models import Count, Q
+from djangocourseproject.cache.stampede import get_or_compute, aget_or_compute
+from django.db import transaction
+from django.db.models import Count, Q, Sum
 from io import StringIO
+import uuid
 from django.core.management import call_command
-from django.utils.timezone import now
+from django.utils.timezone import now, localdate, make_aware
+from datetime import datetime, time, timedelta
 
 
 # Общие View
-class Home(LoginRequiredMixin, TemplateView):
-    template_name = 'mailing/home.html'
+class AsyncListView(AsyncLoginRequiredMixin, ListView):
+    """ListView, который загружает список через асинхронный ORM и кеш.
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
+    Строки списка описывает row_class, ключ кеша - шаблон cache_key с подстановкой user.
+    """
+    row_class = None
+    cache_key = None
 
-        if user.is_authenticated:
-            # Используем кеширование для статистики пользователя
-            cache_key = f"user_home_stats_{user.id}"
-            cached_stats = cache.get(cache_key)
-
-            if cached_stats:
-                context.update(cached_stats)
-            else:
-                # Пользователь видит только свои данные
-                mailing_count = Mailing.objects.filter(owner=user).count()
-                mailing_active_count = Mailing.objects.filter(status='Запущена', owner=user).count()
-
-                # Количество уникальных получателей у пользователя
-                user_mailings = Mailing.objects.filter(owner=user)
-                receivers_set = set()
-                for mailing in user_mailings:
-                    receivers_set.update(mailing.receivers.all())
-                receivers_count = len(receivers_set)
-
-                successful_mailings = user.successful_mailing_count or 0
-                unsuccessful_mailings = user.unsuccessful_mailing_count or 0
-                messages_count = user.messages_count or 0
-
-                # Сохраняем в кеш на 2 минуты
-                stats = {
-                    'mailing_count': mailing_count,
-                    'mailing_active_count': mailing_active_count,
-                    'receivers_count': receivers_count,
-                    'successful_mailings': successful_mailings,
-                    'unsuccessful_mailings': unsuccessful_mailings,
-                    'messages_count': messages_count,
-                }
-                cache.set(cache_key, stats, 120)  # 120 секунд = 2 минуты
-                context.update(stats)
+    async def get(self, request, *args, **kwargs):
+        self.object_list = await self.aget_queryset()
+        context = self.get_context_data()
+        return self.render_to_response(context)
 
-        return context
-
-class ReceiverListView(LoginRequiredMixin, ListView):
-    model = ReceiverMailing
-    template_name = 'mailing/receiver_list.html'
-    context_object_name = 'receivers'
+    async def aget_queryset(self):
+        return await self.aget_rows(self.request.user)
 
-    def get_queryset(self):
-        user = self.request.user
+    async def aget_user_queryset(self, user):
+        """Записи, которые видит пользователь: менеджер - все, остальные - свои"""
+        if await auser_is_manager(user):
+            return self.model._default_manager.all()
+        return self.model._default_manager.filter(owner=user)
 
-        cache_key = f"receivers_list_{user.id}"
-        cached_receivers = cache.get(cache_key)
+    async def aget_rows(self, user):
+        """Строки списка пользователя, их же заранее кеширует команда warm_cache"""
+        return await cached_rows(self.cache_key.format(user=user), await self.aget_user_queryset(user), self.row_class)
 
-        if cached_receivers:
-            return cached_receivers
 
-        if user_is_manager(user):
-            receivers = ReceiverMailing.objects.select_related('owner').all()
-        else:
-            receivers = ReceiverMailing.objects.select_related('owner').filter(owner=user)
+class Home(AsyncLoginRequiredMixin, TemplateView):
+    template_name = 'mailing/home.html'
 
-        cache.set(cache_key, receivers, 60)
-        return receivers
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        context.update(await self.aget_stats(request.user))
+        return self.render_to_response(context)
+
+    async def aget_stats(self, user):
+        # Статистику пересчитывает один запрос, остальные получают прежнее значение
+        return await aget_or_compute(f"user_home_stats_{user.id}", lambda: self.acompute_stats(user), 120)
+
+    async def acompute_stats(self, user):
+        # Количество уникальных получателей у пользователя (с учетом сегментов) - одним запросом
+        receivers_count = await recipients_of(Mailing.objects.filter(owner=user)).acount()
+
+        # Счетчики рассылок хранятся у пользователя и поддерживаются сигналами
+        stats = {
+            'mailing_count': user.mailing_count,
+            'mailing_active_count': user.active_mailing_count,
+            'receivers_count': receivers_count,
+            'successful_mailings': user.successful_mailing_count or 0,
+            'unsuccessful_mailings': user.unsuccessful_mailing_count or 0,
+            'messages_count': user.messages_count or 0,
+        }
+        return stats
+
+class ReceiverListView(AsyncListView):
+    model = ReceiverMailing
+    template_name = 'mailing/receiver_list.html'
+    context_object_name = 'receivers'
+    row_class = ReceiverRow
+    cache_key = "receivers_list_{user.id}"
 
-class ReceiverDetail(LoginRequiredMixin, DetailView):
+class ReceiverDetail(ObjectPermissionMixin, DetailView):
     model = ReceiverMailing
     template_name = 'mailing/receiver.html'
     context_object_name = 'receiver'
+    shared_via = 'receivers'
+    permission_denied_message = "Вы не можете просматривать этого получателя"
 
     @method_decorator(cache_page(60 * 3))  # Кешируем страницу на 3 минуты
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
-    def get_object(self, queryset=None):
-        receiver = super().get_object(queryset)
-        user = self.request.user
-
-        if user_is_owner_or_manager(user, receiver):
-            return receiver
-
-        if Mailing.objects.filter(owner=user, receivers=receiver).exists():
-            return receiver
-
-        raise PermissionDenied("Вы не можете просматривать этого получателя")
-
 
 class ReceiverCreateView(LoginRequiredMixin, CreateView):
     model = ReceiverMailing
@@ -123,11 +130,48 @@ class ReceiverCreateView(LoginRequiredMixin, CreateView):
         return response
 
 
-class ReceiverUpdateView(LoginRequiredMixin, UpdateView):
+class ReceiverImportView(LoginRequiredMixin, FormView):
+    """Массовая загрузка получателей из CSV-файла"""
+    form_class = ReceiverImportForm
+    template_name = 'mailing/receiver_import.html'
+
+    def form_valid(self, form):
+        user = self.request.user
+        uploaded = form.cleaned_data['file']
+
+        try:
+            result = import_receivers(uploaded.open('rb'), user)
+        except (ValidationError, UnicodeDecodeError) as e:
+            form.add_error('file', f'Не удалось прочитать файл: {e}')
+            return self.form_invalid(form)
+
+        cache.delete(f"receivers_list_{user.id}")
+        cache.delete(f"user_home_stats_{user.id}")
+
+        # Показываем отчет об импорте вместо редиректа
+        return self.render_to_response(self.get_context_data(form=self.form_class(), result=result))
+
+
+def receiver_mailing_owner_ids(receiver):
+    """Владельцы рассылок, которые могут дойти до получателя напрямую или через сегменты"""
+    # Условия фильтров не проверяем: лишний раз очистить кеш дешевле, чем считать точно
+    return set(
+        Mailing.objects.filter(
+            Q(receivers=receiver)
+            | Q(segments__receivers=receiver)
+            | Q(segments__kind=ReceiverList.Kind.FILTER, segments__owner_id=receiver.owner_id),
+            owner__isnull=False,
+        ).values_list('owner_id', flat=True)
+    )
+
+
+class ReceiverUpdateView(ObjectPermissionMixin, UpdateView):
     model = ReceiverMailing
     form_class = ReceiverForm
     template_name = 'mailing/receiver_edit.html'
     success_url = reverse_lazy('mailing:home')
+    shared_via = 'receivers'
+    permission_denied_message = "Вы не можете редактировать этого получателя"
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -135,11 +179,7 @@ class ReceiverUpdateView(LoginRequiredMixin, UpdateView):
         receiver = self.object
 
         # Находим всех пользователей, у которых есть этот получатель
-        user_ids = set()
-        mailings = Mailing.objects.filter(receivers=receiver).select_related('owner')
-        for mailing in mailings:
-            if mailing.owner:
-                user_ids.add(mailing.owner.id)
+        user_ids = receiver_mailing_owner_ids(receiver)
 
         # Очищаем кеш для каждого пользователя
         for user_id in user_ids:
@@ -147,34 +187,20 @@ class ReceiverUpdateView(LoginRequiredMixin, UpdateView):
 
         return response
 
-    def dispatch(self, request, *args, **kwargs):
-        receiver = self.get_object()
-        user = request.user
-
-        if user_is_owner_or_manager(user, receiver):
-            return super().dispatch(request, *args, **kwargs)
-
-        if Mailing.objects.filter(owner=user, receivers=receiver).exists():
-            return super().dispatch(request, *args, **kwargs)
 
-        raise PermissionDenied("Вы не можете редактировать этого получателя")
-
-
-class ReceiverDeleteView(LoginRequiredMixin, DeleteView):
+class ReceiverDeleteView(ObjectPermissionMixin, DeleteView):
     model = ReceiverMailing
     template_name = 'mailing/receiver_delete.html'
     success_url = reverse_lazy('mailing:home')
+    shared_via = 'receivers'
+    permission_denied_message = "Вы не можете удалить этого получателя"
 
     def delete(self, request, *args, **kwargs):
         # Сохраняем информацию о получателе до удаления
         receiver = self.get_object()
 
         # Находим всех пользователей, связанных с этим получателем
-        user_ids = set()
-        mailings = Mailing.objects.filter(receivers=receiver).select_related('owner')
-        for mailing in mailings:
-            if mailing.owner:
-                user_ids.add(mailing.owner.id)
+        user_ids = receiver_mailing_owner_ids(receiver)
 
         response = super().delete(request, *args, **kwargs)
 
@@ -184,65 +210,105 @@ class ReceiverDeleteView(LoginRequiredMixin, DeleteView):
 
         return response
 
-    def dispatch(self, request, *args, **kwargs):
-        # Аналогичная проверка как в UpdateView
-        receiver = self.get_object()
-        user = request.user
 
-        if user_is_owner_or_manager(user, receiver):
-            return super().dispatch(request, *args, **kwargs)
+# Сегменты получателей
+def invalidate_segment_stats(segment):
+    """Очищает статистику владельцев рассылок, которые используют сегмент"""
+    user_ids = set(
+        Mailing.objects.filter(segments=segment, owner__isnull=False).values_list('owner_id', flat=True)
+    )
+    for user_id in user_ids:
+        cache.delete(f"user_home_stats_{user_id}")
 
-        if Mailing.objects.filter(owner=user, receivers=receiver).exists():
-            return super().dispatch(request, *args, **kwargs)
 
-        raise PermissionDenied("Вы не можете удалить этого получателя")
+class SegmentListView(LoginRequiredMixin, ListView):
+    model = ReceiverList
+    template_name = 'mailing/segment_list.html'
+    context_object_name = 'segments'
 
+    def get_queryset(self):
+        segments = ReceiverList.objects.select_related('owner').order_by('name')
+        if user_is_manager(self.request.user):
+            return segments
+        return segments.filter(owner=self.request.user)
 
-class MessageListView(LoginRequiredMixin, ListView):
-    model = Message
-    template_name = 'mailing/message_list.html'
-    context_object_name = 'messages'
 
-    def get_queryset(self):
-        user = self.request.user
+class SegmentDetail(ObjectPermissionMixin, DetailView):
+    model = ReceiverList
+    template_name = 'mailing/segment.html'
+    context_object_name = 'segment'
+    permission_denied_message = "Вы не можете просматривать этот сегмент"
+    # Сколько получателей показывать на странице сегмента
+    preview_size = 50
 
-        cache_key = f"messages_list_{user.id}"
-        cached_messages = cache.get(cache_key)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        receivers = self.object.get_receivers()
+        context['receivers_count'] = receivers.count()
+        context['receivers'] = receivers.order_by('email')[:self.preview_size]
+        return context
 
-        if cached_messages:
-            return cached_messages
 
-        if user_is_manager(user):
-            messages = Message.objects.select_related('owner').all()
-        else:
-            messages = Message.objects.select_related('owner').filter(owner=user)
+class SegmentCreateView(LoginRequiredMixin, CreateView):
+    model = ReceiverList
+    form_class = ReceiverListForm
+    template_name = 'mailing/segment_form.html'
+    success_url = reverse_lazy('mailing:segment-list')
 
-        cache.set(cache_key, messages, 60)
-        return messages
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['owner'] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        form.instance.owner = self.request.user
+        return super().form_valid(form)
 
 
-class MessageDetail(LoginRequiredMixin, DetailView):
+class SegmentUpdateView(ObjectPermissionMixin, UpdateView):
+    model = ReceiverList
+    form_class = ReceiverListForm
+    template_name = 'mailing/segment_edit.html'
+    success_url = reverse_lazy('mailing:segment-list')
+    permission_denied_message = "Вы не можете редактировать этот сегмент"
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        invalidate_segment_stats(self.object)
+        return response
+
+
+class SegmentDeleteView(ObjectPermissionMixin, DeleteView):
+    model = ReceiverList
+    template_name = 'mailing/segment_delete.html'
+    success_url = reverse_lazy('mailing:segment-list')
+    permission_denied_message = "Вы не можете удалить этот сегмент"
+
+    def form_valid(self, form):
+        invalidate_segment_stats(self.object)
+        return super().form_valid(form)
+
+
+class MessageListView(AsyncListView):
+    model = Message
+    template_name = 'mailing/message_list.html'
+    context_object_name = 'messages'
+    row_class = MessageRow
+    cache_key = "messages_list_{user.id}"
+
+
+class MessageDetail(ObjectPermissionMixin, DetailView):
     model = Message
     template_name = 'mailing/message.html'
     context_object_name = 'message'
+    # Сообщение доступно и тем, кто использует его в своих рассылках
+    shared_via = 'message'
+    permission_denied_message = "Вы не можете просматривать это сообщение"
 
     @method_decorator(cache_page(60 * 3))  # Кешируем страницу на 3 минуты
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
-    def get_object(self, queryset=None):
-        message = super().get_object(queryset)
-        user = self.request.user
-
-        if user_is_owner_or_manager(user, message):
-            return message
-
-        # Проверяем, использует ли пользователь это сообщение в своих рассылках
-        if Mailing.objects.filter(owner=user, message=message).exists():
-            return message
-
-        raise PermissionDenied("Вы не можете просматривать это сообщение")
-
 
 class MessageCreateView(LoginRequiredMixin, CreateView):
     model = Message
@@ -259,11 +325,13 @@ class MessageCreateView(LoginRequiredMixin, CreateView):
         return response
 
 
-class MessageUpdateView(LoginRequiredMixin, UpdateView):
+class MessageUpdateView(ObjectPermissionMixin, UpdateView):
     model = Message
     form_class = MessageForm
     template_name = 'mailing/message_edit.html'
     success_url = reverse_lazy('mailing:home')
+    shared_via = 'message'
+    permission_denied_message = "Вы не можете редактировать это сообщение"
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -271,11 +339,9 @@ class MessageUpdateView(LoginRequiredMixin, UpdateView):
         message = self.object
 
         # Находим всех пользователей, у которых есть это сообщение
-        user_ids = set()
-        mailings = Mailing.objects.filter(message=message).select_related('owner')
-        for mailing in mailings:
-            if mailing.owner:
-                user_ids.add(mailing.owner.id)
+        user_ids = set(
+            Mailing.objects.filter(message=message, owner__isnull=False).values_list('owner_id', flat=True)
+        )
 
         # Очищаем кеш для каждого пользователя
         for user_id in user_ids:
@@ -283,23 +349,12 @@ class MessageUpdateView(LoginRequiredMixin, UpdateView):
 
         return response
 
-    def dispatch(self, request, *args, **kwargs):
-        message = self.get_object()
-        user = request.user
-
-        if user_is_owner_or_manager(user, message):
-            return super().dispatch(request, *args, **kwargs)
-
-        # Проверяем, использует ли пользователь это сообщение в своих рассылках
-        if Mailing.objects.filter(owner=user, message=message).exists():
-            return super().dispatch(request, *args, **kwargs)
 
-        raise PermissionDenied("Вы не можете редактировать это сообщение")
-
-
-class MessageDeleteView(LoginRequiredMixin, DeleteView):
+class MessageDeleteView(ObjectPermissionMixin, DeleteView):
     model = Message
     template_name = 'mailing/message_delete.html'
+    shared_via = 'message'
+    permission_denied_message = "Вы не можете удалить это сообщение"
 
     def get_success_url(self):
         return f"{reverse_lazy('mailing:home')}?t={now().timestamp()}"
@@ -309,11 +364,9 @@ class MessageDeleteView(LoginRequiredMixin, DeleteView):
         message = self.get_object()
 
         # Находим всех пользователей, связанных с этим сообщением
-        user_ids = set()
-        mailings = Mailing.objects.filter(message=message).select_related('owner')
-        for mailing in mailings:
-            if mailing.owner:
-                user_ids.add(mailing.owner.id)
+        user_ids = set(
+            Mailing.objects.filter(message=message, owner__isnull=False).values_list('owner_id', flat=True)
+        )
 
         response = super().delete(request, *args, **kwargs)
 
@@ -323,75 +376,186 @@ class MessageDeleteView(LoginRequiredMixin, DeleteView):
 
         return response
 
-    def dispatch(self, request, *args, **kwargs):
-        message = self.get_object()
-        user = request.user
-
-        if user_is_owner_or_manager(user, message):
-            return super().dispatch(request, *args, **kwargs)
-
-        if Mailing.objects.filter(owner=user, message=message).exists():
-            return super().dispatch(request, *args, **kwargs)
-
-        raise PermissionDenied("Вы не можете удалить это сообщение")
-
 
 # Рассылки - с использованием миксина
-class MailingListView(LoginRequiredMixin, ListView):
+class MailingListView(AsyncListView):
     model = Mailing
     template_name = 'mailing/mailing_list.html'
     context_object_name = 'mailings'
+    row_class = MailingRow
+    # Менеджеры видят все рассылки, пользователи - только свои; кеш на 1 минуту
+    cache_key = "mailings_list_{user.id}"
 
-    def get_queryset(self):
-        user = self.request.user
+class MailingAttemptListView(AsyncListView):
+    model = Mailing
+    template_name = 'mailing/mailing_attempts_list.html'
+    context_object_name = 'mailing_attempts'
+    # Тяжелое чтение - отправляем на реплику
+    use_replica = True
 
-        # Используем кеширование для списка рассылок
-        cache_key = f"mailings_list_{user.id}"
-        cached_mailings = cache.get(cache_key)
+    async def aget_queryset(self):
+        user = self.request.user
 
-        if cached_mailings:
-            return cached_mailings
+        mailing_attempts = MailingAttempt.objects.select_related(
+            'mailing', 'mailing__owner'
+        ).filter(mailing__owner=user).order_by('-attempt_time')
 
-        if user_is_manager(user):
-            # Менеджеры видят все рассылки
-            mailings = Mailing.objects.select_related('message', 'owner').all()
-        else:
-            # Пользователи видят только свои
-            mailings = Mailing.objects.select_related('message', 'owner').filter(owner=user)
+        return [attempt async for attempt in mailing_attempts]
 
-        # Кешируем на 1 минуту
-        cache.set(cache_key, mailings, 60)
-        return mailings
 
-class MailingAttemptListView(LoginRequiredMixin, ListView):
-    model = Mailing
-    template_name = 'mailing/mailing_attempts_list.html'
-    context_object_name = 'mailing_attempts'
+class ExportView(LoginRequiredMixin, View):
+    """Базовый view потоковой выгрузки: ?format=csv|jsonl"""
+    filename = 'export'
+    model = None
+    # Заголовки колонок и соответствующие им поля values_list()
+    fields = ()
+    columns = ()
+    owner_field = 'owner'
+    ordering = ('pk',)
+    use_replica = True
 
     def get_queryset(self):
+        """Доступные пользователю записи model, values_list() с полями columns"""
+        queryset = self.filter_owner(self.model._default_manager.all(), owner_field=self.owner_field)
+        return queryset.order_by(*self.ordering).values_list(*self.columns)
+
+    def format_row(self, row):
+        return row
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return HttpResponseBadRequest('Неизвестный формат выгрузки')
+        try:
+            queryset = self.get_queryset()
+        except ValueError:
+            return HttpResponseBadRequest('Некорректные параметры выгрузки')
+        return export_response(
+            self.fields, queryset, self.filename, fmt,
+            format_row=self.format_row, is_async=isinstance(request, ASGIRequest),
+        )
+
+    def filter_owner(self, queryset, owner_field='owner'):
+        """Менеджер может выгрузить данные любого пользователя (?owner=<id>), остальные - только свои"""
         user = self.request.user
+        owner_id = self.request.GET.get('owner')
+        # Строки читаются уже после выхода из middleware, поэтому фиксируем базу сейчас
+        queryset = queryset.using(queryset.db)
+        if not user_is_manager(user):
+            return queryset.filter(**{owner_field: user})
+        if owner_id:
+            return queryset.filter(**{f'{owner_field}_id': int(owner_id)})
+        return queryset
 
-        mailing_attempts = MailingAttempt.objects.select_related(
-            'mailing', 'mailing__owner'
-        ).filter(mailing__owner=user)
 
-        return mailing_attempts
+class MailingAttemptExportView(ExportView):
+    """Выгрузка попыток рассылок: ?mailing=<id>&owner=<id>&date_from=ГГГГ-ММ-ДД&date_to=ГГГГ-ММ-ДД"""
+    filename = 'mailing_attempts'
+    model = MailingAttempt
+    fields = ('id', 'attempt_time', 'status', 'server_response', 'mailing_id', 'owner_email')
+    columns = ('id', 'attempt_time', 'status', 'server_response', 'mailing_id', 'mailing__owner__email')
+    owner_field = 'mailing__owner'
+    ordering = ('attempt_time',)
+    status_labels = dict(MailingAttempt.Status.choices)
+
+    def get_queryset(self):
+        params = self.request.GET
+        attempts = super().get_queryset()
+
+        if params.get('mailing'):
+            attempts = attempts.filter(mailing_id=int(params['mailing']))
+        # Фильтр по времени позволяет PostgreSQL читать только нужные партиции
+        if params.get('date_from'):
+            start = make_aware(datetime.combine(date.fromisoformat(params['date_from']), time.min))
+            attempts = attempts.filter(attempt_time__gte=start)
+        if params.get('date_to'):
+            end = make_aware(datetime.combine(date.fromisoformat(params['date_to']), time.min))
+            attempts = attempts.filter(attempt_time__lt=end + timedelta(days=1))
+
+        return attempts
+
+    def format_row(self, row):
+        pk, at, status, response, mailing_id, email = row
+        return pk, at, self.status_labels.get(status, status), response, mailing_id, email
+
+
+class ReceiverExportView(ExportView):
+    """Выгрузка получателей: ?owner=<id> (для менеджеров)"""
+    filename = 'receivers'
+    model = ReceiverMailing
+    fields = ('id', 'email', 'full_name', 'comm', 'owner_email')
+    columns = ('id', 'email', 'full_name', 'comm', 'owner__email')
+
+
+class MailingStatsView(AsyncLoginRequiredMixin, TemplateView):
+    """Отчет по доставке за период, строится по дневной статистике, а не по сырым попыткам"""
+    template_name = 'mailing/mailing_stats.html'
+    use_replica = True
+    default_days = 30
+    max_days = 366
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get('days', self.default_days))
+        except ValueError:
+            days = self.default_days
+        return min(max(days, 1), self.max_days)
+
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        context.update(await self.aget_stats(request.user))
+        return self.render_to_response(context)
+
+    async def aget_stats(self, user):
+        days = self.get_days()
+
+        stats = MailingDailyStat.objects.filter(day__gt=localdate() - timedelta(days=days))
+        if not await auser_is_manager(user):
+            stats = stats.filter(owner=user)
+
+        totals = {
+            'success': Sum('attempts_count', filter=Q(status=MailingAttempt.Status.SUCCESS), default=0),
+            'failed': Sum('attempts_count', filter=Q(status=MailingAttempt.Status.FAILED), default=0),
+        }
+        daily = stats.values('day').annotate(**totals).order_by('-day')
+        by_mailing = (
+            stats.values('mailing_id', 'mailing__message__topic')
+            .annotate(**totals)
+            .order_by('-success', 'mailing_id')
+        )
+
+        return {
+            'days': days,
+            'daily_stats': [row async for row in daily],
+            'mailing_stats': [row async for row in by_mailing],
+            'watermark': await RollupWatermark.objects.filter(name=WATERMARK_NAME)
+            .values_list('position', flat=True).afirst(),
+        }
 
 
 class MailingDetail(OwnerOrManagerRequiredMixin, DetailView):
     model = Mailing
     template_name = 'mailing/mailing.html'
     context_object_name = 'mailing'
-
-    @method_decorator(cache_page(60 * 2))  # Кешируем страницу на 2 минуты
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    # Страница не кешируется: в ней формы с CSRF-токеном пользователя и ключ текущего запуска
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset)
         obj.update_status()
         return obj
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Время по этапам последнего запуска, в порядке выполнения
+        last_run = self.object.stats.get('last_run', {})
+        stages = last_run.get('stages', {})
+        context['last_run'] = last_run
+        context['recipients_count'] = self.object.get_recipients().count()
+        context['last_run_stages'] = [
+            {'label': label, **stages[name]} for name, label in SEND_STAGES if name in stages
+        ]
+        return context
+
 
 class MailingCreateView(LoginRequiredMixin, CreateView):
     model = Mailing
@@ -399,6 +563,11 @@ class MailingCreateView(LoginRequiredMixin, CreateView):
     template_name = 'mailing/mailing_form.html'
     success_url = reverse_lazy('mailing:mailing-list')
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
         form.instance.owner = self.request.user
         response = super().form_valid(form)
@@ -415,6 +584,11 @@ class MailingUpdateView(OwnerOrManagerRequiredMixin, UpdateView):
     template_name = 'mailing/mailing_edit.html'
     success_url = reverse_lazy('mailing:mailing-list')
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
         response = super().form_valid(form)
         # Очищаем кеши после обновления рассылки
@@ -424,6 +598,23 @@ class MailingUpdateView(OwnerOrManagerRequiredMixin, UpdateView):
         return response
 
 
+class MailingCloneView(OwnerOrManagerRequiredMixin, SingleObjectMixin, View):
+    """Копия рассылки с теми же сообщением и получателями, время сдвигается вперед"""
+    model = Mailing
+    # Через сколько после копирования начинается новая рассылка
+    start_delay = timedelta(hours=1)
+
+    def post(self, request, *args, **kwargs):
+        mailing = self.get_object()
+        start_time = (now() + self.start_delay).replace(second=0, microsecond=0)
+        copy = mailing.clone(start_time, start_time + (mailing.end_time - mailing.start_time))
+
+        cache.delete(f"mailings_list_{copy.owner_id}")
+        cache.delete(f"user_home_stats_{copy.owner_id}")
+        messages.success(request, f'Создана копия рассылки #{mailing.id}, проверьте время отправки')
+        return redirect('mailing:mailing-update', pk=copy.pk)
+
+
 class MailingDeleteView(OwnerOrManagerRequiredMixin, DeleteView):
     model = Mailing
     template_name = 'mailing/mailing_delete.html'
@@ -445,7 +636,7 @@ class ManagerRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     def test_func(self):
         user = self.request.user
         # Проверяем, состоит ли пользователь в группе Менеджеры
-        return user.groups.filter(name='Менеджеры').exists()
+        return user_is_manager(user)
 
     def handle_no_permission(self):
         if self.request.user.is_authenticated:
@@ -458,51 +649,48 @@ class UserListView(ManagerRequiredMixin, ListView):
     model = CustomUser
     template_name = 'mailing/user_list.html'
     context_object_name = 'users'
+    use_replica = True
 
     @method_decorator(cache_page(60 * 10))  # Кешируем страницу на 10 минут
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        # Используем кеширование для списка пользователей
-        cache_key = "users_list_managers"
-        cached_users = cache.get(cache_key)
+        return self.get_rows()
 
-        if cached_users:
-            return cached_users
+    def get_rows(self):
+        # Показываем всех пользователей кроме суперпользователей.
+        # Количество рассылок берем из денормализованных счетчиков, без GROUP BY.
+        # Кешируем на 5 минут готовый список, пересчитывает его один запрос
+        users = CustomUser.objects.filter(is_superuser=False).order_by('email')
 
-        # Показываем всех пользователей кроме суперпользователей
-        users = CustomUser.objects.filter(is_superuser=False) \
-            .annotate(
-            mailing_count=Count('mailing', distinct=True),
-            active_mailing_count=Count('mailing', filter=Q(mailing__status='Запущена'), distinct=True)
-        ) \
-            .order_by('email')
+        def compute():
+            return UserRow.pack(UserRow.values(users))
 
-        # Кешируем на 5 минут
-        cache.set(cache_key, users, 300)
-        return users
+        rows = UserRow.unpack(get_or_compute("users_list_managers", compute, 300))
+        if rows is None:
+            # В кеше запись старого формата - следующий запрос закеширует новую
+            cache.delete("users_list_managers")
+            rows = UserRow.unpack(compute())
+        return rows
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        # Кешируем общую статистику
-        cache_key = "users_stats"
-        cached_stats = cache.get(cache_key)
-
-        if cached_stats:
-            context.update(cached_stats)
-        else:
-            stats = {
-                'total_users': CustomUser.objects.filter(is_superuser=False).count(),
-                'active_users': CustomUser.objects.filter(is_superuser=False, is_active=True).count(),
-                'blocked_users': CustomUser.objects.filter(is_superuser=False, is_active=False).count(),
-            }
-            cache.set(cache_key, stats, 120)  # 2 минуты
-            context.update(stats)
-
+        context.update(self.get_stats())
         return context
 
+    def get_stats(self):
+        # Кешируем общую статистику на 2 минуты
+        return get_or_compute(
+            "users_stats",
+            lambda: CustomUser.objects.filter(is_superuser=False).aggregate(
+                total_users=Count('pk'),
+                active_users=Count('pk', filter=Q(is_active=True)),
+                blocked_users=Count('pk', filter=Q(is_active=False)),
+            ),
+            120,
+        )
+
 
 # Блокировка/разблокировка пользователя
 class UserToggleBlockView(ManagerRequiredMixin, UpdateView):
@@ -523,11 +711,6 @@ class UserToggleBlockView(ManagerRequiredMixin, UpdateView):
                 self.request,
                 f'Пользователь {user.email} заблокирован'
             )
-            # Дополнительно: блокируем все активные рассылки пользователя
-            active_mailings = Mailing.objects.filter(owner=user, status='Запущена')
-            for mailing in active_mailings:
-                mailing.status = 'Заблокирована'
-                mailing.save()
         else:
             # Разблокируем пользователя
             user.is_active = True
@@ -536,7 +719,15 @@ class UserToggleBlockView(ManagerRequiredMixin, UpdateView):
                 f'Пользователь {user.email} разблокирован'
             )
 
-        user.save()
+        with transaction.atomic():
+            # Сохраняем только is_active, чтобы не перезаписать счетчики, изменившиеся в БД
+            user.save(update_fields=['is_active'])
+            if not user.is_active:
+                # Активные рассылки пользователя блокируем одним UPDATE, счетчик поправляем явно
+                blocked = Mailing.objects.filter(owner=user, status=Mailing.Status.RUNNING).update(
+                    status=Mailing.Status.BLOCKED, next_run_at=None,
+                )
+                adjust_mailing_counters(user.pk, active=-blocked)
 
         # Очищаем кеши после изменения статуса пользователя
         cache.delete("users_list_managers")
@@ -564,14 +755,14 @@ class MailingToggleView(ManagerRequiredMixin, UpdateView):
     def form_valid(self, form):
         mailing = self.object
 
-        if mailing.status == 'Запущена':
+        if mailing.status == Mailing.Status.RUNNING:
             # Отключаем рассылку
-            mailing.status = 'Отключена менеджером'
+            mailing.status = Mailing.Status.DISABLED
             messages.warning(
                 self.request,
                 f'Рассылка #{mailing.id} отключена'
             )
-        elif mailing.status == 'Отключена менеджером':
+        elif mailing.status == Mailing.Status.DISABLED:
             # Включаем рассылку обратно
             mailing.update_status()  # Используем существующий метод для определения статуса
             messages.success(
@@ -592,20 +783,28 @@ class MailingToggleView(ManagerRequiredMixin, UpdateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['action'] = 'disable' if self.object.status == 'Запущена' else 'enable'
+        context['action'] = 'disable' if self.object.status == Mailing.Status.RUNNING else 'enable'
         return context
 
 
+# Состояние пула соединений с БД для мониторинга
+class DatabasePoolStatsView(ManagerRequiredMixin, View):
+    """Статистика пулов соединений psycopg в формате JSON"""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'pools': pool_stats()})
+
+
 # Быстрое отключение рассылки без подтверждения
 def mailing_disable_quick(request, pk):
     """Быстрое отключение рассылки (для использования из списка)"""
-    if not request.user.groups.filter(name='Менеджеры').exists():
+    if not user_is_manager(request.user):
         raise PermissionDenied("Только менеджеры могут выполнять это действие")
 
     mailing = get_object_or_404(Mailing, pk=pk)
 
-    if mailing.status == 'Запущена':
-        mailing.status = 'Отключена менеджером'
+    if mailing.status == Mailing.Status.RUNNING:
+        mailing.status = Mailing.Status.DISABLED
         mailing.save()
         messages.warning(request, f'Рассылка #{mailing.id} отключена')
 
@@ -619,29 +818,45 @@ def mailing_disable_quick(request, pk):
     return redirect('mailing:mailing')
 
 
-def start_mailing_view(request, pk):
-    """View для запуска рассылки по кнопке"""
-    mailing = get_object_or_404(Mailing, pk=pk)
+class MailingStartView(OwnerOrManagerRequiredMixin, SingleObjectMixin, View):
+    """Запуск рассылки по кнопке.
 
-    # Проверка прав доступа (если нужно)
-    if not request.user.is_authenticated:
-        messages.error(request, 'Необходима авторизация')
-        return redirect('user:login')
-
-    try:
-        # Сохраняем вывод в буфер
-        out = StringIO()
-
-        # Запускаем команду
-        call_command('start_mailing', str(pk), stdout=out)
+    Форма передает ключ запуска, поэтому повторное нажатие (или запуск, пока
+    идет другой) не отправляет письма заново, а открывает ход уже идущего запуска.
+    """
+    model = Mailing
 
-        # Получаем результат
-        result = out.getvalue()
+    def post(self, request, *args, **kwargs):
+        mailing = self.get_object()
+        key = request.POST.get('launch_key') or uuid.uuid4().hex
+        run = MailingRun.find(mailing.pk, key)
+        if run is not None:
+            messages.info(request, f'Рассылка #{mailing.id} уже запущена, показан ход запуска')
+            return redirect('mailing:mailing-run', pk=mailing.pk, run_pk=run.pk)
 
+        out = StringIO()
+        try:
+            call_command('start_mailing', str(mailing.pk), key=key, stdout=out)
+        except Exception as e:
+            messages.error(request, f'Ошибка запуска рассылки: {str(e)}')
+            return redirect('mailing:mailing', pk=mailing.pk)
+
+        run = MailingRun.find(mailing.pk, key)
+        if run is None:
+            # Команда не начала запуск (например, не время для рассылки) - показываем ее вывод
+            messages.warning(request, out.getvalue())
+            return redirect('mailing:mailing', pk=mailing.pk)
         messages.success(request, f'Рассылка #{mailing.id} запущена')
-        messages.info(request, result)
+        return redirect('mailing:mailing-run', pk=mailing.pk, run_pk=run.pk)
 
-    except Exception as e:
-        messages.error(request, f'Ошибка запуска рассылки: {str(e)}')
 
-    return redirect('mailing:mailing', pk=pk)
+class MailingRunDetail(OwnerOrManagerRequiredMixin, DetailView):
+    """Ход запуска рассылки"""
+    model = Mailing
+    template_name = 'mailing/mailing_run.html'
+    context_object_name = 'mailing'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['run'] = get_object_or_404(self.object.runs, pk=self.kwargs['run_pk'])
+        return context
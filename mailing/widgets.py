@@ -0,0 +1,41 @@
+from django import forms
+from django.urls import reverse
+
+
+class AutocompleteMixin:
+    """Поле выбора с поиском на сервере.
+
+    В HTML попадают только выбранные значения, остальные варианты
+    static/js/autocomplete.js подгружает постранично по адресу url.
+    """
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    class Media:
+        js = ('js/autocomplete.js',)
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [pk for pk in value if str(pk).isdigit()]
+        options = []
+        if not self.allow_multiple_selected and not self.is_required:
+            options.append(self.create_option(name, '', '---------', not selected, 0))
+        if selected:
+            # Выбранные объекты - одним запросом, сколько бы их ни было в базе
+            for obj in self.choices.queryset.filter(pk__in=selected):
+                options.append(self.create_option(name, obj.pk, str(obj), True, len(options)))
+        return [(None, [option], option['index']) for option in options]
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    pass
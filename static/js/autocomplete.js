@@ -0,0 +1,131 @@
+/*
+ * Поиск на сервере для полей выбора с атрибутом data-autocomplete-url.
+ *
+ * Сервер отдает страницы вариантов: {"results": [{"id", "text"}], "pagination": {"more"}}.
+ * Выбранные значения хранятся в самом <select>, который скрывается и
+ * показывается как набор меток с кнопкой удаления.
+ */
+(function () {
+    'use strict';
+
+    var DEBOUNCE_MS = 250;
+
+    function init(select) {
+        var url = select.dataset.autocompleteUrl;
+        var multiple = select.multiple;
+        var term = '';
+        var page = 1;
+        var timer = null;
+        var request = 0;
+
+        var wrapper = document.createElement('div');
+        var chips = document.createElement('div');
+        chips.className = 'mb-2';
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control';
+        input.placeholder = select.getAttribute('placeholder') || 'Поиск';
+        input.autocomplete = 'off';
+        var results = document.createElement('div');
+        results.className = 'list-group mt-1';
+        var more = document.createElement('button');
+        more.type = 'button';
+        more.className = 'btn btn-sm btn-link';
+        more.textContent = 'Показать еще';
+        more.hidden = true;
+
+        wrapper.append(chips, input, results, more);
+        select.hidden = true;
+        select.after(wrapper);
+
+        function renderChips() {
+            chips.replaceChildren();
+            Array.from(select.selectedOptions).forEach(function (option) {
+                if (!option.value) {
+                    return;
+                }
+                var chip = document.createElement('span');
+                chip.className = 'badge bg-secondary me-1';
+                chip.textContent = option.textContent + ' ';
+                var remove = document.createElement('button');
+                remove.type = 'button';
+                remove.className = 'btn-close btn-close-white btn-sm';
+                remove.setAttribute('aria-label', 'Убрать');
+                remove.addEventListener('click', function () {
+                    option.remove();
+                    renderChips();
+                });
+                chip.append(remove);
+                chips.append(chip);
+            });
+        }
+
+        function choose(item) {
+            var value = String(item.id);
+            var option = Array.from(select.options).find(function (o) { return o.value === value; });
+            if (!multiple) {
+                Array.from(select.options).forEach(function (o) { o.selected = false; });
+            }
+            if (!option) {
+                option = new Option(item.text, value);
+                select.add(option);
+            }
+            option.selected = true;
+            renderChips();
+            if (!multiple) {
+                results.replaceChildren();
+                more.hidden = true;
+                input.value = '';
+            }
+        }
+
+        function load(append) {
+            var current = ++request;
+            var params = new URLSearchParams({term: term, page: page});
+            fetch(url + '?' + params, {credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    // Ответ на устаревший запрос не показываем
+                    if (current !== request) {
+                        return;
+                    }
+                    if (!append) {
+                        results.replaceChildren();
+                    }
+                    (data.results || []).forEach(function (item) {
+                        var button = document.createElement('button');
+                        button.type = 'button';
+                        button.className = 'list-group-item list-group-item-action';
+                        button.textContent = item.text;
+                        button.addEventListener('click', function () { choose(item); });
+                        results.append(button);
+                    });
+                    more.hidden = !(data.pagination && data.pagination.more);
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                term = input.value.trim();
+                page = 1;
+                load(false);
+            }, DEBOUNCE_MS);
+        });
+        input.addEventListener('focus', function () {
+            if (!results.children.length) {
+                load(false);
+            }
+        });
+        more.addEventListener('click', function () {
+            page += 1;
+            load(true);
+        });
+
+        renderChips();
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(init);
+    });
+})();
@@ -0,0 +1,33 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+
+from user.roles import aload_user_roles, load_user_roles
+
+
+class UserRolesMiddleware:
+    """Определяет роли пользователя один раз за запрос и кладет их в request.user.roles"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user = request.user
+        if user.is_authenticated:
+            user.roles = SimpleLazyObject(lambda: load_user_roles(user))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Под ASGI ленивую загрузку использовать нельзя: синхронный запрос к БД
+        # из event loop запрещен, поэтому роли загружаем сразу
+        user = await request.auser()
+        if user.is_authenticated:
+            user.roles = await aload_user_roles(user)
+        # request.user и request.auser() кешируют разные объекты, оставляем один
+        request.user = user
+        return await self.get_response(request)
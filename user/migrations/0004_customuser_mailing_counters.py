@@ -0,0 +1,50 @@
+# Generated by Django 6.0 on 2026-10-19 11:58
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_mailing_counters(apps, schema_editor):
+    CustomUser = apps.get_model('user', 'CustomUser')
+    Mailing = apps.get_model('mailing', 'Mailing')
+
+    def count_for(**filters):
+        return Coalesce(
+            Subquery(
+                Mailing.objects.filter(owner=OuterRef('pk'), **filters)
+                .order_by()
+                .values('owner')
+                .annotate(total=Count('pk'))
+                .values('total'),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        )
+
+    CustomUser.objects.update(
+        mailing_count=count_for(),
+        active_mailing_count=count_for(status='Запущена'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_customuser_messages_count_and_more'),
+        ('mailing', '0008_alter_mailing_options_alter_mailingattempt_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='active_mailing_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество активных рассылок'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='mailing_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество рассылок'),
+        ),
+        migrations.RunPython(fill_mailing_counters, migrations.RunPython.noop),
+    ]
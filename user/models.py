@@ -25,6 +25,15 @@ class CustomUser(AbstractUser):
     successful_mailing_count = models.PositiveIntegerField(default=0, verbose_name='количество успешных рассылок')
     unsuccessful_mailing_count = models.PositiveIntegerField(default=0, verbose_name='количество неуспешных рассылок')
     messages_count = models.PositiveIntegerField(default=0, verbose_name='количество отправленных сообщений')
+    # Денормализованные счетчики рассылок, поддерживаются сигналами приложения mailing
+    mailing_count = models.PositiveIntegerField(default=0, verbose_name='количество рассылок')
+    active_mailing_count = models.PositiveIntegerField(default=0, verbose_name='количество активных рассылок')
+
+    # Счетчики меняются только UPDATE с F() (сигналы и команда start_mailing), обычное сохранение их не пишет
+    COUNTER_FIELDS = (
+        'successful_mailing_count', 'unsuccessful_mailing_count', 'messages_count',
+        'mailing_count', 'active_mailing_count',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -32,6 +41,16 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return f"{self.email}, {self.first_name}, {self.last_name}"
 
+    def save(self, *args, **kwargs):
+        # Профиль, админка и allauth сохраняют пользователя целиком; значения счетчиков
+        # в памяти к этому времени могут устареть, поэтому обновляем все поля, кроме них
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "пользователь"
         verbose_name_plural = "пользователи"
@@ -0,0 +1,70 @@
+from django.core.cache import cache
+
+MANAGERS_GROUP = 'Менеджеры'
+USERS_GROUP = 'Пользователи'
+
+# Время жизни ролей в кеше (секунды). В памяти процесса их держит
+# локальный уровень кеша, см. политику user_roles_ в настройках CACHES
+SHARED_ROLES_TTL = 60 * 10
+
+
+def roles_cache_key(user_id):
+    return f"user_roles_{user_id}"
+
+
+def get_user_roles(user):
+    """Возвращает множество названий групп пользователя.
+
+    Сначала смотрим в кеш (память процесса, затем Redis), и только потом в БД.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, 'roles', None)
+    if roles is not None:
+        return roles
+    return load_user_roles(user)
+
+
+def load_user_roles(user):
+    """Загружает роли пользователя, минуя атрибут user.roles"""
+    cache_key = roles_cache_key(user.pk)
+    roles = cache.get(cache_key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(cache_key, roles, SHARED_ROLES_TTL)
+    return roles
+
+
+async def aget_user_roles(user):
+    """Асинхронный вариант get_user_roles для async view"""
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, 'roles', None)
+    # type(), а не isinstance: isinstance вычислил бы ленивый объект синхронно
+    if type(roles) is frozenset:
+        return roles
+    user.roles = await aload_user_roles(user)
+    return user.roles
+
+
+async def aload_user_roles(user):
+    """Асинхронный вариант load_user_roles"""
+    cache_key = roles_cache_key(user.pk)
+    roles = await cache.aget(cache_key)
+    if roles is None:
+        roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        await cache.aset(cache_key, roles, SHARED_ROLES_TTL)
+    return roles
+
+
+def user_has_role(user, role):
+    return role in get_user_roles(user)
+
+
+def invalidate_user_roles(*user_ids):
+    """Сбрасывает закешированные роли пользователей во всех процессах"""
+    if not user_ids:
+        return
+    cache.delete_many([roles_cache_key(user_id) for user_id in user_ids])
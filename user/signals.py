@@ -0,0 +1,30 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from user.models import CustomUser
+from user.roles import invalidate_user_roles
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def reset_roles_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кеш ролей при изменении состава групп"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        # Изменились группы конкретного пользователя
+        invalidate_user_roles(instance.pk)
+    elif action == 'pre_clear':
+        # Группа очищается целиком - сбрасываем всех ее участников
+        invalidate_user_roles(*instance.user_set.values_list('pk', flat=True))
+    else:
+        invalidate_user_roles(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def reset_roles_on_group_change(sender, instance, **kwargs):
+    """Сбрасывает кеш ролей при переименовании или удалении группы"""
+    if instance.pk:
+        invalidate_user_roles(*instance.user_set.values_list('pk', flat=True))
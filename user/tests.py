@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from mailing.models import Mailing, Message
+from user.models import CustomUser
+from user.roles import MANAGERS_GROUP, get_user_roles, invalidate_user_roles
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UserRolesQueryTestCase(TestCase):
+    """Роли пользователя читаются из БД один раз и сбрасываются при смене групп"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='user@example.com', username='user', password='x')
+        cls.managers = Group.objects.create(name=MANAGERS_GROUP)
+
+    def setUp(self):
+        cache.clear()
+        invalidate_user_roles(self.user.pk)
+
+    def test_roles_are_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_roles(self.user), frozenset())
+        with self.assertNumQueries(0):
+            get_user_roles(CustomUser(pk=self.user.pk))
+
+    def test_roles_are_invalidated_on_group_change(self):
+        get_user_roles(self.user)
+        self.user.groups.add(self.managers)
+        self.assertIn(MANAGERS_GROUP, get_user_roles(CustomUser(pk=self.user.pk)))
+
+
+# Кеш проекта без Redis: после первых ошибок переходит на память процесса, delete_pattern работает
+@override_settings(CACHES={'default': {
+    'BACKEND': 'djangocourseproject.cache.backends.ResilientRedisCache',
+    'LOCATION': 'redis://127.0.0.1:9/0',
+    'OPTIONS': {'socket_connect_timeout': 0.05, 'CIRCUIT': {'FAILURE_THRESHOLD': 1, 'RESET_TIMEOUT': 60}},
+}})
+class UserCountersTestCase(TestCase):
+    """Сохранение пользователя и его блокировка не перезаписывают счетчики рассылок"""
+
+    def test_counters_survive_save_and_block(self):
+        manager = CustomUser.objects.create_user(email='manager@example.com', username='manager', password='x')
+        manager.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+        user = CustomUser.objects.create_user(email='user@example.com', username='user', password='x')
+        stale = CustomUser.objects.get(pk=user.pk)
+        now = timezone.now()
+        message = Message.objects.create(topic='Тема', text='Текст', owner=user)
+        for _ in range(2):
+            Mailing.objects.create(
+                start_time=now - timedelta(hours=1), end_time=now + timedelta(days=1),
+                status=Mailing.Status.RUNNING, message=message, owner=user,
+            )
+
+        # Профиль сохраняется из объекта, загруженного до создания рассылок
+        stale.country = 'Россия'
+        stale.save()
+        user.refresh_from_db()
+        self.assertEqual((user.country, user.mailing_count, user.active_mailing_count), ('Россия', 2, 2))
+
+        self.client.force_login(manager)
+        self.client.post(reverse('mailing:user_toggle_block', args=[user.pk]))
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertEqual((user.mailing_count, user.active_mailing_count), (2, 0))
+        self.assertFalse(Mailing.objects.filter(owner=user).exclude(status=Mailing.Status.BLOCKED).exists())